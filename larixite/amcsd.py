@@ -23,32 +23,55 @@ And the answers are that there are simple methods for:
 
 import sys
 import os
-import re
 import time
 import json
-from io import StringIO
+import hashlib
+import tarfile
+import asyncio
+import threading
+import zipfile
+from io import StringIO, BytesIO
+from functools import wraps, partial
 from string import ascii_letters
 from base64 import b64encode, b64decode
 from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from typing import Union
-from pathlib import Path
+from pathlib import Path, PurePosixPath
 import requests
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 import atexit
 import numpy as np
 
-from sqlalchemy import MetaData, create_engine, func, text, and_, Table
+from sqlalchemy import (create_engine, func, text, and_, or_,
+                        Table, cast, Float)
 from sqlalchemy import __version__ as sqla_version
 from sqlalchemy.sql import select as sqla_select
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, scoped_session, Session
+from sqlalchemy.exc import OperationalError
 
 from xraydb.chemparser import chemparse
 from xraydb import f0, f1_chantler, f2_chantler
 
-from .amcsd_utils import (make_engine, isAMCSD, put_optarray, get_optarray,
-                          PMG_CIF_OPTS, CifParser, SpacegroupAnalyzer, pmg_version)
-
-from .physical_constants import TAU, ATOM_SYMS
+from .amcsd_utils import (make_engine, MMAP_SIZE, get_metadata, schema_fingerprint, isAMCSD,
+                          put_optarray, get_optarray, get_optfarray,
+                          PMG_CIF_OPTS, CifParser, SpacegroupAnalyzer, pmg_version,
+                          PMGSpaceGroup,
+                          ELEM_INDEX, elements_bitmask, build_elements_bitmasks,
+                          SCHEMA_V2_TAG, CIF_FLOATCOLUMNS, cif_float,
+                          textindex_schema, textindex_insert, fts_quote,
+                          is_wildcard, wildcard_pattern, spacegroup_number,
+                          centering_vectors, niggli_cell, cell_distances,
+                          build_composition_matrix, composition_vector, parse_ratio,
+                          DESCRIPTOR_RANGES, DESCRIPTOR_FLAGS, descriptors_schema,
+                          cif_descriptors, Structure, structure_cache_schema,
+                          pack_structure, unpack_structure,
+                          compile_symmetry_ops, build_structure, manifest_schema,
+                          fingerprint_schema, structure_fingerprint,
+                          read_cif_block, site_symbol, COLUMNAR_SITES,
+                          save_columnar, load_columnar, LRUCache)
+
+from .physical_constants import TAU
 from .utils import isotime, mkdir, version_ge, bytes2str, user_folder
 from .xrd_utils import generate_hkl, hkl2d, q2twotheta, wavelength2energy
 
@@ -71,6 +94,9 @@ CIF_TEXTCOLUMNS = ('formula', 'compound', 'pub_title', 'formula_title', 'a',
                    'atoms_aniso_u23', 'qdat','url', 'hkls')
 
 
+# authors of a publication are listed in the order they were added
+PUBAUTH_ORDER = text('publication_authors.rowid')
+
 CifPublication = namedtuple('CifPublication', ('id', 'journalname', 'year',
                                             'volume', 'page_first',
                                             'page_last', 'authors'))
@@ -148,6 +174,23 @@ def select(*args):
         return sqla_select(tuple(args))
 
 
+# orderings for AMCSD.iter_cifs(): CIF id, mineral name, publication year,
+# journal name, or cell parameters
+FIND_ORDERS = ('id', 'mineral', 'year', 'journal') + CIF_FLOATCOLUMNS
+
+def id_chunks(ids, size=500):
+    "split a sequence of ids into lists of at most size ids, for IN clauses"
+    ids = list(ids)
+    for i in range(0, len(ids), size):
+        yield ids[i:i+size]
+
+
+def cif_value(val):
+    "value for CIF text, with '?' for NaN"
+    if isinstance(val, float) and np.isnan(val):
+        return '?'
+    return val
+
 def get_nonzero(thing):
     try:
         if len(thing) == 1 and abs(thing[0]) < 1.e-5:
@@ -161,8 +204,9 @@ def clean_elemsym(sym):
     return ''.join([s.strip() for s in sx if s in ascii_letters])
 
 
-def parse_cif_file(filename):
-    """parse ciffile, extract data for 1st listed structure,
+def parse_cif_file(filename, block=0):
+    """parse ciffile, extract data for one data block (by default,
+    the 1st listed structure), reading only that block of the file,
     and do some basic checks:
         must have formula
         must have spacegroup
@@ -171,7 +215,7 @@ def parse_cif_file(filename):
     if CifParser is None:
         raise ValueError("CifParser from pymatgen not available. Try 'pip install pymatgen'.")
 
-    cif = CifParser(filename, **PMG_CIF_OPTS)
+    cif = CifParser.from_str(read_cif_block(filename, block), **PMG_CIF_OPTS)
     cifkey = list(cif._cif.data.keys())[0]
     dat = cif._cif.data[cifkey].data
 
@@ -212,9 +256,206 @@ def parse_cif_file(filename):
     return dat, formula, symm_xyz
 
 
+def read_ciffile(filename, block=0):
+    """read a CIF file with parse_cif_file(), and return a dict of the
+    values needed to add it to the database, see AMCSD.add_ciffile().
+    This does not use the database, and can be run in worker processes.
+    """
+    try:
+        dat, formula, symm_xyz = parse_cif_file(filename, block=block)
+    except:
+        raise ValueError(f"unknown error trying to parse CIF file: {filename}")
+
+    # compound
+    compound = '<missing>'
+    for compname in ('_chemical_compound_source',
+                     '_chemical_name_systematic',
+                     '_chemical_name_common'):
+        if compname in dat:
+            compound = dat[compname]
+
+    # spacegroup
+    sgroup_name = dat.get('_symmetry_space_group_name_H-M', None)
+    if sgroup_name is None:
+        for key, val in dat.items():
+            if 'space_group' in key and 'H-M' in key:
+                sgroup_name = val
+
+    min_name = '<missing>'
+    for mname in ('_chemical_name_mineral',
+                   '_chemical_name_common'):
+        if mname in dat:
+            min_name = dat[mname]
+
+    # get publication data (including ISCD style of 'citation' in place of 'journal' )
+    pubdict = dict(journalname=dat.get('_journal_name_full', None),
+                   year=dat.get('_journal_year', None),
+                   volume=dat.get('_journal_volume', None),
+                   page_first=dat.get('_journal_page_first', None),
+                   page_last=dat.get('_journal_page_last', None))
+
+    for key, alt, dval in (('journalname', 'journal_full', 'No Journal'),
+                           ('year', None, -1),
+                           ('volume', 'journal_volume', 0),
+                           ('page_first', None, 0),
+                           ('page_last', None, 0)):
+        if pubdict[key] is None:
+            if alt is None:
+                alt = key
+            alt = '_citation_%s' % alt
+            pubdict[key] = dat.get(alt, [dval])[0]
+    authors = dat.get('_publ_author_name', None)
+    if authors is None:
+        authors = dat.get('_citation_author_name', ['Anonymous'])
+    if isinstance(authors, str):
+        authors = [authors]
+
+    density = dat.get('_exptl_crystal_density_meas', None)
+    if density is None:
+        density = dat.get('_exptl_crystal_density_diffrn', -1.0)
+
+    cif_id = dat.get('_database_code_amcsd', None)
+    if cif_id is None:
+        cif_id = dat.get('_cod_database_code', None)
+
+    cifdata = dict(formula=formula, compound=compound,
+                   formula_title=dat.get('_amcsd_formula_title', '<missing>'),
+                   pub_title=dat.get('_publ_section_title', '<missing>'),
+                   atoms_sites=json.dumps(dat['_atom_site_label']),
+                   atoms_x=put_optarray(dat, '_atom_site_fract_x'),
+                   atoms_y=put_optarray(dat, '_atom_site_fract_y'),
+                   atoms_z=put_optarray(dat, '_atom_site_fract_z'),
+                   atoms_occupancy=put_optarray(dat, '_atom_site_occupancy'),
+                   atoms_u_iso=put_optarray(dat, '_atom_site_U_iso_or_equiv'),
+                   atoms_aniso_label=json.dumps(dat.get('_atom_site_aniso_label', '<missing>')),
+                   atoms_aniso_u11=put_optarray(dat, '_atom_site_aniso_U_11'),
+                   atoms_aniso_u22=put_optarray(dat, '_atom_site_aniso_U_22'),
+                   atoms_aniso_u33=put_optarray(dat, '_atom_site_aniso_U_33'),
+                   atoms_aniso_u12=put_optarray(dat, '_atom_site_aniso_U_12'),
+                   atoms_aniso_u13=put_optarray(dat, '_atom_site_aniso_U_13'),
+                   atoms_aniso_u23=put_optarray(dat, '_atom_site_aniso_U_23'),
+                   a=dat['_cell_length_a'],
+                   b=dat['_cell_length_b'],
+                   c=dat['_cell_length_c'],
+                   alpha=dat['_cell_angle_alpha'],
+                   beta=dat['_cell_angle_beta'],
+                   gamma=dat['_cell_angle_gamma'],
+                   cell_volume=dat.get('_cell_volume', -1),
+                   crystal_density=density)
+
+    return dict(cif_id=cif_id, spacegroup=sgroup_name, symmetry_xyz=symm_xyz,
+                mineral=min_name, publication=pubdict, authors=list(authors),
+                cifdata=cifdata)
+
+
+class DuplicateCIFError(ValueError):
+    "CIF with the structural fingerprint of a CIF in the database"
+
+
+def cif_fingerprint(symmetry_xyz, a=None, b=None, c=None, alpha=None,
+                    beta=None, gamma=None, atoms_sites=None, atoms_x=None,
+                    atoms_y=None, atoms_z=None, atoms_occupancy=None, **kws):
+    """structure_fingerprint() for values as stored in the cif table,
+    or from read_ciffile()"""
+    cell = [cif_float(val) for val in (a, b, c, alpha, beta, gamma)]
+    if None in cell:
+        raise ValueError("undefined unit cell")
+    labels = json.loads(atoms_sites)
+    fcoords = np.array([get_optfarray(atoms_x), get_optfarray(atoms_y),
+                        get_optfarray(atoms_z)]).T
+    return structure_fingerprint(cell, symmetry_xyz, labels, fcoords,
+                                 occupancy=get_optfarray(atoms_occupancy))
+
+
+def _read_ciffile_task(filename):
+    "read_ciffile() for worker processes: returns filename, record, error"
+    try:
+        return filename, read_ciffile(filename), None
+    except Exception as exc:
+        return filename, None, f"{exc.__class__.__name__}: {exc}"
+
+
+def _render_cif_task(cif):
+    """CIF text for export_cifs() in worker processes, for a CifStructure
+    with its publication, mineral and spacegroup already looked up:
+    returns CIF id, archive entry name, encoded text, error"""
+    try:
+        name = cif.label.replace('/', '_').replace(' ', '_') + '.cif'
+        return cif.ams_id, name, cif.ciftext.encode('utf-8'), None
+    except Exception as exc:
+        return cif.ams_id, None, None, f"{exc.__class__.__name__}: {exc}"
+
+
+ATOM_ARRAYS = ('atoms_x', 'atoms_y', 'atoms_z', 'atoms_occupancy',
+               'atoms_u_iso', 'atoms_aniso_u11', 'atoms_aniso_u22',
+               'atoms_aniso_u33', 'atoms_aniso_u12', 'atoms_aniso_u13',
+               'atoms_aniso_u23')
+
+CifSummary = namedtuple('CifSummary', ('ams_id', 'formula', 'mineral',
+                                       'year', 'journal'))
+
+def mineral_label(name, formula_title):
+    "mineral name for display, falling back to formula title"
+    if name in (None, '<missing>'):
+        name = formula_title
+    if name in (None, '<missing>'):
+        name = 'missing'
+    return name
+
+
+class _LazyAttr():
+    """attribute of CifStructure that is built on first access by
+    CifStructure._load(), and then held in slot '_<name>'"""
+    def __set_name__(self, owner, name):
+        self.name = name
+        self.slot = '_' + name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        val = getattr(obj, self.slot, _LazyAttr)
+        if val is _LazyAttr:
+            val = obj._load(self.name)
+            setattr(obj, self.slot, val)
+        return val
+
+    def __set__(self, obj, value):
+        setattr(obj, self.slot, value)
+
+
 class CifStructure():
     """representation of a Cif Structure
+
+    When built from a row of the cif table (as by AMCSD.get_cifs()), the
+    atom site arrays, publication, mineral, and spacegroup are decoded or
+    looked up only when first used.
     """
+    __slots__ = ('ams_id', 'ams_db', 'formula_title', 'compound', 'formula',
+                 'pub_title', 'a', 'b', 'c', 'alpha', 'beta', 'gamma',
+                 'cell_volume', 'crystal_density', 'hkls', 'pmg_pstruct',
+                 'pmg_cstruct', '_ciftext', '_row', '_as_strings',
+                 '_publication', '_mineral', '_spacegroup', '_hm_symbol',
+                 '_natoms', '_atoms_sites', '_atoms_aniso_label') + tuple(
+                     f'_{attr}' for attr in ATOM_ARRAYS)
+
+    publication = _LazyAttr()
+    mineral = _LazyAttr()
+    spacegroup = _LazyAttr()
+    hm_symbol = _LazyAttr()
+    natoms = _LazyAttr()
+    atoms_sites = _LazyAttr()
+    atoms_aniso_label = _LazyAttr()
+    atoms_x = _LazyAttr()
+    atoms_y = _LazyAttr()
+    atoms_z = _LazyAttr()
+    atoms_occupancy = _LazyAttr()
+    atoms_u_iso = _LazyAttr()
+    atoms_aniso_u11 = _LazyAttr()
+    atoms_aniso_u22 = _LazyAttr()
+    atoms_aniso_u33 = _LazyAttr()
+    atoms_aniso_u12 = _LazyAttr()
+    atoms_aniso_u13 = _LazyAttr()
+    atoms_aniso_u23 = _LazyAttr()
 
     def __init__(self, ams_id=None, ams_db=None, publication=None, mineral=None,
                  spacegroup=None, hm_symbol=None, formula_title=None,
@@ -230,10 +471,13 @@ class CifStructure():
 
         self.ams_id = ams_id
         self.ams_db = ams_db
+        self._row = None
+        self._as_strings = False
         self.publication = publication
         self.mineral = mineral
         self.spacegroup = spacegroup
-        self.hm_symbol = hm_symbol
+        if hm_symbol is not None or spacegroup is None:
+            self.hm_symbol = hm_symbol
         self.formula_title = formula_title
         self.compound = compound
         self.formula = formula
@@ -260,12 +504,82 @@ class CifStructure():
         self.atoms_aniso_u12 = get_nonzero(atoms_aniso_u12)
         self.atoms_aniso_u13 = get_nonzero(atoms_aniso_u13)
         self.atoms_aniso_u23 = get_nonzero(atoms_aniso_u23)
-        self.natoms = 0
         self._ciftext = None
         self.pmg_pstruct = None
         self.pmg_cstruct = None
-        if atoms_sites not in (None, '<missing>'):
-            self.natoms = len(atoms_sites)
+
+    @classmethod
+    def from_row(cls, row, ams_db=None, as_strings=False):
+        """Cif Structure for a row of the cif table, with atom sites,
+        publication, mineral, and spacegroup left to be loaded on first use"""
+        out = cls.__new__(cls)
+        out.ams_id = row.id
+        out.ams_db = ams_db
+        out._row = row
+        out._as_strings = as_strings
+        out._ciftext = None
+        out.pmg_pstruct = None
+        out.pmg_cstruct = None
+
+        for attr in ('formula_title', 'compound', 'formula', 'pub_title'):
+            setattr(out, attr, getattr(row, attr, '<missing>'))
+        schema_version = 1 if ams_db is None else ams_db.schema_version
+        for attr in CIF_FLOATCOLUMNS:
+            val = getattr(row, attr, '-1')
+            if schema_version >= 2:
+                # schema v2: numeric columns are already stored as real
+                if as_strings and val is not None:
+                    val = str(val)
+            elif not as_strings and val is not None:
+                fval = cif_float(val)
+                if fval is not None:
+                    val = fval
+            setattr(out, attr, val)
+        out.hkls = getattr(row, 'hkls', None)
+        return out
+
+    def _load(self, name):
+        "build a lazy attribute from the cif row"
+        row, db = self._row, self.ams_db
+        if name == 'natoms':
+            sites = self.atoms_sites
+            return 0 if sites in (None, '<missing>') else len(sites)
+        if name == 'hm_symbol':
+            sgroup = self.spacegroup
+            return None if sgroup is None else sgroup.hm_notation.split('%var')[0]
+        if row is None:
+            return '<missing>' if name in ('atoms_sites', 'atoms_aniso_label') else None
+        if name in ('atoms_sites', 'atoms_aniso_label'):
+            val = getattr(row, name, '<missing>')
+            return '<missing>' if val in (None, '<missing>') else json.loads(val)
+        if name in ATOM_ARRAYS:
+            if self.atoms_sites in (None, '<missing>'):
+                return None
+            val = getattr(row, name, '0')
+            try:
+                if self._as_strings:
+                    val = get_optarray(val)
+                    return None if val == '0' else val
+                return get_optfarray(val)
+            except:
+                print(f"could not parse CIF entry for {self.ams_id} '{name}': {val} ")
+                return None
+        if db is None:
+            return None
+        if name == 'publication':
+            return db.get_cif_publication(row.publication_id)
+        if name == 'mineral':
+            return db.get_row_by_id('minerals', row.mineral_id)
+        if name == 'spacegroup':
+            return db.get_row_by_id('spacegroups', row.spacegroup_id)
+        return None
+
+    def summary(self):
+        "CifSummary of id, formula, mineral name, publication year, and journal"
+        pub = self.publication
+        return CifSummary(self.ams_id, self.formula, self.get_mineralname(),
+                          None if pub is None else pub.year,
+                          None if pub is None else pub.journalname)
 
     def __repr__(self):
         if self.ams_id is None or self.formula is None:
@@ -273,12 +587,9 @@ class CifStructure():
         return f'<CifStructure, ams_id={self.ams_id}, formula={self.formula:s}>'
 
     def get_mineralname(self):
-        minname = self.mineral.name
-        if minname == '<missing>':
-            minname =self.formula_title
-        if minname == '<missing>':
-            minname = 'missing'
-        return minname
+        mineral = self.mineral
+        return mineral_label(None if mineral is None else mineral.name,
+                             self.formula_title)
 
 
     @property
@@ -344,11 +655,12 @@ class CifStructure():
             if atoms_u_iso is not None:
                 out.append('_atom_site_U_iso_or_equiv')
             for i in range(natoms):
-                adat = f"{atoms_sites[i]}   {atoms_x[i]}  {atoms_y[i]}  {atoms_z[i]}"
+                adat = (f"{atoms_sites[i]}   {cif_value(atoms_x[i])}  "
+                        f"{cif_value(atoms_y[i])}  {cif_value(atoms_z[i])}")
                 if atoms_occ is not None:
-                    adat +=  f"  {atoms_occ[i]}"
+                    adat +=  f"  {cif_value(atoms_occ[i])}"
                 if atoms_u_iso is not None:
-                    adat +=  f"  {atoms_u_iso[i]}"
+                    adat +=  f"  {cif_value(atoms_u_iso[i])}"
                 out.append(adat)
 
             aniso_label = self.atoms_aniso_label
@@ -370,7 +682,8 @@ class CifStructure():
                 u23 = self.atoms_aniso_u23
 
                 for i in range(natoms):
-                    out.append(f"{aniso_label[i]}   {u11[i]}  {u22[i]}  {u33[i]}  {u12[i]}  {u13[i]}  {u23[i]}")
+                    uvals = '  '.join(f"{cif_value(u[i])}" for u in (u11, u22, u33, u12, u13, u23))
+                    out.append(f"{aniso_label[i]}   {uvals}")
 
         out.append('')
         out.append('')
@@ -573,19 +886,65 @@ class CifStructure():
         return f2
 
 
-    def get_pmg_struct(self):
-        if self.pmg_cstruct is not None and self.pmg_pstruct is not None:
-            return
-        err = f"pymatgen {pmg_version} could not"
+    def to_structure(self):
+        """pymatgen Structure for the CIF, built directly from the atom
+        sites and the compiled symmetry operations of the spacegroup.
+        This gives the same structure as parse_structure(), without
+        writing and parsing CIF text.
+
+        Raises ValueError if the structure cannot be built."""
+        atoms_sites = self.atoms_sites
+        if atoms_sites in (None, 'None', '0', '<missing>'):
+            raise ValueError(f"no atom sites for CIF {self.ams_id}")
+        if self.ams_db is not None and self._row is not None:
+            rots, trans = self.ams_db.get_symmetry_ops(self._row.spacegroup_id)
+        else:
+            rots, trans = compile_symmetry_ops(self.spacegroup.symmetry_xyz)
+
+        def farray(vals):
+            return np.array([np.nan if v is None else v for v in map(cif_float, vals)])
+
+        cell = [cif_float(getattr(self, attr)) for attr in
+                ('a', 'b', 'c', 'alpha', 'beta', 'gamma')]
+        if None in cell:
+            raise ValueError(f"undefined unit cell for CIF {self.ams_id}")
+        fcoords = np.array([farray(self.atoms_x), farray(self.atoms_y),
+                            farray(self.atoms_z)]).T
+        occupancy = self.atoms_occupancy
+        if occupancy is not None:
+            occupancy = farray(occupancy)
+        return build_structure(cell, rots, trans, atoms_sites, fcoords,
+                               occupancy=occupancy)
+
+    def parse_structure(self):
+        "pymatgen Structure from parsing ciftext with CifParser, or None"
         try:
             pmcif = CifParser(StringIO(self.ciftext), **PMG_CIF_OPTS)
+            return pmcif.parse_structures(primitive=False)[0]
         except:
-            print(f"{err} parse CIF text for CIF {self.ams_id}")
+            return None
 
+    def get_pmg_struct(self, use_cache=True):
+        """build pymatgen structures pmg_cstruct (as parsed from ciftext) and
+        pmg_pstruct (conventional standard structure).  If the database has
+        a structure cache (see AMCSD.build_structure_cache()), structures are
+        read from it, or parsed and then saved to it."""
+        if self.pmg_cstruct is not None and self.pmg_pstruct is not None:
+            return
+        db = self.ams_db
+        use_cache = use_cache and db is not None and self.ams_id is not None
+        if use_cache:
+            cached = db.get_cached_structures(self.ams_id)
+            if cached is not None:
+                self.pmg_cstruct, self.pmg_pstruct = cached
+                return
+        err = f"pymatgen {pmg_version} could not"
         try:
-            self.pmg_cstruct = pmcif.parse_structures(primitive=False)[0]
+            self.pmg_cstruct = self.to_structure()
         except:
-            print(f"{err} parse structure for CIF {self.ams_id}")
+            self.pmg_cstruct = self.parse_structure()
+            if self.pmg_cstruct is None:
+                print(f"{err} parse structure for CIF {self.ams_id}")
 
         try:
             self.pmg_pstruct = SpacegroupAnalyzer(self.pmg_cstruct
@@ -593,6 +952,9 @@ class CifStructure():
         except:
             print(f"{err} could not analyze spacegroup for CIF {self.ams_id}")
 
+        if use_cache and self.pmg_pstruct is not None:
+            db.cache_structures(self.ams_id, self.pmg_cstruct, self.pmg_pstruct)
+
     def get_unitcell(self):
         "unitcell as dict, from PMG structure"
         self.get_pmg_struct()
@@ -638,15 +1000,70 @@ class CifStructure():
         return sites
 
 
+def search_key(**criteria):
+    """hashable key for find_cifs() criteria, for the cache of search
+    results: names are lower case, lists of elements are sorted, and
+    dicts and lists are made into tuples"""
+    def freeze(val):
+        if isinstance(val, dict):
+            return tuple(sorted((k, freeze(v)) for k, v in val.items()))
+        if isinstance(val, (list, tuple)):
+            return tuple(freeze(v) for v in val)
+        return val
+    key = []
+    for name, val in sorted(criteria.items()):
+        if val is None:
+            continue
+        if name in ('mineral_name', 'author_name', 'journal_name'):
+            val = val.strip().lower()
+        elif name in ('contains_elements', 'excludes_elements'):
+            val = tuple(sorted(set(val)))
+        key.append((name, freeze(val)))
+    return tuple(key)
+
+
+class _ReadOnlySession(Session):
+    "session for read-only databases, with flush doing nothing"
+    def flush(self, *args, **kwargs):
+        return
+
+
+def _writer(method):
+    "run an AMCSD method that writes to the database holding its write lock"
+    @wraps(method)
+    def wrapper(self, *args, **kws):
+        with self.write_lock:
+            return method(self, *args, **kws)
+    return wrapper
+
+
 class AMCSD():
     """
     Database of CIF structure data from the American Mineralogical Crystal Structure Database
 
        http://rruff.geo.arizona.edu/AMS/amcsd.php
 
+    An AMCSD instance can be shared between threads: each thread uses its
+    own session and pooled connection, so that reading methods, including
+    get_cif(), get_cifs(), find_cifs(), iter_cifs(), and get_publications(),
+    can be called concurrently.  Methods that write to the database are
+    serialized by write_lock, so that there is a single writer at a time.
     """
-    def __init__(self, dbname=None, read_only=False):
-        "connect to an existing database"
+    def __init__(self, dbname=None, read_only=False, mmap_size=MMAP_SIZE,
+                 cif_cache_size=0, search_cache_size=0):
+        """connect to an existing database.
+
+        With read_only=True, the file is opened as immutable (see
+        make_engine()), for sharing one database file between processes,
+        and must not be changed while open.  mmap_size is the size in bytes
+        for memory-mapped I/O [MMAP_SIZE], or None for the sqlite default.
+        In a forked process, the database is opened again on first use.
+        For cif_cache_size and search_cache_size, see enable_caches().
+        """
+        self.read_only = read_only
+        self.mmap_size = mmap_size
+        self.write_lock = threading.RLock()
+        self.enable_caches(cif_cache_size, search_cache_size)
         if dbname is None:
             parent, _ = os.path.split(__file__)
             dbname = os.path.join(parent, AMCSD_TRIM)
@@ -659,35 +1076,105 @@ class AMCSD():
         self.connect(dbname, read_only=read_only)
         atexit.register(self.finalize_amcsd)
         ciftab = self.tables['cif']
-        for colname in CIF_TEXTCOLUMNS:
-            if colname not in ciftab.columns and not read_only:
+        missing = [col for col in CIF_TEXTCOLUMNS if col not in ciftab.columns]
+        if len(missing) > 0 and not read_only:
+            for colname in missing:
                 self.session.execute(text(f'alter table cif add column {colname} text'))
-                self.close()
-                self.connect(dbname, read_only=read_only)
-                time.sleep(0.1)
                 self.insert('version', tag=f'with {colname}', date=isotime(),
                             notes=f'added {colname} column to cif table')
+            schema_fingerprint(dbname, refresh=True)
+            self.metadata = get_metadata(self.engine, dbname)
+            self.tables = self.metadata.tables
+
+    def enable_caches(self, cif_cache_size=256, search_cache_size=64):
+        """set sizes of the least-recently-used caches of CIF Structures
+        returned by get_cif() and get_cifs(), which keep their CIF text and
+        pymatgen structures once made, and of results of find_cifs(), by
+        criteria.  A size of 0 disables a cache.  The caches are cleared by
+        inserts, updates, and deletes, and when the version table changes.
+        See cache_stats() for the hits and misses of each cache."""
+        self.cif_cache = LRUCache(cif_cache_size)
+        self.search_cache = LRUCache(search_cache_size)
+        self._cache_token = None
+
+    def cache_stats(self):
+        "dict of hits, misses, and sizes for the 'cifs' and 'searches' caches"
+        return {'cifs': self.cif_cache.stats(), 'searches': self.search_cache.stats()}
+
+    def _clear_caches(self):
+        "clear the caches of CIF Structures and find_cifs() results"
+        self.cif_cache.clear()
+        self.search_cache.clear()
+
+    def _check_caches(self):
+        "clear the caches of CIF Structures and searches if the version table changed"
+        vtab = self.tables['version']
+        token = tuple(self.execone(select(func.max(vtab.c.id), func.count(vtab.c.id))))
+        if token != self._cache_token:
+            self._clear_caches()
+            self._cache_token = token
 
     def finalize_amcsd(self):
         conn = getattr(self, 'conn', None)
-        if conn is not None:
+        if conn is not None and getattr(self, '_pid', None) == os.getpid():
             conn.close()
 
     def connect(self, dbname, read_only=False):
         self.dbname = dbname
-        self.engine = make_engine(dbname)
-        self.conn = self.engine.connect()
-        kwargs = {'bind': self.engine, 'autoflush': True, 'autocommit': False}
-        self.session = sessionmaker(**kwargs)()
-        if read_only:
-            def readonly_flush(*args, **kwargs):
-                return
-            self.session.flush = readonly_flush
+        self.read_only = read_only
+        self._open_engine()
+        self._inherited = None
 
-        self.metadata = MetaData()
-        self.metadata.reflect(bind=self.engine)
+        self.metadata = get_metadata(self.engine, dbname)
         self.tables = self.metadata.tables
         self.cif_elems = None
+        self.elem_masks = None
+        self.compositions = None
+        self.sg_numbers = None
+        self.cell_index = None
+        self.cell_index_fingerprint = None
+        self.row_cache = {}
+        self.pub_cache = {}
+        self.symmetry_ops = {}
+        self._in_batch = False
+        self._batch_textindex = False
+        self.schema_version = 1
+        vtab = self.tables['version']
+        if self.execone(select(vtab.c.tag).where(vtab.c.tag==SCHEMA_V2_TAG)) is not None:
+            self.schema_version = 2
+
+    def _open_engine(self):
+        """create engine, connection, and a registry of per-thread
+        sessions for the current process"""
+        self._pid = os.getpid()
+        self._engine = make_engine(self.dbname, read_only=self.read_only,
+                                   mmap_size=getattr(self, 'mmap_size', MMAP_SIZE))
+        self.conn = self._engine.connect()
+        kwargs = {'bind': self._engine, 'autoflush': True, 'autocommit': False}
+        if self.read_only:
+            kwargs['class_'] = _ReadOnlySession
+        self._session = scoped_session(sessionmaker(**kwargs))
+
+    def _check_process(self):
+        """open the database again after a fork(): connections made in the
+        parent process are dropped from the pool, and held without being
+        used or closed"""
+        if self._pid != os.getpid():
+            self._engine.dispose(close=False)
+            self._inherited = (self._engine, self.conn, self._session)
+            self._open_engine()
+
+    @property
+    def engine(self):
+        "sqlalchemy engine for the current process"
+        self._check_process()
+        return self._engine
+
+    @property
+    def session(self):
+        "sqlalchemy session for the current process and thread"
+        self._check_process()
+        return self._session()
 
     def close(self):
         "close session"
@@ -698,6 +1185,7 @@ class AMCSD():
         "generic query"
         return self.session.query(*args, **kws)
 
+    @_writer
     def insert(self, tablename, **kws):
         if isinstance(tablename, Table):
             table = tablename
@@ -705,25 +1193,79 @@ class AMCSD():
             table = self.tables[tablename]
         stmt = table.insert().values(kws)
         out = self.session.execute(stmt)
-        self.session.commit()
-        self.session.flush()
-
+        self._commit()
+        self.cell_index = None
+        self.row_cache = {}
+        self.pub_cache = {}
+        self._clear_caches()
+        pkey = out.inserted_primary_key
+        return pkey[0] if pkey else None
+
+    @_writer
     def update(self, tablename, whereclause=False, **kws):
         if isinstance(tablename, Table):
             table = tablename
         else:
             table = self.tables[tablename]
 
+        cif_ids = []
+        if table.name == 'cif':
+            cif_ids = [row[0] for row in self.execall(select(table.c.id).where(whereclause))]
         stmt = table.update().where(whereclause).values(kws)
         out = self.session.execute(stmt)
-        self.session.commit()
-        self.session.flush()
-
-    def execall(self, query):
-        return self.session.execute(query).fetchall()
-
-    def execone(self, query):
-        results = self.session.execute(query).fetchone()
+        if len(cif_ids) > 0:
+            self._refresh_cifs(cif_ids)
+        self._commit()
+        self.cell_index = None
+        self.row_cache = {}
+        self.pub_cache = {}
+        self._clear_caches()
+
+    def _refresh_cifs(self, cif_ids):
+        """drop cached structures for changed rows of the cif table, and
+        make their fingerprints, descriptors, and text index entries again"""
+        tab = self.tables['cif']
+        for tname in ('cif_structures', 'cif_fingerprints', 'cif_descriptors'):
+            if tname in self.tables:
+                dtab = self.tables[tname]
+                for chunk in id_chunks(cif_ids):
+                    self.session.execute(dtab.delete().where(dtab.c.cif_id.in_(chunk)))
+        for chunk in id_chunks(cif_ids):
+            rows = self.execall(tab.select().where(tab.c.id.in_(chunk)))
+            for row in rows:
+                if self.has_fingerprints():
+                    sgroup = self.get_row_by_id('spacegroups', row.spacegroup_id)
+                    try:
+                        fingerprint = cif_fingerprint(sgroup.symmetry_xyz, **row._asdict())
+                    except Exception:
+                        fingerprint = None
+                    if fingerprint is not None:
+                        self.session.execute(text('''INSERT OR IGNORE INTO cif_fingerprints
+                              (cif_id, fingerprint) VALUES (:id, :fp)'''),
+                              {'id': row.id, 'fp': fingerprint})
+                if self.has_descriptors():
+                    self.session.execute(self.tables['cif_descriptors'].insert().values(
+                        cif_id=row.id, **cif_descriptors(row.formula, row.atoms_sites,
+                              row.atoms_x, row.atoms_y, row.atoms_z, row.atoms_occupancy,
+                              row.atoms_aniso_label, row.atoms_aniso_u11)))
+        if self.has_textindex():
+            for chunk in id_chunks(cif_ids):
+                params = [{'id': cif_id} for cif_id in chunk]
+                self.session.execute(text('DELETE FROM cif_fts WHERE rowid = :id'), params)
+                self.session.execute(text(f'{textindex_insert} WHERE cif.id = :id'), params)
+
+    def _commit(self):
+        "commit and flush session, except while adding a batch of CIFs"
+        if not self._in_batch:
+            self.session.commit()
+            self.session.flush()
+            self._clear_caches()
+
+    def execall(self, query, params=None):
+        return self.session.execute(query, params).fetchall()
+
+    def execone(self, query, params=None):
+        results = self.session.execute(query, params).fetchone()
         if results is None or len(results) < 1:
             return None
         return results
@@ -758,6 +1300,7 @@ class AMCSD():
             out = f"AMCSD Version: {rows[0].tag}, Python Version: {__version__}"
         return out
 
+    @_writer
     def _get_tablerow(self, table, name, add=True):
         tab = self.tables[table]
         if '"' in name:
@@ -780,6 +1323,7 @@ class AMCSD():
         return None
 
 
+    @_writer
     def add_spacegroup(self, hm_name, symmetry_xyz, category=None):
         """add entry to spacegroups table, including HM notation and CIF symmetry operations
         """
@@ -790,9 +1334,166 @@ class AMCSD():
         args = {'hm_notation': hm_name, 'symmetry_xyz': symmetry_xyz}
         if category is not None:
             args['category'] = category
+        if 'number' in self.tables['spacegroups'].columns:
+            args['number'] = spacegroup_number(symmetry_xyz)
         self.insert('spacegroups', **args)
+        self.sg_numbers = None
         return self.get_spacegroup(hm_name)
 
+    def get_spacegroup_numbers(self):
+        """return dict of international space group numbers for all rows of the
+        spacegroups table, keyed by spacegroup id.  For databases without a
+        spacegroups.number column (see upgrade_amcsd()), these are determined
+        from the symmetry operations.
+        """
+        if self.sg_numbers is None:
+            tab = self.tables['spacegroups']
+            out = {}
+            if 'number' in tab.columns:
+                for row in self.execall(select(tab.c.id, tab.c.number)):
+                    out[row.id] = row.number
+            else:
+                for row in self.execall(select(tab.c.id, tab.c.symmetry_xyz)):
+                    out[row.id] = spacegroup_number(row.symmetry_xyz)
+            self.sg_numbers = out
+        return self.sg_numbers
+
+    def find_spacegroup_ids(self, spacegroup):
+        """return list of spacegroup ids for a space group, given as
+        international space group number or Hermann-Mauguin symbol,
+        such as 227, 'Fd-3m', or 'F d -3 m'.  Matching by number
+        includes all settings of a space group.
+        """
+        numbers = self.get_spacegroup_numbers()
+        number = None
+        if isinstance(spacegroup, (int, np.integer)):
+            number = int(spacegroup)
+        elif spacegroup.strip().isdigit():
+            number = int(spacegroup.strip())
+        else:
+            name = spacegroup.split('%var')[0].replace(' ', '').lower()
+            tab = self.tables['spacegroups']
+            sg_ids = [row.id for row in self.execall(select(tab.c.id, tab.c.hm_notation))
+                      if row.hm_notation.split('%var')[0].replace(' ', '').lower() == name]
+            sg_numbers = {numbers.get(sid, None) for sid in sg_ids} - {None}
+            if len(sg_ids) > 0:
+                if len(sg_numbers) == 1:
+                    number = sg_numbers.pop()
+                else:
+                    return sg_ids
+            elif PMGSpaceGroup is not None:
+                try:
+                    number = PMGSpaceGroup(spacegroup.strip()).int_number
+                except Exception:
+                    number = None
+        if number is None:
+            return []
+        return [sid for sid, num in numbers.items() if num == number]
+
+    def cell_fingerprint(self):
+        """return hash of the CIF ids, space groups, and cell parameters
+        used for the cell index, to check whether a saved index is current"""
+        sha = hashlib.sha1()
+        for query in ('select id, spacegroup_id, a, b, c, alpha, beta, gamma from cif order by id',
+                      'select id, symmetry_xyz from spacegroups order by id'):
+            for row in self.execall(text(query)):
+                sha.update(repr(tuple(row)).encode('utf-8'))
+        return sha.hexdigest()
+
+    def get_cell_index(self, filename=None):
+        """return (ids, cells) for the Niggli-reduced primitive unit cells of
+        all CIFs, with cells an array of shape (n, 6) holding a, b, c, alpha,
+        beta, gamma.  Cells that cannot be reduced are set to NaN.
+
+        If filename is given, the index is read from that .npz file when its
+        fingerprint (see cell_fingerprint()) matches the database, and
+        written to it otherwise.  The index held in memory is dropped on
+        inserts and updates, and when the database file is changed by
+        another connection.
+        """
+        # data_version only changes on commits by other connections, and
+        # is counted separately for each pooled connection, so it is kept
+        # in the info of the connection with the fingerprint it was seen with
+        conn = self.session.connection()
+        data_version = conn.exec_driver_sql('pragma data_version').scalar()
+        if (self.cell_index is not None and
+            conn.info.get('cell_index') == (self.cell_index_fingerprint, data_version)):
+            return self.cell_index
+
+        fingerprint = self.cell_fingerprint()
+        conn.info['cell_index'] = (fingerprint, data_version)
+        if self.cell_index is not None and self.cell_index_fingerprint == fingerprint:
+            return self.cell_index
+        self.cell_index_fingerprint = fingerprint
+        if filename is not None and Path(filename).exists():
+            try:
+                dat = np.load(filename)
+                if str(dat['fingerprint']) == fingerprint:
+                    self.cell_index = (dat['ids'], dat['cells'])
+                    return self.cell_index
+            except Exception:
+                pass
+
+        tab = self.tables['cif']
+        stab = self.tables['spacegroups']
+        centerings = {}
+        for row in self.execall(select(stab.c.id, stab.c.symmetry_xyz)):
+            try:
+                centerings[row.id] = centering_vectors(row.symmetry_xyz)
+            except Exception:
+                centerings[row.id] = None
+
+        rows = self.execall(select(tab.c.id, tab.c.spacegroup_id, tab.c.a,
+                                   tab.c.b, tab.c.c, tab.c.alpha, tab.c.beta,
+                                   tab.c.gamma).order_by(tab.c.id))
+        ids = np.array([row.id for row in rows], dtype=np.int64)
+        cells = np.full((len(rows), 6), np.nan)
+        for i, row in enumerate(rows):
+            params = [cif_float(x) for x in row[2:]]
+            if any(p is None or p <= 0 for p in params):
+                continue
+            try:
+                cells[i] = niggli_cell(*params, centering=centerings.get(row.spacegroup_id, None))
+            except Exception:
+                pass
+        self.cell_index = (ids, cells)
+        if filename is not None:
+            np.savez(filename, ids=ids, cells=cells, fingerprint=fingerprint)
+        return self.cell_index
+
+    def nearest_cells(self, a, b, c, alpha=90, beta=90, gamma=90, k=10,
+                      tol=None, centering='P', index_file=None):
+        """return list of CIF ids with unit cells nearest to the given cell,
+        best match first.
+
+        Args:
+            a, b, c, alpha, beta, gamma (float): cell lengths and angles (in degrees)
+            k (int): maximum number of ids to return [10]
+            tol (float or None): maximum cell distance [None, no limit]
+            centering (string): centering type of the cell ('P', 'A', 'B', 'C',
+                'I', 'F', 'R') ['P']
+            index_file (str or None): name of .npz file for the cell index
+
+        Notes:
+            cells are compared as Niggli-reduced primitive cells, with the
+            distance being the root-sum-square of the relative differences
+            of the cell lengths and the differences of cell angles in radians,
+            so that tol=0.01 is roughly a 1% mismatch.
+        """
+        ids, cells = self.get_cell_index(filename=index_file)
+        if len(ids) == 0:
+            return []
+        query = niggli_cell(a, b, c, alpha, beta, gamma, centering=centering)
+        dist = cell_distances(cells, query)
+        k = min(k, len(ids))
+        best = np.argpartition(dist, k-1)[:k]
+        best = best[np.argsort(dist[best], kind='stable')]
+        if tol is not None:
+            best = best[dist[best] <= tol]
+        else:
+            best = best[np.isfinite(dist[best])]
+        return [int(i) for i in ids[best]]
+
     def get_publications(self, journalname=None, year=None, volume=None,
                         page_first=None, page_last=None, id=None):
         """get rows from publications table by journalname, year (required)
@@ -821,7 +1522,8 @@ class AMCSD():
             patab = self.tables['publication_authors']
             for row in rows:
                 q = select(authtab.c.name).where(and_(authtab.c.id==patab.c.author_id,
-                                                      patab.c.publication_id==row.id))
+                                                      patab.c.publication_id==row.id)
+                                                 ).order_by(PUBAUTH_ORDER)
                 authors = tuple([i[0] for i in self.execall(q)])
                 out.append(CifPublication(row.id, row.journalname, row.year,
                                           row.volume, row.page_first,
@@ -830,6 +1532,7 @@ class AMCSD():
         return None
 
 
+    @_writer
     def add_publication(self, journalname, year, authorlist, volume=None,
                         page_first=None, page_last=None, with_authors=True):
 
@@ -854,6 +1557,7 @@ class AMCSD():
                             publication_id=pub.id, author_id=auth.id)
         return pub
 
+    @_writer
     def add_cifdata(self, cif_id, mineral_id, publication_id,
                     spacegroup_id, formula=None, compound=None,
                     formula_title=None, pub_title=None, a=None, b=None,
@@ -865,115 +1569,173 @@ class AMCSD():
                     atoms_aniso_u22=None, atoms_aniso_u33=None,
                     atoms_aniso_u12=None, atoms_aniso_u13=None,
                     atoms_aniso_u23=None, with_elements=True):
+        self._insert_cifdata(cif_id, mineral_id, publication_id, spacegroup_id,
+                             url=url, with_elements=with_elements,
+                             formula=formula, compound=compound,
+                             formula_title=formula_title, pub_title=pub_title,
+                             a=a, b=b, c=c, alpha=alpha, beta=beta, gamma=gamma,
+                             cell_volume=cell_volume, crystal_density=crystal_density,
+                             atoms_sites=atoms_sites, atoms_x=atoms_x,
+                             atoms_y=atoms_y, atoms_z=atoms_z,
+                             atoms_occupancy=atoms_occupancy, atoms_u_iso=atoms_u_iso,
+                             atoms_aniso_label=atoms_aniso_label,
+                             atoms_aniso_u11=atoms_aniso_u11,
+                             atoms_aniso_u22=atoms_aniso_u22,
+                             atoms_aniso_u33=atoms_aniso_u33,
+                             atoms_aniso_u12=atoms_aniso_u12,
+                             atoms_aniso_u13=atoms_aniso_u13,
+                             atoms_aniso_u23=atoms_aniso_u23)
+        return self.get_cif(cif_id)
+
+    def _insert_cifdata(self, cif_id, mineral_id, publication_id, spacegroup_id,
+                        url='', with_elements=True, fingerprint=None, **cifdata):
+        """insert a row of the cif table, as for add_cifdata(), with its
+        elements, fingerprint, descriptors, and text index entry, without
+        reading the CIF back. fingerprint is the structural fingerprint,
+        if already known"""
+        if self.schema_version >= 2:
+            for name in CIF_FLOATCOLUMNS:
+                if name in cifdata:
+                    cifdata[name] = cif_float(cifdata[name])
 
         self.insert('cif', id=cif_id, mineral_id=mineral_id,
                     publication_id=publication_id,
-                    spacegroup_id=spacegroup_id,
-                    formula_title=formula_title, pub_title=pub_title,
-                    formula=formula, compound=compound, url=url, a=a, b=b,
-                    c=c, alpha=alpha, beta=beta, gamma=gamma,
-                    cell_volume=cell_volume,
-                    crystal_density=crystal_density,
-                    atoms_sites=atoms_sites, atoms_x=atoms_x,
-                    atoms_y=atoms_y, atoms_z=atoms_z,
-                    atoms_occupancy=atoms_occupancy,
-                    atoms_u_iso=atoms_u_iso,
-                    atoms_aniso_label=atoms_aniso_label,
-                    atoms_aniso_u11=atoms_aniso_u11,
-                    atoms_aniso_u22=atoms_aniso_u22,
-                    atoms_aniso_u33=atoms_aniso_u33,
-                    atoms_aniso_u12=atoms_aniso_u12,
-                    atoms_aniso_u13=atoms_aniso_u13,
-                    atoms_aniso_u23=atoms_aniso_u23)
+                    spacegroup_id=spacegroup_id, url=url, **cifdata)
 
+        formula = cifdata.get('formula', None)
         if with_elements:
-            for element in chemparse(formula).keys():
-                self.insert('cif_elements', cif_id=cif_id, element=element)
-        return self.get_cif(cif_id)
-
-
-    def add_ciffile(self, filename, cif_id=None, url='', debug=False):
-
-        if CifParser is None:
-            raise ValueError("CifParser from pymatgen not available. Try 'pip install pymatgen'.")
-        try:
-            dat, formula, symm_xyz = parse_cif_file(filename)
-        except:
-            raise ValueError(f"unknown error trying to parse CIF file: {filename}")
-
-        # compound
-        compound = '<missing>'
-        for compname in ('_chemical_compound_source',
-                         '_chemical_name_systematic',
-                         '_chemical_name_common'):
-            if compname in dat:
-                compound = dat[compname]
-
-
-        # spacegroup
-        sgroup_name = dat.get('_symmetry_space_group_name_H-M', None)
-        if sgroup_name is None:
-            for key, val in dat.items():
-                if 'space_group' in key and 'H-M' in key:
-                    sgroup_name = val
-
-        sgroup = self.get_spacegroup(sgroup_name)
-        if sgroup is not None and sgroup.symmetry_xyz != symm_xyz:
+            etab = self.tables['cif_elements']
+            for element, amount in chemparse(formula).items():
+                kws = {'amount': amount} if 'amount' in etab.columns else {}
+                self.insert(etab, cif_id=cif_id, element=element, **kws)
+            self.elem_masks = self.compositions = None
+        if self.has_structure_cache():
+            stab = self.tables['cif_structures']
+            self.session.execute(stab.delete().where(stab.c.cif_id==cif_id))
+            self._commit()
+        if self.has_fingerprints():
+            if fingerprint is None:
+                sgroup = self.get_row_by_id('spacegroups', spacegroup_id)
+                fingerprint = cif_fingerprint(sgroup.symmetry_xyz, **cifdata)
+            self.session.execute(text('''INSERT OR IGNORE INTO cif_fingerprints
+                  (cif_id, fingerprint) VALUES (:id, :fp)'''),
+                  {'id': cif_id, 'fp': fingerprint})
+            self._commit()
+        if self.has_descriptors():
+            self.insert('cif_descriptors', cif_id=cif_id,
+                        **cif_descriptors(formula, *[cifdata.get(name, None) for name in
+                                 ('atoms_sites', 'atoms_x', 'atoms_y', 'atoms_z',
+                                  'atoms_occupancy', 'atoms_aniso_label',
+                                  'atoms_aniso_u11')]))
+        textindex = self._batch_textindex if self._in_batch else self.has_textindex()
+        if textindex:
+            self.session.execute(text(f'{textindex_insert} WHERE cif.id = :id'),
+                                 {'id': cif_id})
+            self._commit()
+
+
+    def _ingest_cache(self, preload=False):
+        """lookups of spacegroups, minerals, authors, and publications used
+        when adding CIFs. With preload=True, the full tables are read, so that
+        no more queries are needed, otherwise rows are read as needed."""
+        cache = {'complete': preload, 'spacegroups': {}, 'minerals': {},
+                 'authors': {}, 'publications': {}}
+        if preload:
+            tab = self.tables['spacegroups']
+            for row in self.execall(select(tab.c.id, tab.c.hm_notation,
+                                           tab.c.symmetry_xyz).order_by(tab.c.id)):
+                cache['spacegroups'].setdefault(row.hm_notation, (row.id, row.symmetry_xyz))
+            for tname in ('minerals', 'authors'):
+                tab = self.tables[tname]
+                for row in self.execall(select(tab.c.id, tab.c.name).order_by(tab.c.id)):
+                    cache[tname].setdefault(row.name, row.id)
+            tab = self.tables['publications']
+            for row in self.execall(tab.select().order_by(tab.c.id)):
+                key = (str(row.journalname).lower(), row.year, str(row.volume),
+                       str(row.page_first), str(row.page_last))
+                cache['publications'].setdefault(key, row.id)
+        return cache
+
+    def _ingest_name(self, cache, tablename, name):
+        "id for a mineral or author name, added as needed"
+        names = cache[tablename]
+        if name not in names:
+            row = None
+            if not cache['complete']:
+                row = self._get_tablerow(tablename, name, add=False)
+            names[name] = self.insert(tablename, name=name) if row is None else row.id
+        return names[name]
+
+    def _ingest_spacegroup(self, cache, sgroup_name, symm_xyz):
+        "id for a spacegroup by HM notation and symmetry operations, added as needed"
+        groups = cache['spacegroups']
+        def lookup(name):
+            if name not in groups and not cache['complete']:
+                row = self.get_spacegroup(name)
+                if row is not None:
+                    groups[name] = (row.id, row.symmetry_xyz)
+            return groups.get(name, None)
+
+        sgroup = lookup(sgroup_name)
+        if sgroup is not None and sgroup[1] != symm_xyz:
             for i in range(1, 11):
                 tgroup_name = sgroup_name + f' %var{i:d}%'
-                sgroup = self.get_spacegroup(tgroup_name)
-                if sgroup is None or sgroup.symmetry_xyz == symm_xyz:
+                sgroup = lookup(tgroup_name)
+                if sgroup is None or sgroup[1] == symm_xyz:
                     sgroup_name = tgroup_name
                     break
         if sgroup is None:
-            sgroup = self.add_spacegroup(sgroup_name, symm_xyz)
-
-        min_name = '<missing>'
-        for mname in ('_chemical_name_mineral',
-                       '_chemical_name_common'):
-            if mname in dat:
-                min_name = dat[mname]
-        mineral = self._get_tablerow('minerals', min_name)
-
-        # get publication data (including ISCD style of 'citation' in place of 'journal' )
-        pubdict = dict(journalname=dat.get('_journal_name_full', None),
-                       year=dat.get('_journal_year', None),
-                       volume=dat.get('_journal_volume', None),
-                       page_first=dat.get('_journal_page_first', None),
-                       page_last=dat.get('_journal_page_last', None))
-
-        for key, alt, dval in (('journalname', 'journal_full', 'No Journal'),
-                               ('year', None, -1),
-                               ('volume', 'journal_volume', 0),
-                               ('page_first', None, 0),
-                               ('page_last', None, 0)):
-            if pubdict[key] is None:
-                if alt is None:
-                    alt = key
-                alt = '_citation_%s' % alt
-                pubdict[key] = dat.get(alt, [dval])[0]
-        authors = dat.get('_publ_author_name', None)
-        if authors is None:
-            authors = dat.get('_citation_author_name', ['Anonymous'])
-
-        pubs = self.get_publications(**pubdict)
-        if pubs is None:
-            pub = self.add_publication(pubdict['journalname'],
-                                       pubdict['year'], authors,
-                                       volume=pubdict['volume'],
-                                       page_first=pubdict['page_first'],
-                                       page_last=pubdict['page_last'])
-        else:
-            pub = pubs[0]
-
-        density = dat.get('_exptl_crystal_density_meas', None)
-        if density is None:
-            density = dat.get('_exptl_crystal_density_diffrn', -1.0)
+            row = self.add_spacegroup(sgroup_name, symm_xyz)
+            sgroup = groups[sgroup_name] = (row.id, row.symmetry_xyz)
+        return sgroup[0]
+
+    def _ingest_publication(self, cache, pubdict, authors):
+        "id for a publication, added with its authors as needed"
+        key = (str(pubdict['journalname']).lower(), int(pubdict['year']),
+               str(pubdict['volume']), str(pubdict['page_first']),
+               str(pubdict['page_last']))
+        pubs = cache['publications']
+        if key not in pubs and not cache['complete']:
+            rows = self.get_publications(**pubdict)
+            if rows is not None:
+                pubs[key] = rows[0].id
+        if key not in pubs:
+            pub_id = self.insert('publications', **pubdict)
+            for name in authors:
+                self.insert('publication_authors', publication_id=pub_id,
+                            author_id=self._ingest_name(cache, 'authors', name))
+            pubs[key] = pub_id
+        return pubs[key]
+
+    def _add_cifrecord(self, rec, cif_id=None, url='', cache=None,
+                       duplicates='link', debug=False):
+        """add a CIF record from read_ciffile(), returning the CIF id and
+        whether it was added (False if already in the database).
+
+        If the table of fingerprints exists, a CIF with the fingerprint of a
+        CIF in the database is not added: with duplicates='link' the id of
+        that CIF is returned, with duplicates='reject' DuplicateCIFError is
+        raised."""
+        if duplicates not in ('link', 'reject'):
+            raise ValueError("duplicates must be 'link' or 'reject'")
+        fingerprint = None
+        if self.has_fingerprints():
+            fingerprint = cif_fingerprint(rec['symmetry_xyz'], **rec['cifdata'])
+            other_id = self.find_fingerprint(fingerprint)
+            if other_id is not None:
+                if duplicates == 'reject':
+                    raise DuplicateCIFError(f"duplicate of CIF {other_id}")
+                return other_id, False
+        if cache is None:
+            cache = self._ingest_cache()
+        sgroup_id = self._ingest_spacegroup(cache, rec['spacegroup'], rec['symmetry_xyz'])
+        mineral_id = self._ingest_name(cache, 'minerals', rec['mineral'])
+        pub_id = self._ingest_publication(cache, rec['publication'], rec['authors'])
+        cifdata = rec['cifdata']
+        formula = cifdata['formula']
 
         if cif_id is None:
-            cif_id = dat.get('_database_code_amcsd', None)
-            if cif_id is None:
-                cif_id = dat.get('_cod_database_code', None)
+            cif_id = rec['cif_id']
             if cif_id is None:
                 cif_id = self.next_cif_id()
         cif_id = int(cif_id)
@@ -985,161 +1747,536 @@ class AMCSD():
         if this is not None:
             _cid, _formula = this
             if formula.replace(' ', '') == _formula.replace(' ', ''):
-                return cif_id
+                return cif_id, False
             else:
                 cif_id = self.next_cif_id()
 
         if debug:
             print("##CIF Would add Cif Data !" )
-            print(cif_id, mineral.id, pub.id, sgroup.id)
-            print("##CIF formuala / compound: ", formula, compound)
-            print("titles: ",
-                  dat.get('_amcsd_formula_title', '<missing>'),
-                  dat.get('_publ_section_title', '<missing>'))
-            print("##CIF atom sites :", json.dumps(dat['_atom_site_label']))
-            print("##CIF locations : ",
-                  put_optarray(dat, '_atom_site_fract_x'),
-                  put_optarray(dat, '_atom_site_fract_y'),
-                  put_optarray(dat, '_atom_site_fract_z'),
-                  put_optarray(dat, '_atom_site_occupancy'),
-                  put_optarray(dat, '_atom_site_U_iso_or_equiv'))
-            print("##CIF aniso label : ",
-                  json.dumps(dat.get('_atom_site_aniso_label', '<missing>')))
-            print("##CIF aniso : ",
-                  put_optarray(dat, '_atom_site_aniso_U_11'),
-                  put_optarray(dat, '_atom_site_aniso_U_22'),
-                  put_optarray(dat, '_atom_site_aniso_U_33'),
-                  put_optarray(dat, '_atom_site_aniso_U_12'),
-                  put_optarray(dat, '_atom_site_aniso_U_13'),
-                  put_optarray(dat, '_atom_site_aniso_U_23'))
-            print('##CIF cell data: ', dat['_cell_length_a'],
-                  dat['_cell_length_b'],
-                  dat['_cell_length_c'],
-                  dat['_cell_angle_alpha'],
-                  dat['_cell_angle_beta'],
-                  dat['_cell_angle_gamma'])
-            print("##CIF volume/ density ", dat.get('_cell_volume', -1),  density)
+            print(cif_id, mineral_id, pub_id, sgroup_id)
+            for key, val in cifdata.items():
+                print(f"##CIF {key}: {val}")
             print("##CIF  url : ", type(url), url)
 
-        self.add_cifdata(cif_id, mineral.id, pub.id, sgroup.id,
-                         formula=formula, compound=compound,
-                         formula_title=dat.get('_amcsd_formula_title', '<missing>'),
-                         pub_title=dat.get('_publ_section_title', '<missing>'),
-                         atoms_sites=json.dumps(dat['_atom_site_label']),
-                         atoms_x=put_optarray(dat, '_atom_site_fract_x'),
-                         atoms_y=put_optarray(dat, '_atom_site_fract_y'),
-                         atoms_z=put_optarray(dat, '_atom_site_fract_z'),
-                         atoms_occupancy=put_optarray(dat, '_atom_site_occupancy'),
-                         atoms_u_iso=put_optarray(dat, '_atom_site_U_iso_or_equiv'),
-                         atoms_aniso_label=json.dumps(dat.get('_atom_site_aniso_label', '<missing>')),
-                         atoms_aniso_u11=put_optarray(dat, '_atom_site_aniso_U_11'),
-                         atoms_aniso_u22=put_optarray(dat, '_atom_site_aniso_U_22'),
-                         atoms_aniso_u33=put_optarray(dat, '_atom_site_aniso_U_33'),
-                         atoms_aniso_u12=put_optarray(dat, '_atom_site_aniso_U_12'),
-                         atoms_aniso_u13=put_optarray(dat, '_atom_site_aniso_U_13'),
-                         atoms_aniso_u23=put_optarray(dat, '_atom_site_aniso_U_23'),
-                         a=dat['_cell_length_a'],
-                         b=dat['_cell_length_b'],
-                         c=dat['_cell_length_c'],
-                         alpha=dat['_cell_angle_alpha'],
-                         beta=dat['_cell_angle_beta'],
-                         gamma=dat['_cell_angle_gamma'],
-                         cell_volume=dat.get('_cell_volume', -1),
-                         crystal_density=density,
-                         url=url)
-        return cif_id
-
-    def get_cif(self, cif_id, as_strings=False):
-        """get Cif Structure object """
-        tab = self.tables['cif']
-
-        cif = self.execone(tab.select().where(tab.c.id==cif_id))
-        if cif is None:
-            return
-
-        tab_pub  = self.tables['publications']
-        tab_auth = self.tables['authors']
-        tab_pa   = self.tables['publication_authors']
-        tab_min  = self.tables['minerals']
-        tab_sp   = self.tables['spacegroups']
-        mineral  = self.execone(tab_min.select().where(tab_min.c.id==cif.mineral_id))
-        sgroup   = self.execone(tab_sp.select().where(tab_sp.c.id==cif.spacegroup_id))
-        hm_symbol = sgroup.hm_notation
-        if '%var' in hm_symbol:
-            hm_symbol = hm_symbol.split('%var')[0]
+        self._insert_cifdata(cif_id, mineral_id, pub_id, sgroup_id, url=url,
+                             fingerprint=fingerprint, **cifdata)
+        return cif_id, True
+
+    @_writer
+    def add_ciffile(self, filename, cif_id=None, url='', duplicates='link',
+                    block=0, debug=False):
+        """add a CIF file to the database, returning its CIF id.
+        For files with several data blocks, only the block given by index
+        or name is read.  See build_fingerprints() for duplicates, and
+        add_ciffiles() to add many CIF files."""
+        if CifParser is None:
+            raise ValueError("CifParser from pymatgen not available. Try 'pip install pymatgen'.")
+        rec = read_ciffile(filename, block=block)
+        return self._add_cifrecord(rec, cif_id=cif_id, url=url,
+                                   duplicates=duplicates, debug=debug)[0]
+
+    @_writer
+    def add_ciffiles(self, filenames, workers=None, batch_size=500, url='',
+                     duplicates='link', verbose=False):
+        """add many CIF files to the database
+
+        CIF files are read with read_ciffile() in a pool of worker processes
+        and added in transactions of batch_size files, using in-memory lookups
+        of spacegroups, minerals, authors, and publications.  Files that
+        cannot be read or added are skipped, and reported in the returned errors.
+
+        Args:
+            filenames (list): CIF files to add
+            workers (int or None): number of worker processes [None, number of CPUs]
+            batch_size (int): number of CIF files per transaction [500]
+            url (str): url for the CIFs ['']
+            duplicates (str): 'link' or 'reject', see build_fingerprints() ['link']
+            verbose (bool): whether to print errors and progress [False]
 
-        pub = self.get_publications(id=cif.publication_id)[0]
+        Returns:
+            cif_ids, errors: list of CIF ids for the files that were added or
+            already in the database, and dict of error message by filename.
+        """
+        if CifParser is None:
+            raise ValueError("CifParser from pymatgen not available. Try 'pip install pymatgen'.")
+        if self.read_only:
+            raise ValueError("cannot add CIF files to read-only database")
+        added, errors = self._add_files(filenames, workers=workers,
+                                        batch_size=batch_size, url=url,
+                                        duplicates=duplicates, verbose=verbose)
+        return [cif_id for cif_id, new in added.values()], errors
+
+    def _add_files(self, filenames, workers=None, batch_size=500, url='',
+                   cif_ids=None, replace=None, duplicates='link', verbose=False):
+        """read and add CIF files, as for add_ciffiles(), with optional dicts
+        by filename of CIF ids to use and of CIF ids to delete once the file
+        has been read, in the transaction that adds it. Returns dicts by
+        filename of (CIF id, whether the CIF was added) and of error message"""
+        filenames = [str(fname) for fname in filenames]
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if cif_ids is None:
+            cif_ids = {}
+        if replace is None:
+            replace = {}
+
+        added, errors = {}, {}
+        cache = self._ingest_cache(preload=True)
+        pool = None
+        if workers > 1 and len(filenames) > 1:
+            pool = ProcessPoolExecutor(max_workers=workers)
+            chunksize = max(1, min(64, len(filenames)//(4*workers)))
+            results = pool.map(_read_ciffile_task, filenames, chunksize=chunksize)
+        else:
+            results = map(_read_ciffile_task, filenames)
+        try:
+            batch = []
+            for fname, rec, err in results:
+                if err is not None:
+                    errors[fname] = err
+                    if verbose:
+                        print(f"could not read CIF file {fname}: {err}")
+                    continue
+                batch.append((fname, rec))
+                if len(batch) >= batch_size:
+                    self._add_cifbatch(batch, cache, url, cif_ids, added, errors,
+                                       replace, duplicates, verbose)
+                    batch = []
+            if len(batch) > 0:
+                self._add_cifbatch(batch, cache, url, cif_ids, added, errors,
+                                   replace, duplicates, verbose)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        return added, errors
+
+    def _add_cifbatch(self, batch, cache, url, cif_ids, added, errors,
+                      replace=None, duplicates='link', verbose=False):
+        """add a batch of (filename, record) in one transaction, first
+        deleting any CIF to be replaced by the file. If that fails, records
+        are added one at a time, and errors recorded"""
+        if replace is None:
+            replace = {}
+        def add_record(fname, rec, rejected):
+            if fname in replace:
+                self.delete_cif(replace[fname])
+            try:
+                return self._add_cifrecord(rec, cif_id=cif_ids.get(fname, None),
+                                           url=url, cache=cache, duplicates=duplicates)
+            except DuplicateCIFError as exc:
+                if fname in replace:
+                    # roll back, keeping the CIF to be replaced
+                    raise
+                rejected[fname] = str(exc)
+                return None
 
-        out = CifStructure(ams_id=cif_id, publication=pub,
-                           mineral=mineral, spacegroup=sgroup,
-                           hm_symbol=hm_symbol, ams_db=self)
+        self._batch_textindex = self.has_textindex()
+        self._in_batch = True
+        try:
+            try:
+                done, rejected = {}, {}
+                for fname, rec in batch:
+                    done[fname] = add_record(fname, rec, rejected)
+                self.session.commit()
+                self._clear_caches()
+                added.update({f: v for f, v in done.items() if v is not None})
+                errors.update(rejected)
+                batch = []
+            except Exception:
+                self.session.rollback()
+                cache.update(self._ingest_cache(preload=True))
+            for fname, rec in batch:
+                try:
+                    result = add_record(fname, rec, errors)
+                    self.session.commit()
+                    self._clear_caches()
+                    if result is not None:
+                        added[fname] = result
+                except Exception as exc:
+                    self.session.rollback()
+                    cache.update(self._ingest_cache(preload=True))
+                    errors[fname] = f"could not add CIF: {exc}"
+                    if verbose:
+                        print(f"could not add CIF file {fname}: {exc}")
+        finally:
+            self._in_batch = False
+        self.cell_index = None
+        self.row_cache = {}
+        self.pub_cache = {}
+        if verbose:
+            print(f"added {len(added)} CIF files, {len(errors)} errors")
+
+    def export_cifs(self, cifs, archive_path, format=None, workers=None,
+                    batch_size=200, verbose=False):
+        """write CIF text for many CIFs into one tar.gz or zip archive,
+        with the CIF text made in worker processes and written straight
+        to the archive, one batch of CIFs at a time.
+
+        Args:
+            cifs (list or dict): list of CIF ids, or dict of criteria
+                for iter_cifs(), as dict(mineral_name='quartz'), with
+                max_matches of find_cifs() taken as limit
+            archive_path (str or Path): name of archive file
+            format (str or None): 'tar.gz' or 'zip' [None, 'zip' if
+                archive_path ends with '.zip', 'tar.gz' otherwise]
+            workers (int or None): number of worker processes, with 1 to
+                not use worker processes [None, number of CPUs]
+            batch_size (int): number of CIFs to read at a time [200]
+            verbose (bool): whether to print progress [False]
 
-        for attr in ('formula_title', 'compound', 'formula', 'pub_title'):
-            setattr(out, attr, getattr(cif, attr, '<missing>'))
-        for attr in ('a', 'b', 'c', 'alpha', 'beta', 'gamma',
-                     'cell_volume', 'crystal_density'):
-            val = getattr(cif, attr, '-1')
-            if not as_strings:
-                if val is not None:
-                    if '(' in val:
-                        val = val.split('(')[0]
-                    if ',' in val and '.' not in val:
-                        val = val.replace(',', '.')
-                    try:
-                        val = float(val)
-                    except:
-                        pass
-            setattr(out, attr, val)
+        Returns:
+            number of CIFs written, and dict of error message by CIF id.
+        """
+        archive_path = str(archive_path)
+        if format is None:
+            format = 'zip' if archive_path.endswith('.zip') else 'tar.gz'
+        if format not in ('tar.gz', 'zip'):
+            raise ValueError("format must be 'tar.gz' or 'zip'")
+        if workers is None:
+            workers = os.cpu_count() or 1
+        batch_size = max(1, int(batch_size))
+        if isinstance(cifs, dict):
+            criteria = dict(cifs)
+            if 'max_matches' in criteria:
+                criteria.setdefault('limit', criteria.pop('max_matches'))
+            for key in ('id', 'summary', 'as_ids', 'batch_size'):
+                if key in criteria:
+                    raise ValueError(f"'{key}' is not a criterion for export_cifs()")
+            paging = {key: criteria.pop(key) for key in ('order_by', 'offset', 'limit')
+                      if key in criteria}
+            ntotal = max(0, self.count_cifs(**criteria) - paging.get('offset', 0))
+            if paging.get('limit', None) is not None:
+                ntotal = min(ntotal, paging['limit'])
+            id_batches = self._find_ids(batch_size=batch_size, **paging, **criteria)
+        else:
+            cifs = [int(cid) for cid in cifs]
+            ntotal = len(cifs)
+            id_batches = id_chunks(cifs, size=batch_size)
+
+        if format == 'zip':
+            archive = zipfile.ZipFile(archive_path, 'w', compression=zipfile.ZIP_DEFLATED)
+            def add_entry(name, data):
+                archive.writestr(name, data)
+        else:
+            archive = tarfile.open(archive_path, 'w:gz')
+            def add_entry(name, data):
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = int(time.time())
+                archive.addfile(info, BytesIO(data))
+
+        pool = None
+        if workers > 1 and ntotal > 1:
+            pool = ProcessPoolExecutor(max_workers=workers)
+        nout, errors = 0, {}
+        try:
+            for ids in id_batches:
+                batch = self._read_cifs(ids)
+                for cif in batch:
+                    # look up shared rows here, so workers need no database
+                    cif.publication, cif.mineral, cif.spacegroup
+                    cif.ams_db = None
+                if pool is not None:
+                    chunksize = max(1, len(batch)//(4*workers))
+                    results = pool.map(_render_cif_task, batch, chunksize=chunksize)
+                else:
+                    results = map(_render_cif_task, batch)
+                for cif_id, name, data, err in results:
+                    if err is not None:
+                        errors[cif_id] = err
+                        continue
+                    add_entry(name, data)
+                    nout += 1
+                if verbose:
+                    print(f"exported {nout} of {ntotal} CIFs to {archive_path}")
+        finally:
+            if pool is not None:
+                pool.shutdown()
+            archive.close()
+        return nout, errors
+
+    @_writer
+    def delete_cif(self, cif_id):
+        """remove a CIF from the database, with its elements, descriptors,
+        cached structures, and text index entry"""
+        if self.read_only:
+            raise ValueError("cannot delete CIF from read-only database")
+        for tname in ('cif_elements', 'cif_descriptors', 'cif_structures',
+                      'cif_fingerprints'):
+            if tname in self.tables:
+                tab = self.tables[tname]
+                self.session.execute(tab.delete().where(tab.c.cif_id==cif_id))
+        if self.has_textindex():
+            self.session.execute(text('DELETE FROM cif_fts WHERE rowid = :id'),
+                                 {'id': cif_id})
+        tab = self.tables['cif']
+        self.session.execute(tab.delete().where(tab.c.id==cif_id))
+        self._commit()
+        self.elem_masks = self.compositions = None
+        self.cell_index = None
+        self.row_cache = {}
+        self.pub_cache = {}
+        self._clear_caches()
+
+    @_writer
+    def sync_directory(self, path, pattern='*.cif', retire=False, workers=None,
+                       batch_size=500, duplicates='link', verbose=False):
+        """add CIF files in a directory tree to the database, keeping a
+        manifest (table cif_files) of path, size, modification time, and
+        content hash for each file, so that syncing again only reads files
+        that were added or changed:
+
+           new files are added.
+           files with the same size and modification time are skipped
+           without reading them, as are files with unchanged content.
+           changed files replace their earlier CIF, keeping its CIF id.
+           with retire=True, CIFs for files that were removed are deleted.
+
+        Args:
+            path (str or Path): top directory
+            pattern (str): glob pattern for CIF files ['*.cif']
+            retire (bool): whether to delete CIFs for removed files [False]
+            workers (int or None): number of worker processes, see add_ciffiles()
+            batch_size (int): number of CIF files per transaction [500]
+            duplicates (str): 'link' or 'reject', see build_fingerprints() ['link']
+            verbose (bool): whether to print errors and progress [False]
 
-        for attr in ('atoms_sites', 'atoms_aniso_label'):
-            val = getattr(cif, attr, '<missing>')
-            val = '<missing>' if val in (None, '<missing>') else json.loads(val)
-            setattr(out, attr, val)
+        Returns:
+            dict with lists of 'added', 'updated', and 'retired' paths, the
+            number of 'unchanged' files, and dict of 'errors' by path.
+        """
+        if self.read_only:
+            raise ValueError("cannot sync directory for read-only database")
+        if 'cif_files' not in self.tables:
+            self.session.execute(text(manifest_schema))
+            self.session.commit()
+            Table('cif_files', self.metadata, autoload_with=self.engine)
+        mtab = self.tables['cif_files']
+        manifest = {row.path: row for row in self.execall(mtab.select())}
+
+        out = {'added': [], 'updated': [], 'retired': [], 'unchanged': 0, 'errors': {}}
+        found, changed, stats, hashes = set(), [], {}, {}
+        for fpath in sorted(Path(path).rglob(pattern)):
+            if not fpath.is_file():
+                continue
+            fname = fpath.absolute().as_posix()
+            found.add(fname)
+            stat = fpath.stat()
+            stats[fname] = (stat.st_size, stat.st_mtime_ns)
+            prev = manifest.get(fname, None)
+            if prev is not None and (prev.size, prev.mtime) == stats[fname]:
+                out['unchanged'] += 1
+                continue
+            hashes[fname] = hashlib.sha256(fpath.read_bytes()).hexdigest()
+            if prev is not None and prev.hash == hashes[fname]:
+                # touched but not changed
+                self.session.execute(mtab.update().where(mtab.c.path==fname).values(
+                    size=stats[fname][0], mtime=stats[fname][1]))
+                out['unchanged'] += 1
+                continue
+            changed.append(fname)
+        self.session.commit()
 
-        if out.atoms_sites not in (None, '<missing>'):
-            out.natoms = len(out.atoms_sites)
-            for attr in ('atoms_x', 'atoms_y', 'atoms_z', 'atoms_occupancy',
-                         'atoms_u_iso', 'atoms_aniso_u11', 'atoms_aniso_u22',
-                         'atoms_aniso_u33', 'atoms_aniso_u12',
-                         'atoms_aniso_u13', 'atoms_aniso_u23'):
-                try:
-                    val =  get_optarray(getattr(cif, attr))
-                    if val == '0':
-                        val = None
-                    elif not as_strings:
-                        tmp = []
-                        for i in range(len(val)):
-                            v = val[i]
-                            if v in ('?', '.'):
-                                v = 2.
-                            else:
-                                v = float(v)
-                            tmp.append(v)
-                        val = tmp
-                    setattr(out, attr, val)
-                except:
-                    print(f"could not parse CIF entry for {cif_id} '{attr}': {val} ")
-
-        # we're now ignoring per-cif qvalues
-        # out.qval = None
-        # if cif.qdat is not None:
-        #     out.qval = np.unpackbits(np.array([int(b) for b in b64decode(cif.qdat)],
-        #                                       dtype='uint8'))
-
-        out.hkls = None
-        if hasattr(cif, 'hkls'):
-            out.hkls = cif.hkls
+        def release(fname):
+            """delete manifest entry, returning the CIF id to delete if the
+            CIF was added from this file and no other file uses it"""
+            row = manifest.pop(fname)
+            self.session.execute(mtab.delete().where(mtab.c.path==fname))
+            if (row.cif_id is None or not row.added or
+                any(other.cif_id == row.cif_id for other in manifest.values())):
+                return None
+            return row.cif_id
+
+        if retire:
+            # the manifest is shared by all directories synced
+            root = PurePosixPath(Path(path).absolute().as_posix())
+            for fname in [fname for fname in manifest if fname not in found]:
+                fpath = PurePosixPath(fname)
+                if (not fpath.is_relative_to(root) or
+                    not fpath.relative_to(root).match(pattern)):
+                    continue
+                cif_id = release(fname)
+                if cif_id is not None:
+                    self.delete_cif(cif_id)
+                out['retired'].append(fname)
+        self.session.commit()
 
+        # the CIF of a changed file is replaced, keeping its id, in the
+        # transaction that adds the file read again, so that files that
+        # can no longer be read keep their CIF
+        previous = {fname: manifest[fname] for fname in changed if fname in manifest}
+        replace = {}
+        for fname, row in previous.items():
+            if (row.cif_id is not None and row.added and
+                not any(other.cif_id == row.cif_id for ofname, other in manifest.items()
+                        if ofname != fname)):
+                replace[fname] = row.cif_id
+        added, out['errors'] = self._add_files(changed, workers=workers,
+                                               batch_size=batch_size,
+                                               cif_ids=dict(replace), replace=replace,
+                                               duplicates=duplicates, verbose=verbose)
+        # files that could not be read are kept in the manifest, with the
+        # CIF from an earlier version of the file, if any, so that they are
+        # read again only when changed
+        for fname in changed:
+            prev = previous.get(fname, None)
+            if fname in added:
+                cif_id, new = added[fname]
+            elif prev is not None:
+                cif_id, new = prev.cif_id, prev.added
+            else:
+                cif_id, new = None, False
+            if prev is not None:
+                self.session.execute(mtab.delete().where(mtab.c.path==fname))
+            self.session.execute(mtab.insert().values(path=fname, size=stats[fname][0],
+                                                      mtime=stats[fname][1],
+                                                      hash=hashes[fname], cif_id=cif_id,
+                                                      added=int(new)))
+            if fname in added:
+                out['updated' if prev is not None else 'added'].append(fname)
+        self.session.commit()
         return out
 
+    def get_cif(self, cif_id, as_strings=False):
+        """get Cif Structure object """
+        out = self.get_cifs([cif_id], as_strings=as_strings)
+        if len(out) < 1:
+            return None
+        return out[0]
+
+    def get_row_by_id(self, tablename, row_id):
+        """row of the minerals or spacegroups table by id, cached"""
+        cache = self.row_cache.get(tablename, {})
+        if row_id not in cache:
+            cache = self._cache_rows(tablename, [row_id])
+        return cache.get(row_id, None)
+
+    def get_symmetry_ops(self, spacegroup_id):
+        """compiled symmetry operations (rotations, translations) for a
+        spacegroup id, cached (see compile_symmetry_ops())"""
+        if spacegroup_id not in self.symmetry_ops:
+            sgroup = self.get_row_by_id('spacegroups', spacegroup_id)
+            self.symmetry_ops[spacegroup_id] = compile_symmetry_ops(sgroup.symmetry_xyz)
+        return self.symmetry_ops[spacegroup_id]
+
+    def get_cif_publication(self, pub_id):
+        """CifPublication (with authors) by publication id, cached"""
+        cache = self.pub_cache
+        if pub_id not in cache:
+            cache = self._cache_publications([pub_id])
+        return cache.get(pub_id, None)
+
+    def _cache_rows(self, tablename, ids):
+        "read rows of a table by id into row_cache, returning that cache"
+        cache = self.row_cache.setdefault(tablename, {})
+        ids = [i for i in set(ids) if i not in cache]
+        table = self.tables[tablename]
+        for chunk in id_chunks(ids):
+            for row in self.execall(table.select().where(table.c.id.in_(chunk))):
+                cache[row.id] = row
+        return cache
+
+    def _cache_publications(self, ids):
+        "read publications with authors by id into pub_cache, returning that cache"
+        cache = self.pub_cache
+        ids = [i for i in set(ids) if i not in cache]
+        if len(ids) == 0:
+            return cache
+        tab_pub  = self.tables['publications']
+        tab_auth = self.tables['authors']
+        tab_pa   = self.tables['publication_authors']
+        pubrows = {}
+        for chunk in id_chunks(ids):
+            for row in self.execall(tab_pub.select().where(tab_pub.c.id.in_(chunk))):
+                pubrows[row.id] = row
+
+        authors = {pid: [] for pid in pubrows}
+        for chunk in id_chunks(pubrows.keys()):
+            query = select(tab_pa.c.publication_id, tab_auth.c.name).where(
+                and_(tab_auth.c.id==tab_pa.c.author_id,
+                     tab_pa.c.publication_id.in_(chunk))).order_by(PUBAUTH_ORDER)
+            for pub_id, name in self.execall(query):
+                authors[pub_id].append(name)
+
+        for row in pubrows.values():
+            cache[row.id] = CifPublication(row.id, row.journalname, row.year,
+                                           row.volume, row.page_first,
+                                           row.page_last, tuple(authors[row.id]))
+        return cache
+
+    def get_cifs(self, cif_ids, as_strings=False):
+        """get list of Cif Structure objects for a list of CIF ids
+
+        The cif rows for all CIFs are fetched with a few bulk queries, and
+        the minerals, spacegroups, and publications they use are read into
+        the caches used when these are first accessed.  CIF ids that are
+        not found are skipped, otherwise the order of cif_ids is preserved.
+        With the CIF cache (see enable_caches()), CIF Structures are reused.
+        """
+        cif_ids = [int(cid) for cid in cif_ids]
+        if self.cif_cache.maxsize <= 0:
+            return self._read_cifs(cif_ids, as_strings=as_strings)
+        self._check_caches()
+        generation = self.cif_cache.generation
+        cifs = {}
+        for cif_id in cif_ids:
+            cif = self.cif_cache.get((cif_id, as_strings))
+            if cif is not None:
+                cifs[cif_id] = cif
+        missing = [cif_id for cif_id in cif_ids if cif_id not in cifs]
+        if len(missing) > 0:
+            for cif in self._read_cifs(missing, as_strings=as_strings):
+                cifs[cif.ams_id] = cif
+                self.cif_cache.put((cif.ams_id, as_strings), cif, generation=generation)
+        return [cifs[cif_id] for cif_id in cif_ids if cif_id in cifs]
+
+    def _read_cifs(self, cif_ids, as_strings=False):
+        "list of new Cif Structure objects for a list of CIF ids, see get_cifs()"
+        tab = self.tables['cif']
+        # per-CIF q values (qdat) are not used
+        columns = [col for col in tab.columns if col.name != 'qdat']
+        cif_ids = [int(cid) for cid in cif_ids]
+        cifs = {}
+        for chunk in id_chunks(cif_ids):
+            for row in self.execall(select(*columns).where(tab.c.id.in_(chunk))):
+                cifs[row.id] = row
+        if len(cifs) == 0:
+            return []
+
+        self._cache_rows('minerals', [c.mineral_id for c in cifs.values()])
+        self._cache_rows('spacegroups', [c.spacegroup_id for c in cifs.values()])
+        self._cache_publications([c.publication_id for c in cifs.values()])
+
+        return [CifStructure.from_row(cifs[cif_id], ams_db=self, as_strings=as_strings)
+                for cif_id in cif_ids if cif_id in cifs]
+
+    def get_summaries(self, cif_ids):
+        """get list of CifSummary (id, formula, mineral name, publication
+        year, and journal) for a list of CIF ids, with one query per 500
+        ids.  CIF ids that are not found are skipped."""
+        tab = self.tables['cif']
+        tab_min = self.tables['minerals']
+        tab_pub = self.tables['publications']
+        source = tab.outerjoin(tab_min, tab_min.c.id==tab.c.mineral_id).outerjoin(
+            tab_pub, tab_pub.c.id==tab.c.publication_id)
+        cif_ids = [int(cid) for cid in cif_ids]
+        rows = {}
+        for chunk in id_chunks(cif_ids):
+            query = select(tab.c.id, tab.c.formula, tab.c.formula_title,
+                           tab_min.c.name, tab_pub.c.year,
+                           tab_pub.c.journalname).select_from(source).where(tab.c.id.in_(chunk))
+            for row in self.execall(query):
+                rows[row.id] = row
+        return [CifSummary(cid, rows[cid].formula,
+                           mineral_label(rows[cid].name, rows[cid].formula_title),
+                           rows[cid].year, rows[cid].journalname)
+                for cid in cif_ids if cid in rows]
+
     def next_cif_id(self):
         """next available CIF ID > 200000 that is not in current table"""
-        max_id = 200_000
         tabcif = self.tables['cif']
-        for row in self.execall(select(tabcif.c.id).where(tabcif.c.id>200000)):
-            if row[0] > max_id:
-                max_id = row[0]
-        return max_id + 1
+        max_id = self.execone(select(func.max(tabcif.c.id)))[0]
+        return max(200_000, max_id or 0) + 1
 
 
     def all_minerals(self):
@@ -1163,6 +2300,325 @@ class AMCSD():
                 names.append(row.journalname)
         return names
 
+    def _columnar_batches(self, batch_size=2000):
+        """generate batches of columns for export_columnar(), reading
+        the cif table in id order, batch_size rows at a time"""
+        tab = self.tables['cif']
+        tab_min = self.tables['minerals']
+        tab_pub = self.tables['publications']
+        tab_sg = self.tables['spacegroups']
+        source = tab.outerjoin(tab_min, tab_min.c.id==tab.c.mineral_id).outerjoin(
+            tab_pub, tab_pub.c.id==tab.c.publication_id).outerjoin(
+            tab_sg, tab_sg.c.id==tab.c.spacegroup_id)
+        query = select(tab.c.id, tab.c.spacegroup_id, tab.c.mineral_id,
+                       tab.c.publication_id, tab.c.formula, tab.c.formula_title,
+                       tab_min.c.name, tab_sg.c.hm_notation, tab_pub.c.year,
+                       tab_pub.c.journalname, *[tab.c[n] for n in CIF_FLOATCOLUMNS],
+                       tab.c.atoms_sites, tab.c.atoms_x, tab.c.atoms_y, tab.c.atoms_z,
+                       tab.c.atoms_occupancy, tab.c.atoms_u_iso).select_from(source)
+
+        def fit(vals, nsites, default=np.nan):
+            out = np.full(nsites, default)
+            if vals is not None:
+                vals = vals[:nsites]
+                out[:len(vals)] = vals
+            return out
+
+        last_id = None
+        while True:
+            batch_query = query if last_id is None else query.where(tab.c.id > last_id)
+            rows = self.execall(batch_query.order_by(tab.c.id).limit(batch_size))
+            if len(rows) == 0:
+                break
+            last_id = rows[-1].id
+            cols = {name: [] for name in COLUMNAR_SITES}
+            counts = []
+            for row in rows:
+                try:
+                    labels = json.loads(row.atoms_sites)
+                except Exception:
+                    labels = []
+                nsites = len(labels)
+                counts.append(nsites)
+                cols['site_label'].extend(labels)
+                cols['site_symbol'].extend(site_symbol(label) or '' for label in labels)
+                for name, attr in (('site_x', 'atoms_x'), ('site_y', 'atoms_y'),
+                                   ('site_z', 'atoms_z'), ('site_u_iso', 'atoms_u_iso')):
+                    cols[name].append(fit(get_optfarray(getattr(row, attr)), nsites))
+                occupancy = fit(get_optfarray(row.atoms_occupancy), nsites, default=1.0)
+                cols['site_occupancy'].append(np.where(np.isnan(occupancy), 1.0, occupancy))
+
+            batch = {'id': np.array([row.id for row in rows], dtype=np.int64)}
+            for name in ('spacegroup_id', 'mineral_id', 'publication_id', 'year'):
+                batch[name] = np.array([-1 if getattr(row, name) is None else int(getattr(row, name))
+                                        for row in rows], dtype=np.int64)
+            batch['formula'] = np.array([row.formula or '' for row in rows], dtype=str)
+            batch['mineral'] = np.array([mineral_label(row.name, row.formula_title)
+                                         for row in rows], dtype=str)
+            batch['spacegroup'] = np.array([row.hm_notation or '' for row in rows], dtype=str)
+            batch['journal'] = np.array([row.journalname or '' for row in rows], dtype=str)
+            for name in CIF_FLOATCOLUMNS:
+                vals = [cif_float(getattr(row, name)) for row in rows]
+                batch[name] = np.array([np.nan if v is None else v for v in vals],
+                                       dtype=np.float64)
+            batch['site_count'] = np.array(counts, dtype=np.int64)
+            for name in ('site_label', 'site_symbol'):
+                batch[name] = np.array(cols[name], dtype=str)
+            for name in ('site_x', 'site_y', 'site_z', 'site_occupancy', 'site_u_iso'):
+                batch[name] = np.concatenate(cols[name]) if len(cols[name]) > 0 else np.zeros(0)
+            yield batch
+            if len(rows) < batch_size:
+                break
+
+    def export_columnar(self, path, batch_size=2000):
+        """export the summary columns and atom sites of all CIFs to a column
+        store, for analytics over the whole database with array operations.
+        The database is read in one pass, batch_size rows at a time.
+
+        Args:
+            path (str or Path): Parquet file if ending with '.parquet' (requires
+                pyarrow), otherwise a directory for one .npy file per column.
+            batch_size (int): number of CIFs per SELECT (and Parquet row group)
+
+        Returns:
+            number of CIFs exported.
+
+        Notes:
+            Use load_columnar(path) to read the columns, memory-mapped:
+            id, spacegroup_id, mineral_id, publication_id, year, formula,
+            mineral, spacegroup, journal, and the cell parameters, volume,
+            and density, with NaN for missing values, one value per CIF.
+            Atom sites are given as flat arrays site_label, site_symbol,
+            site_x, site_y, site_z, site_occupancy (1 if missing), and
+            site_u_iso, with the sites for the i-th CIF being
+            [site_offsets[i]:site_offsets[i+1]].
+        """
+        return save_columnar(path, self._columnar_batches(batch_size=max(1, int(batch_size))))
+
+    def has_descriptors(self):
+        "whether the table of CIF descriptors (cif_descriptors) exists"
+        return 'cif_descriptors' in self.tables
+
+    @_writer
+    def build_descriptors(self, rebuild=False):
+        """fill the table of CIF descriptors (see cif_descriptors()) used
+        by the descriptor filters of find_cifs(), creating it if needed.
+        Descriptors are added for all CIFs without them, or for all CIFs
+        with rebuild=True.
+
+        Returns:
+            number of CIFs for which descriptors were added
+        """
+        if self.read_only:
+            raise ValueError("cannot build descriptors for read-only database")
+        for stmt in descriptors_schema:
+            self.session.execute(text(stmt))
+        self.session.commit()
+        if 'cif_descriptors' not in self.tables:
+            Table('cif_descriptors', self.metadata, autoload_with=self.engine)
+        dtab = self.tables['cif_descriptors']
+        if rebuild:
+            self.session.execute(dtab.delete())
+        done = {row[0] for row in self.execall(select(dtab.c.cif_id))}
+
+        tab = self.tables['cif']
+        query = select(tab.c.id, tab.c.formula, tab.c.atoms_sites, tab.c.atoms_x,
+                       tab.c.atoms_y, tab.c.atoms_z, tab.c.atoms_occupancy,
+                       tab.c.atoms_aniso_label, tab.c.atoms_aniso_u11)
+        rows = []
+        for row in self.execall(query):
+            if row.id not in done:
+                rows.append(dict(cif_id=row.id, **cif_descriptors(*row[1:])))
+        if len(rows) > 0:
+            self.session.execute(dtab.insert(), rows)
+        self.session.commit()
+        return len(rows)
+
+    def has_fingerprints(self):
+        "whether the table of structural fingerprints (cif_fingerprints) exists"
+        return 'cif_fingerprints' in self.tables
+
+    def find_fingerprint(self, fingerprint):
+        "id of the CIF with a structural fingerprint, or None"
+        tab = self.tables['cif_fingerprints']
+        row = self.execone(select(tab.c.cif_id).where(tab.c.fingerprint==fingerprint))
+        return None if row is None else row[0]
+
+    @_writer
+    def build_fingerprints(self, rebuild=False):
+        """fill the table of structural fingerprints (see cif_fingerprint()),
+        creating it if needed.  Once this table exists, adding a CIF with the
+        fingerprint of a CIF in the database (the same cell, symmetry
+        operations, and atom sites, independent of labels and formatting)
+        either gives the id of that CIF or is rejected, see add_ciffile().
+
+        Fingerprints are unique: for CIFs already in the database with
+        the same fingerprint, only the first (lowest id) is recorded.
+
+        Returns:
+            dict of CIF ids for duplicates of earlier CIFs, {id: earlier_id}
+        """
+        if self.read_only:
+            raise ValueError("cannot build fingerprints for read-only database")
+        self.session.execute(text(fingerprint_schema))
+        self.session.commit()
+        if 'cif_fingerprints' not in self.tables:
+            Table('cif_fingerprints', self.metadata, autoload_with=self.engine)
+        ftab = self.tables['cif_fingerprints']
+        if rebuild:
+            self.session.execute(ftab.delete())
+        known = {row.fingerprint: row.cif_id for row in self.execall(ftab.select())}
+        done = set(known.values())
+
+        tab = self.tables['cif']
+        query = select(tab.c.id, tab.c.spacegroup_id, tab.c.a, tab.c.b, tab.c.c,
+                       tab.c.alpha, tab.c.beta, tab.c.gamma, tab.c.atoms_sites,
+                       tab.c.atoms_x, tab.c.atoms_y, tab.c.atoms_z,
+                       tab.c.atoms_occupancy).order_by(tab.c.id)
+        rows, duplicates = [], {}
+        for row in self.execall(query):
+            if row.id in done:
+                continue
+            sgroup = self.get_row_by_id('spacegroups', row.spacegroup_id)
+            try:
+                fingerprint = cif_fingerprint(sgroup.symmetry_xyz, **row._asdict())
+            except Exception:
+                continue
+            if fingerprint in known:
+                duplicates[row.id] = known[fingerprint]
+            else:
+                known[fingerprint] = row.id
+                rows.append({'cif_id': row.id, 'fingerprint': fingerprint})
+        if len(rows) > 0:
+            self.session.execute(ftab.insert(), rows)
+        self.session.commit()
+        return duplicates
+
+    def has_structure_cache(self):
+        "whether the cache of pymatgen structures (cif_structures) exists"
+        return 'cif_structures' in self.tables
+
+    def get_cached_structures(self, cif_id):
+        """return (pmg_cstruct, pmg_pstruct) for a CIF from the structure
+        cache, or None if not cached or cached with another pymatgen version"""
+        if not self.has_structure_cache() or Structure is None:
+            return None
+        tab = self.tables['cif_structures']
+        row = self.execone(select(tab.c.pmg_version, tab.c.pmg_cstruct,
+                                  tab.c.pmg_pstruct).where(tab.c.cif_id==cif_id))
+        if row is None or row.pmg_version != pmg_version:
+            return None
+        try:
+            return unpack_structure(row.pmg_cstruct), unpack_structure(row.pmg_pstruct)
+        except Exception:
+            return None
+
+    @_writer
+    def cache_structures(self, cif_id, cstruct, pstruct, commit=True):
+        "save pymatgen structures for a CIF to the structure cache, if it exists"
+        if not self.has_structure_cache() or self.read_only:
+            return
+        self.session.execute(text("""insert or replace into cif_structures
+              (cif_id, pmg_version, pmg_cstruct, pmg_pstruct) values (:id, :v, :c, :p)"""),
+              {'id': cif_id, 'v': pmg_version, 'c': pack_structure(cstruct),
+               'p': pack_structure(pstruct)})
+        if commit:
+            self.session.commit()
+
+    @_writer
+    def build_structure_cache(self, cif_ids=None, rebuild=False, batch_size=200):
+        """create the cache of pymatgen structures (table cif_structures) if
+        needed, and fill it for CIFs that are not cached, or were cached with
+        another version of pymatgen.  Once the table exists, structures are
+        also added to it as CifStructure.get_pmg_struct() parses them.
+
+        Args:
+            cif_ids (list or None): CIF ids to cache [None, all CIFs]
+            rebuild (bool): whether to parse cached CIFs again [False]
+            batch_size (int): number of CIFs per transaction [200]
+
+        Returns:
+            number of CIFs added to the cache
+        """
+        if CifParser is None:
+            raise ValueError("CifParser from pymatgen not available. Try 'pip install pymatgen'.")
+        if self.read_only:
+            raise ValueError("cannot build structure cache for read-only database")
+        self.session.execute(text(structure_cache_schema))
+        self.session.commit()
+        if 'cif_structures' not in self.tables:
+            Table('cif_structures', self.metadata, autoload_with=self.engine)
+
+        if cif_ids is None:
+            tab = self.tables['cif']
+            cif_ids = [row[0] for row in self.execall(select(tab.c.id).order_by(tab.c.id))]
+        if not rebuild:
+            stab = self.tables['cif_structures']
+            done = {row[0] for row in self.execall(
+                select(stab.c.cif_id).where(stab.c.pmg_version==pmg_version))}
+            cif_ids = [cid for cid in cif_ids if cid not in done]
+
+        count = 0
+        for chunk in id_chunks(cif_ids, size=batch_size):
+            for cif in self.get_cifs(chunk):
+                cif.get_pmg_struct(use_cache=False)
+                if cif.pmg_pstruct is not None:
+                    self.cache_structures(cif.ams_id, cif.pmg_cstruct,
+                                          cif.pmg_pstruct, commit=False)
+                    count += 1
+            self.session.commit()
+        return count
+
+    def has_textindex(self):
+        "whether the full-text search index (cif_fts table) exists"
+        query = text("select name from sqlite_master where type='table' and name='cif_fts'")
+        return self.execone(query) is not None
+
+    @_writer
+    def build_textindex(self):
+        """build the full-text search index (sqlite FTS5 table cif_fts) of
+        mineral names, compounds, formulas, formula and publication titles,
+        authors, and journal names.  An existing index will be rebuilt.
+        """
+        self.session.execute(text('drop table if exists cif_fts'))
+        self.session.execute(text(textindex_schema))
+        self.session.execute(text(textindex_insert))
+        self.session.execute(text("insert into cif_fts(cif_fts) values('optimize')"))
+        self.session.commit()
+
+    def search_text(self, query, limit=100, build=False):
+        """full-text search of mineral names, compounds, formulas, titles,
+        authors, and journal names
+
+        Args:
+            query (string): search words, using FTS5 query syntax, as with
+                'hematite', 'hema*', 'Downs AND quartz', or 'mineral: quartz'
+            limit (int): maximum number of CIF ids to return [100]
+            build (bool): whether to build a missing search index [False]
+
+        Returns:
+            list of CIF ids, ordered by relevance
+
+        Notes:
+           the search index must be built with build_textindex(), or by
+           passing build=True, which writes the index to the database file.
+        """
+        if not self.has_textindex():
+            if not build:
+                raise ValueError("no full-text index: use build_textindex() or search_text(..., build=True)")
+            if self.read_only:
+                raise ValueError("cannot build full-text index for read-only database")
+            self.build_textindex()
+        stmt = text("""select rowid from cif_fts where cif_fts match :query
+                       order by rank limit :limit""")
+        try:
+            rows = self.execall(stmt, {'query': query, 'limit': limit})
+        except OperationalError:
+            # not valid FTS5 syntax: search for the quoted words
+            self.session.rollback()
+            rows = self.execall(stmt, {'query': fts_quote(query), 'limit': limit})
+        return [row[0] for row in rows]
+
     def get_cif_elems(self):
         if self.cif_elems is None:
             out = {}
@@ -1176,127 +2632,572 @@ class AMCSD():
             self.cif_elems = out
         return self.cif_elems
 
-
-    def find_cifs(self, id=None, mineral_name=None, author_name=None,
-                  journal_name=None, contains_elements=None,
-                  excludes_elements=None, strict_contains=False,
-                  full_occupancy=False, max_matches=1000):
-        """return list of CIF Structures matching mineral, publication, or elements
+    def get_elem_masks(self):
+        """return element bitmasks for all CIFs, as a tuple of
+        (sorted ndarray of CIF ids, ndarray of uint64 bitmasks with one
+        bit per entry of ATOM_SYMS), built once from the cif_elements table
         """
-        if id is not None:
-            thiscif = self.get_cif(id)
-            if thiscif is not None:
-                return [thiscif]
+        if self.elem_masks is None:
+            tab = self.tables['cif_elements']
+            rows = self.execall(select(tab.c.cif_id, tab.c.element))
+            self.elem_masks = build_elements_bitmasks([int(r[0]) for r in rows],
+                                                      [r[1] for r in rows])
+        return self.elem_masks
+
+    def filter_elements(self, cif_ids, contains_elements=None,
+                        excludes_elements=None, strict_contains=False):
+        """filter a list of CIF ids by elements, using element bitmasks
+
+        contains_elements:  list of atomic symbols required to be in structure
+        excludes_elements:  list of atomic symbols required to NOT be in structure
+        strict_contains:    `contains_elements` is complete -- no other elements
+        """
+        if contains_elements is None and excludes_elements is None:
+            return list(cif_ids)
+        all_ids, masks = self.get_elem_masks()
+        keep = np.ones(len(all_ids), dtype=bool)
+        if contains_elements is not None:
+            if any(el not in ELEM_INDEX for el in contains_elements):
+                return []
+            want = elements_bitmask(contains_elements)
+            keep &= ((masks & want) == want).all(axis=1)
+            if strict_contains:
+                keep &= ((masks & ~want) == 0).all(axis=1)
+        if excludes_elements is not None:
+            keep &= ((masks & elements_bitmask(excludes_elements)) == 0).all(axis=1)
+
+        cif_ids = np.asarray(cif_ids, dtype=np.int64)
+        return cif_ids[np.isin(cif_ids, all_ids[keep])].tolist()
 
+    def get_compositions(self):
+        """return compositions for all CIFs, as a tuple of (sorted ndarray of
+        CIF ids, float32 ndarray of atomic fractions with one column per entry
+        of ATOM_SYMS), built once from the amounts in the cif_elements table,
+        or from the cif formulas where those are not available.
+        """
+        if self.compositions is None:
+            tab = self.tables['cif_elements']
+            ids, elems, amounts = [], [], []
+            missing = set()
+            if 'amount' in tab.columns:
+                for row in self.execall(select(tab.c.cif_id, tab.c.element, tab.c.amount)):
+                    if row.amount is None:
+                        missing.add(int(row.cif_id))
+                    else:
+                        ids.append(int(row.cif_id))
+                        elems.append(row.element)
+                        amounts.append(row.amount)
+            else:
+                missing = None
+            ctab = self.tables['cif']
+            query = select(ctab.c.id, ctab.c.formula)
+            if missing is None or len(missing) > 0:
+                for row in self.execall(query):
+                    if missing is not None and row.id not in missing:
+                        continue
+                    try:
+                        formula = chemparse(row.formula)
+                    except Exception:
+                        continue
+                    for elem, amount in formula.items():
+                        ids.append(int(row.id))
+                        elems.append(elem)
+                        amounts.append(amount)
+            self.compositions = build_composition_matrix(ids, elems, amounts)
+        return self.compositions
+
+    def filter_ratios(self, cif_ids, element_ratios):
+        """filter a list of CIF ids by atomic ratios of elements
+
+        element_ratios: dict of {'El1/El2': (min, max)}, with None for
+                        no limit, as with {'Fe/Ti': (2, 4)}.
+                        Structures without El2 are excluded.
+        """
+        if not element_ratios:
+            return list(cif_ids)
+        all_ids, comps = self.get_compositions()
+        keep = np.ones(len(all_ids), dtype=bool)
+        for ratio, vrange in element_ratios.items():
+            num, den = parse_ratio(ratio)
+            if not isinstance(vrange, (tuple, list)) or len(vrange) != 2:
+                raise ValueError(f"range for '{ratio}' must be (min, max)")
+            denom = comps[:, ELEM_INDEX[den]]
+            keep &= denom > 0
+            with np.errstate(divide='ignore', invalid='ignore'):
+                vals = comps[:, ELEM_INDEX[num]] / denom
+            vmin, vmax = vrange
+            if vmin is not None:
+                keep &= vals >= vmin
+            if vmax is not None:
+                keep &= vals <= vmax
+        cif_ids = np.asarray(cif_ids, dtype=np.int64)
+        return cif_ids[np.isin(cif_ids, all_ids[keep])].tolist()
+
+    def nearest_compositions(self, formula, k=10, metric='cosine', tol=None):
+        """return list of CIF ids with compositions nearest to a formula,
+        best match first.
+
+        Args:
+            formula (string or dict): formula, as 'Fe2.6Ti0.4O4', or dict
+                of {symbol: amount}
+            k (int): maximum number of ids to return [10]
+            metric (string): 'cosine' or 'l1' ['cosine']
+            tol (float or None): maximum distance [None, no limit]
+
+        Notes:
+            compositions are compared as atomic fractions. The 'cosine'
+            distance is 1 - cosine similarity, the 'l1' distance is the sum
+            of absolute differences of atomic fractions (0 to 2).
+        """
+        all_ids, comps = self.get_compositions()
+        if len(all_ids) == 0:
+            return []
+        query = composition_vector(formula)
+        metric = metric.lower()
+        if metric == 'cosine':
+            norms = np.linalg.norm(comps, axis=1) * np.linalg.norm(query)
+            norms[norms == 0] = np.inf
+            dist = 1.0 - (comps @ query) / norms
+        elif metric == 'l1':
+            dist = np.abs(comps - query).sum(axis=1)
+        else:
+            raise ValueError(f"unknown composition metric '{metric}'")
+        k = min(k, len(all_ids))
+        best = np.argpartition(dist, k-1)[:k]
+        best = best[np.argsort(dist[best], kind='stable')]
+        if tol is not None:
+            best = best[dist[best] <= tol]
+        return [int(i) for i in all_ids[best]]
+
+
+    def _find_query(self, mineral_name=None, author_name=None, journal_name=None,
+                    spacegroup=None, cell_ranges=None, descriptors=None,
+                    full_occupancy=False, order_by='id', after=None):
+        """build a single SELECT of CIF ids matching mineral, author, and
+        journal names, space group, and ranges of cell parameters.  Names are
+        matched case-insensitively, or as regular expressions if they contain
+        '*', '^', or '$' (see is_wildcard()). cell_ranges is a dict of
+        (min, max) values for the columns in CIF_FLOATCOLUMNS, with None for
+        no limit.  descriptors is a dict of (min, max) ranges for
+        DESCRIPTOR_RANGES and True/False for DESCRIPTOR_FLAGS, and
+        full_occupancy selects a minimum occupancy above 0.96, both
+        using the cif_descriptors table.
+        Rows of (id, order_key) are ordered by order_by (see
+        FIND_ORDERS), then by CIF id, so that the order is stable.  If given,
+        after=(order_key, id) of the last row already read selects only the
+        rows after that one, for keyset pagination.
+        """
         tabcif = self.tables['cif']
         tabmin = self.tables['minerals']
         tabpub = self.tables['publications']
         tabaut = self.tables['authors']
         tab_ap = self.tables['publication_authors']
-        tab_ce = self.tables['cif_elements']
-
-        matches = []
-        t0 = time.time()
-        if mineral_name is None:
-            mineral_name = ''
-        mineral_name = mineral_name.strip()
-
-        if mineral_name not in (None, '') and ('*' in mineral_name or
-                                               '^' in mineral_name or
-                                               '$' in mineral_name):
-            pattern = mineral_name.replace('*', '.*').replace('..*', '.*')
-            matches = []
-            for row in self.get_all('minerals'):
-                if re.search(pattern, row.name, flags=re.IGNORECASE) is not None:
-                    query = select(tabcif.c.id).where(tabcif.c.mineral_id==row.id)
-                    for m in [row[0] for row in self.execall(query)]:
-                        if m not in matches:
-                           matches.append(m)
-
-            if journal_name not in (None, ''):
-                pattern = journal_name.replace('*', '.*').replace('..*', '.*')
-                new_matches = []
-                for c in matches:
-                    pub_id = self.execone(select(tabcif.c.publication_id
-                                             ).where(tabcif.c.id==c))
-                    this_journal = self.execone(select(tabpub.c.journalname
-                                                   ).where(tabpub.c.id==pub_id))
-                    if re.search(pattern,  this_journal, flags=re.IGNORECASE) is not None:
-                        new_matches.append[c]
-                matches = new_matches
-
-
-        else: # strict mineral name or no mineral name
-            args = []
-            if mineral_name not in (None, ''):
-                args.append(func.lower(tabmin.c.name)==mineral_name.lower())
-                args.append(tabmin.c.id==tabcif.c.mineral_id)
-
-            if journal_name not in (None, ''):
-                args.append(func.lower(tabpub.c.journalname)==journal_name.lower())
-                args.append(tabpub.c.id==tabcif.c.publication_id)
-
-            if author_name not in (None, ''):
-                args.append(func.lower(tabaut.c.name)==author_name.lower())
-                args.append(tabcif.c.publication_id==tab_ap.c.publication_id)
-                args.append(tabaut.c.id==tab_ap.c.author_id)
-
-            query = select(tabcif.c.id)
-            if len(args) > 0:
-                query = select(tabcif.c.id).where(and_(*args))
-            matches = [row[0] for row in self.execall(query)]
-            matches = list(set(matches))
-        #
-        cif_elems = self.get_cif_elems()
-        if contains_elements is not None:
-            for el in contains_elements:
-                new_matches = []
-                for row in matches:
-                    if row in cif_elems and el in cif_elems[row]:
-                        new_matches.append(row)
-                matches = new_matches
 
-            if strict_contains:
-                excludes_elements = ATOM_SYMS[:]
-                for c in contains_elements:
-                    if c in excludes_elements:
-                        excludes_elements.remove(c)
-        if excludes_elements is not None:
-            bad = []
-            for el in excludes_elements:
-                for row in matches:
-                    if el in cif_elems[row] and row not in bad:
-                        bad.append(row)
-            for row in bad:
-                matches.remove(row)
-
-
-        if full_occupancy:
-            good = []
-            for cif_id in matches:
-                cif = self.execone(tabcif.select().where(tabcif.c.id==cif_id))
-                occ = get_optarray(getattr(cif, 'atoms_occupancy'))
-                if occ in ('0', 0, None):
-                    good.append(cif_id)
-                else:
+        def name_match(column, name):
+            if is_wildcard(name):
+                return column.op('REGEXP')(wildcard_pattern(name))
+            return func.lower(column)==name.lower()
+
+        args = []
+        if mineral_name not in (None, ''):
+            args.append(name_match(tabmin.c.name, mineral_name.strip()))
+            args.append(tabmin.c.id==tabcif.c.mineral_id)
+
+        if journal_name not in (None, ''):
+            args.append(name_match(tabpub.c.journalname, journal_name.strip()))
+            args.append(tabpub.c.id==tabcif.c.publication_id)
+
+        if author_name not in (None, ''):
+            args.append(name_match(tabaut.c.name, author_name.strip()))
+            args.append(tabcif.c.publication_id==tab_ap.c.publication_id)
+            args.append(tabaut.c.id==tab_ap.c.author_id)
+
+        if spacegroup not in (None, ''):
+            args.append(tabcif.c.spacegroup_id.in_(self.find_spacegroup_ids(spacegroup)))
+
+        if cell_ranges is not None:
+            for attr, limits in cell_ranges.items():
+                if limits is None:
+                    continue
+                if attr not in CIF_FLOATCOLUMNS:
+                    raise ValueError(f"cannot search by range of '{attr}'")
+                try:
+                    vmin, vmax = limits
+                except (TypeError, ValueError):
+                    raise ValueError(f"range of '{attr}' must be (min, max)")
+                col = tabcif.c[attr]
+                if self.schema_version < 2:
+                    col = cast(col, Float)
+                # values <= 0 are used for missing volume and density
+                args.append(col > 0)
+                if vmin is not None:
+                    args.append(col >= vmin)
+                if vmax is not None:
+                    args.append(col <= vmax)
+
+        if full_occupancy or descriptors:
+            if not self.has_descriptors():
+                raise ValueError("no CIF descriptors: use build_descriptors()")
+            tabdesc = self.tables['cif_descriptors']
+            args.append(tabdesc.c.cif_id==tabcif.c.id)
+            if full_occupancy:
+                args.append(tabdesc.c.min_occupancy > 0.96)
+            for attr, value in (descriptors or {}).items():
+                if value is None:
+                    continue
+                col = tabdesc.c[attr] if attr in tabdesc.columns else None
+                if attr in DESCRIPTOR_FLAGS:
+                    args.append(col == int(bool(value)))
+                elif attr in DESCRIPTOR_RANGES:
                     try:
-                        min_wt = min([float(x) for x in occ])
-                    except:
-                        min_wt = 0
-                    if min_wt > 0.96:
-                        good.append(cif_id)
-            matches = good
+                        vmin, vmax = value
+                    except (TypeError, ValueError):
+                        raise ValueError(f"range of '{attr}' must be (min, max)")
+                    if vmin is not None:
+                        args.append(col >= vmin)
+                    if vmax is not None:
+                        args.append(col <= vmax)
+                else:
+                    raise ValueError(f"cannot search by descriptor '{attr}'")
+
+        desc = order_by.startswith('-')
+        order_name = order_by.lstrip('-+').strip().lower()
+        if order_name not in FIND_ORDERS:
+            raise ValueError(f"cannot order by '{order_by}', use one of {FIND_ORDERS}")
+
+        source = tabcif
+        if order_name == 'id':
+            key = tabcif.c.id
+        elif order_name == 'mineral':
+            key = func.coalesce(func.lower(tabmin.c.name), '')
+            source = tabcif.outerjoin(tabmin, tabmin.c.id==tabcif.c.mineral_id)
+        elif order_name in ('year', 'journal'):
+            if order_name == 'journal':
+                key = func.coalesce(func.lower(tabpub.c.journalname), '')
+            else:
+                key = func.coalesce(tabpub.c.year, 0)
+            source = tabcif.outerjoin(tabpub, tabpub.c.id==tabcif.c.publication_id)
+        else:
+            key = tabcif.c[order_name]
+            if self.schema_version < 2:
+                key = cast(key, Float)
+            key = func.coalesce(key, 0)
+
+        if after is not None:
+            last_key, last_id = after
+            if order_name == 'id':
+                args.append(key < last_id if desc else key > last_id)
+            else:
+                beyond = key < last_key if desc else key > last_key
+                args.append(or_(beyond, and_(key == last_key, tabcif.c.id > last_id)))
+
+        query = select(tabcif.c.id, key.label('order_key')).select_from(source)
+        order = [key.desc() if desc else key]
+        if order_name != 'id':
+            order.append(tabcif.c.id)
+        query = query.distinct().order_by(*order)
+        if len(args) > 0:
+            query = query.where(and_(*args))
+        return query
+
+    def filter_occupancy(self, cif_ids, min_occupancy=0.96):
+        """filter a list of CIF ids to structures with all site occupancies
+        above min_occupancy, or with no occupancies given"""
+        tabcif = self.tables['cif']
+        good = set()
+        for chunk in id_chunks(cif_ids):
+            query = select(tabcif.c.id, tabcif.c.atoms_occupancy).where(tabcif.c.id.in_(chunk))
+            for row in self.execall(query):
+                occ = get_optfarray(row.atoms_occupancy)
+                # NaN for '?' or '.' fails the comparison
+                if occ is None or occ.min() > min_occupancy:
+                    good.add(row.id)
+        return [cif_id for cif_id in cif_ids if cif_id in good]
+
+    def _find_ids(self, order_by='id', offset=0, limit=None, batch_size=500,
+                  mineral_name=None, author_name=None, journal_name=None,
+                  contains_elements=None, excludes_elements=None,
+                  strict_contains=False, full_occupancy=False, spacegroup=None,
+                  a=None, b=None, c=None, alpha=None, beta=None, gamma=None,
+                  cell_volume=None, crystal_density=None, element_ratios=None,
+                  descriptors=None):
+        """generate lists of at most batch_size matching CIF ids, in order.
+        The SELECT is run one batch at a time, continuing after the last row
+        of the previous batch (keyset pagination), and the element, ratio,
+        and occupancy filters are applied to each batch.  The occupancy
+        filter is done in the SELECT if the CIF descriptors are available.
+        """
+        cell_ranges = dict(a=a, b=b, c=c, alpha=alpha, beta=beta, gamma=gamma,
+                           cell_volume=cell_volume, crystal_density=crystal_density)
+        sql_occupancy = full_occupancy and self.has_descriptors()
+        if sql_occupancy:
+            full_occupancy = False
+        criteria = dict(mineral_name=mineral_name, author_name=author_name,
+                        journal_name=journal_name, spacegroup=spacegroup,
+                        cell_ranges=cell_ranges, descriptors=descriptors,
+                        full_occupancy=sql_occupancy, order_by=order_by)
+        query = self._find_query(**criteria)
+        batch_size = max(1, int(batch_size))
+        offset = max(0, int(offset))
+        allowed = None
+        if (contains_elements is not None or excludes_elements is not None
+            or bool(element_ratios)):
+            allowed = self.get_elem_masks()[0]
+            allowed = self.filter_elements(allowed, contains_elements=contains_elements,
+                                           excludes_elements=excludes_elements,
+                                           strict_contains=strict_contains)
+            allowed = set(self.filter_ratios(allowed, element_ratios))
+        has_filters = allowed is not None or full_occupancy
+        sql_offset = 0
+        if not has_filters:
+            sql_offset, offset = offset, 0
+        while limit is None or limit > 0:
+            nrows = batch_size
+            if limit is not None and not has_filters:
+                nrows = min(nrows, limit)
+            if sql_offset > 0:
+                rows = self.execall(query.offset(sql_offset).limit(nrows))
+                sql_offset = 0
+            else:
+                rows = self.execall(query.limit(nrows))
+            if len(rows) == 0:
+                break
+            query = self._find_query(after=(rows[-1][1], rows[-1][0]), **criteria)
+            ids = [row[0] for row in rows]
+            if allowed is not None:
+                ids = [cif_id for cif_id in ids if cif_id in allowed]
+            if full_occupancy:
+                ids = self.filter_occupancy(ids)
+            if offset > 0:
+                nskip = min(offset, len(ids))
+                ids, offset = ids[nskip:], offset - nskip
+            if limit is not None:
+                ids = ids[:limit]
+                limit -= len(ids)
+            if len(ids) > 0:
+                yield ids
+            if len(rows) < nrows:
+                break
 
-        if len(matches) > max_matches:
-            matches = matches[:max_matches]
-        return [self.get_cif(cid) for cid in matches]
+    def iter_cifs(self, order_by='id', offset=0, limit=None, batch_size=200,
+                  as_ids=False, summary=False, **criteria):
+        """generate CIF Structures matching the criteria of find_cifs(),
+        reading batch_size structures at a time, so that large results can
+        be walked with constant memory.
+
+        order_by:    one of FIND_ORDERS, with a leading '-' for descending
+                     order, as 'mineral' or '-year'. Ties are ordered by CIF id.
+        offset:      number of matches to skip
+        limit:       maximum number of matches [None, no limit]
+        batch_size:  number of CIFs to read at a time
+        as_ids:      generate CIF ids instead of CIF Structures
+        summary:     generate CifSummary instead of CIF Structures
+
+        pages of results are given by offset and limit, as with
+            db.iter_cifs(mineral_name='quartz', offset=100, limit=50)
+        """
+        for batch in self._iter_batches(order_by=order_by, offset=offset, limit=limit,
+                                        batch_size=batch_size, as_ids=as_ids,
+                                        summary=summary, **criteria):
+            yield from batch
+
+    def _iter_batches(self, order_by='id', offset=0, limit=None, batch_size=200,
+                      as_ids=False, summary=False, **criteria):
+        "generate lists of CIF ids, CifSummary, or CIF Structures for iter_cifs()"
+        for ids in self._find_ids(order_by=order_by, offset=offset, limit=limit,
+                                  batch_size=batch_size, **criteria):
+            if as_ids:
+                yield ids
+            elif summary:
+                yield self.get_summaries(ids)
+            else:
+                # not kept in the CIF cache, which is for repeated lookups
+                yield self._read_cifs(ids)
+
+    def count_cifs(self, **criteria):
+        """return number of CIFs matching the criteria of find_cifs()"""
+        sql_only = all(criteria.get(key, None) in (None, False, {}) for key in
+                       ('contains_elements', 'excludes_elements', 'element_ratios'))
+        if not self.has_descriptors() and criteria.get('full_occupancy', False):
+            sql_only = False
+        if sql_only:
+            for key in ('contains_elements', 'excludes_elements', 'strict_contains',
+                        'element_ratios'):
+                criteria.pop(key, None)
+            cell_ranges = {key: criteria.pop(key) for key in CIF_FLOATCOLUMNS
+                           if key in criteria}
+            query = self._find_query(cell_ranges=cell_ranges, **criteria)
+            return self.execone(select(func.count()).select_from(query.subquery()))[0]
+        return sum(len(ids) for ids in self._find_ids(batch_size=5000, **criteria))
 
+    def find_cifs(self, id=None, mineral_name=None, author_name=None,
+                  journal_name=None, contains_elements=None,
+                  excludes_elements=None, strict_contains=False,
+                  full_occupancy=False, max_matches=1000, spacegroup=None,
+                  a=None, b=None, c=None, alpha=None, beta=None, gamma=None,
+                  cell_volume=None, crystal_density=None, element_ratios=None,
+                  descriptors=None, summary=False):
+        """return list of CIF Structures matching mineral, publication, elements,
+        space group, ranges of cell parameters, or CIF descriptors
+
+        spacegroup:  international space group number or Hermann-Mauguin symbol
+        element_ratios: dict of (min, max) ranges of atomic ratios, as
+             {'Fe/Ti': (2, 4)}, see filter_ratios()
+        descriptors: dict of (min, max) ranges of natoms, min_occupancy,
+             max_occupancy, n_elements, z_min, z_max, or True/False for
+             has_aniso or disordered, as {'natoms': (None, 4), 'disordered': False}.
+             These require the cif_descriptors table, see build_descriptors().
+        summary: return CifSummary (id, formula, mineral, year, journal)
+             instead of CIF Structures, read with a single query.
+        a, b, c, alpha, beta, gamma, cell_volume, crystal_density:
+             (min, max) range of values, with None for no limit, as with
+             a=(8.3, 8.5) or crystal_density=(5, None).
+        """
+        if id is not None:
+            thiscif = self.get_cif(id)
+            if thiscif is not None:
+                return [thiscif.summary() if summary else thiscif]
+
+        key = None
+        if self.search_cache.maxsize > 0:
+            self._check_caches()
+            generation = self.search_cache.generation
+            key = search_key(mineral_name=mineral_name, author_name=author_name,
+                             journal_name=journal_name,
+                             contains_elements=contains_elements,
+                             excludes_elements=excludes_elements,
+                             strict_contains=strict_contains,
+                             full_occupancy=full_occupancy, max_matches=max_matches,
+                             spacegroup=spacegroup, a=a, b=b, c=c, alpha=alpha,
+                             beta=beta, gamma=gamma, cell_volume=cell_volume,
+                             crystal_density=crystal_density,
+                             element_ratios=element_ratios,
+                             descriptors=descriptors, summary=summary)
+            found = self.search_cache.get(key)
+            if found is not None:
+                return list(found)
+
+        found = list(self.iter_cifs(limit=max_matches, batch_size=max_matches or 1000,
+                                   summary=summary,
+                                   mineral_name=mineral_name,
+                                   author_name=author_name,
+                                   journal_name=journal_name,
+                                   contains_elements=contains_elements,
+                                   excludes_elements=excludes_elements,
+                                   strict_contains=strict_contains,
+                                   full_occupancy=full_occupancy,
+                                   spacegroup=spacegroup, a=a, b=b, c=c,
+                                   alpha=alpha, beta=beta, gamma=gamma,
+                                   cell_volume=cell_volume,
+                                   crystal_density=crystal_density,
+                                   element_ratios=element_ratios,
+                                   descriptors=descriptors))
+        if key is not None:
+            self.search_cache.put(key, tuple(found), generation=generation)
+        return found
+
+    @_writer
     def set_hkls(self, cifid, hkls, degens):
         ctab = self.tables['cif']
         packed_hkls = pack_hkl_degen(hkls, degens)
         self.update(ctab, whereclause=(ctab.c.id == cifid), hkls=packed_hkls)
         return packed_hkls
 
+
+class AsyncAMCSD():
+    """asyncio interface to an AMCSD database, for use from an event loop:
+
+        adb = AsyncAMCSD()
+        cifs = await adb.find_cifs(mineral_name='hematite')
+        async for cif in adb.iter_cifs(contains_elements=['Fe', 'O']):
+            ...
+
+    Calls to AMCSD run in a pool of reader threads (see AMCSD for which
+    methods can be called concurrently), with at most max_concurrency calls
+    submitted at a time, and others waiting in the event loop.  Cancelling
+    a waiting call does not run it, and cancelling iter_cifs() stops it
+    before the next batch, but a call already running in a thread finishes.
+
+    Args:
+        db (AMCSD, str, or None): AMCSD instance or database file name
+            [None, get_amcsd()]
+        max_workers (int): number of reader threads [8]
+        max_concurrency (int or None): maximum number of calls submitted to
+            the reader threads [None, max_workers]
+    """
+    def __init__(self, db=None, max_workers=8, max_concurrency=None):
+        if db is None:
+            db = get_amcsd()
+        elif not isinstance(db, AMCSD):
+            db = AMCSD(db)
+        self.db = db
+        self.max_concurrency = max_concurrency or max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers,
+                                           thread_name_prefix='amcsd')
+        self._loop = None
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def close(self):
+        "shut down the reader threads, dropping calls not yet started"
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def run(self, func, *args, **kws):
+        """run func(*args, **kws) in a reader thread, as for any method of
+        self.db, once fewer than max_concurrency calls are running"""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # semaphore for the running loop
+            self._loop = loop
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self._semaphore:
+            return await loop.run_in_executor(self.executor, partial(func, *args, **kws))
+
+    async def get_cif(self, cif_id, as_strings=False):
+        "CIF Structure by id, see AMCSD.get_cif()"
+        return await self.run(self.db.get_cif, cif_id, as_strings=as_strings)
+
+    async def get_cifs(self, cif_ids, as_strings=False):
+        "list of CIF Structures for a list of ids, see AMCSD.get_cifs()"
+        return await self.run(self.db.get_cifs, cif_ids, as_strings=as_strings)
+
+    async def find_cifs(self, **criteria):
+        "list of matching CIF Structures, see AMCSD.find_cifs()"
+        return await self.run(self.db.find_cifs, **criteria)
+
+    async def count_cifs(self, **criteria):
+        "number of matching CIFs, see AMCSD.count_cifs()"
+        return await self.run(self.db.count_cifs, **criteria)
+
+    async def get_publications(self, **kws):
+        "list of publications, see AMCSD.get_publications()"
+        return await self.run(self.db.get_publications, **kws)
+
+    async def set_hkls(self, cifid, hkls, degens):
+        "save HKLs for a CIF, see AMCSD.set_hkls()"
+        return await self.run(self.db.set_hkls, cifid, hkls, degens)
+
+    async def iter_cifs(self, order_by='id', offset=0, limit=None, batch_size=200,
+                        as_ids=False, summary=False, **criteria):
+        """asynchronous generator of CIF Structures matching the criteria of
+        find_cifs(), reading batch_size CIFs at a time in a reader thread,
+        see AMCSD.iter_cifs()"""
+        batches = self.db._iter_batches(order_by=order_by, offset=offset, limit=limit,
+                                        batch_size=batch_size, as_ids=as_ids,
+                                        summary=summary, **criteria)
+        while True:
+            batch = await self.run(next, batches, None)
+            if batch is None:
+                break
+            for item in batch:
+                yield item
+
+
 def get_amcsd(download_full=True, timeout=30):
     """return instance of the AMCSD CIF Database
 
@@ -1333,11 +3234,11 @@ def get_amcsd(download_full=True, timeout=30):
             with open(dbfull, 'wb') as fh:
                 fh.write(req.content)
             print(f"Downloaded {url} to {dbfull}: {(time.time()-t0):.2f} sec")
-            time.sleep(0.25)
             _CIFDB = AMCSD(dbfull)
             return _CIFDB
     # download of full db must have failed, fallback to trimmed
-    return AMCSD()
+    _CIFDB = AMCSD()
+    return _CIFDB
 
 def get_cif(ams_id):
     """
@@ -1,36 +1,164 @@
 import os
+import re
+import json
+import zlib
+import hashlib
 import sqlite3
+import warnings
+import threading
+from functools import lru_cache
+from pathlib import Path
+from itertools import groupby
 from base64 import b64encode, b64decode
+from collections import OrderedDict
 
 import numpy as np
 
-from sqlalchemy import MetaData, create_engine, func, text, and_
+from sqlalchemy import MetaData, create_engine, func, text, and_, event
 from sqlalchemy.sql import select
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import SingletonThreadPool
+from sqlalchemy.pool import QueuePool
 
 try:
     from pymatgen.io.cif import CifParser
     from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
-    from pymatgen.core import Molecule, IMolecule, IStructure
+    from pymatgen.core import Molecule, IMolecule, IStructure, Structure
+    from pymatgen.symmetry.groups import SpaceGroup as PMGSpaceGroup
+    from pymatgen.core import Lattice as PMGLattice
+    from pymatgen.core import Composition, Element as PMGElement, Site as PMGSite
+    from pymatgen.core.periodic_table import get_el_sp
     from pymatgen.core import __version__ as pmg_version
 except:
-    CifParser = SpacegroupAnalyzer = None
-    Molecule = IMolecule = IStructure = None
+    CifParser = SpacegroupAnalyzer = PMGSpaceGroup = PMGLattice = None
+    Molecule = IMolecule = IStructure = Structure = None
+    Composition = PMGElement = PMGSite = get_el_sp = None
     pmg_version = None
 
+try:
+    import spglib
+except ImportError:
+    spglib = None
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from xraydb.chemparser import chemparse
+
 from .physical_constants import ATOM_SYMS, ATOM_NAMES
+from .utils import isotime
 
 __version__ = '1'
 
 PMG_CIF_OPTS = dict(occupancy_tolerance=10, site_tolerance=5e-3)
 
 
-def make_engine(dbname):
-    "create engine for sqlite connection"
-    return create_engine('sqlite:///%s' % (dbname),
-                         poolclass=SingletonThreadPool,
-                         connect_args={'check_same_thread': False})
+def reflect_metadata(engine):
+    """return MetaData reflected from engine.  Schema v2 uses indexes on
+    lower(name), which sqlalchemy cannot reflect and warns about."""
+    meta = MetaData()
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore', message='Skipped unsupported reflection')
+        meta.reflect(bind=engine)
+    return meta
+
+
+@lru_cache(maxsize=256)
+def compile_regexp(pattern):
+    "compiled, case-insensitive regular expression, cached by pattern"
+    return re.compile(pattern, flags=re.IGNORECASE)
+
+def sql_regexp(pattern, value):
+    """REGEXP function for sqlite: 'value REGEXP pattern' is true
+    for a case-insensitive match of pattern anywhere in value"""
+    if pattern is None or value is None:
+        return False
+    return compile_regexp(pattern).search(value) is not None
+
+def is_wildcard(name):
+    "whether a name is a wildcard pattern, containing '*', '^', or '$'"
+    return '*' in name or '^' in name or '$' in name
+
+def wildcard_pattern(name):
+    "convert a wildcard name with '*', '^', or '$' to a regular expression"
+    return name.replace('*', '.*').replace('..*', '.*')
+
+# default size of memory-mapped I/O for AMCSD databases, in bytes
+MMAP_SIZE = 2**28
+
+def make_engine(dbname, read_only=False, mmap_size=None):
+    """create engine for sqlite connection, with a REGEXP function, and a
+    pool of connections that can be used by any thread, one at a time.
+
+    With read_only=True, the file is opened with the URI
+    'file:<dbname>?mode=ro&immutable=1', so that sqlite does no locking or
+    change detection: the file must not be changed while it is open.
+    mmap_size sets the size in bytes for memory-mapped I/O [None, sqlite default]
+    """
+    if read_only:
+        uri = Path(os.path.abspath(dbname)).as_uri() + '?mode=ro&immutable=1'
+        def creator():
+            return sqlite3.connect(uri, uri=True, check_same_thread=False)
+        engine = create_engine('sqlite://', poolclass=QueuePool, pool_size=0,
+                               creator=creator)
+    else:
+        engine = create_engine('sqlite:///%s' % (dbname),
+                               poolclass=QueuePool, pool_size=0,
+                               connect_args={'check_same_thread': False})
+
+    @event.listens_for(engine, 'connect')
+    def add_regexp(dbapi_conn, conn_record):
+        dbapi_conn.create_function('regexp', 2, sql_regexp, deterministic=True)
+        if mmap_size is not None:
+            dbapi_conn.execute(f'pragma mmap_size={int(mmap_size)}')
+    return engine
+
+# schema fingerprints and reflected metadata, by file name
+SCHEMA_CACHE = {}
+METADATA_CACHE = {}
+
+def _file_key(dbname):
+    "size and modification time of a sqlite file and its write-ahead log"
+    key = []
+    for fname in (dbname, dbname + '-wal'):
+        if os.path.exists(fname):
+            stat = os.stat(fname)
+            key.extend((stat.st_size, stat.st_mtime_ns))
+    return tuple(key)
+
+def schema_fingerprint(dbname, refresh=False):
+    """return (fingerprint, table names) for the schema of a sqlite file,
+    from one query of sqlite_master.  This is kept by file name until the
+    size or modification time of the file changes, or refresh=True."""
+    dbname = os.path.abspath(dbname)
+    key = _file_key(dbname)
+    cached = SCHEMA_CACHE.get(dbname, None)
+    if not refresh and cached is not None and cached[0] == key:
+        return cached[1]
+    conn = sqlite3.connect(dbname)
+    try:
+        rows = conn.execute('SELECT type, name, tbl_name, sql FROM sqlite_master '
+                            'ORDER BY type, name').fetchall()
+    finally:
+        conn.close()
+    sha = hashlib.sha1(repr(rows).encode('utf-8'))
+    out = (sha.hexdigest(), tuple(row[1] for row in rows if row[0] == 'table'))
+    SCHEMA_CACHE[dbname] = (key, out)
+    return out
+
+def get_metadata(engine, dbname):
+    """return MetaData for a sqlite file, reflected only when the
+    schema fingerprint (see schema_fingerprint()) has changed"""
+    dbname = os.path.abspath(dbname)
+    fingerprint = schema_fingerprint(dbname)[0]
+    cached = METADATA_CACHE.get(dbname, None)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+    meta = reflect_metadata(engine)
+    METADATA_CACHE[dbname] = (fingerprint, meta)
+    return meta
 
 def isAMCSD(dbname):
     """whether a file is a valid AMCSD database
@@ -44,19 +172,17 @@ def isAMCSD(dbname):
     Notes:
       1. must be a sqlite db file, with tables
         'cif', 'elements', 'spacegroup'
+      2. the tables are read with schema_fingerprint()
     """
     _tables = ('cif', 'elements', 'spacegroups')
     result = False
     try:
-        engine = make_engine(dbname)
-        meta = MetaData()
-        meta.reflect(bind=engine)
-        result = all([t in meta.tables for t in _tables])
+        tables = schema_fingerprint(dbname)[1]
+        result = all([t in tables for t in _tables])
     except:
         pass
     return result
 
-
 farray_scale = 4.e6
 
 def encode_farray(dat):
@@ -97,6 +223,14 @@ def decode_farray(dat):
             out.append(f"{a:f}")
     return out
 
+def decode_farray_float(dat):
+    """decodes a string encoded by encode_farray()
+    returns float64 ndarray, with NaN for '?' and '.'
+    """
+    arr = np.frombuffer(b64decode(dat), dtype=np.int32)/farray_scale
+    arr[(abs(arr-2.0) < 1.e-5) | (abs(arr-3.0) < 1.e-5)] = np.nan
+    return arr.round(6)
+
 def put_optarray(dat, attr):
     d = dat.get(attr, '0')
     if d != '0':
@@ -108,6 +242,134 @@ def get_optarray(dat):
         dat = decode_farray(dat)
     return dat
 
+def get_optfarray(dat):
+    "float64 ndarray for an optional encoded array, or None"
+    if dat in (None, 0, '0'):
+        return None
+    return decode_farray_float(dat)
+
+
+class LRUCache():
+    """size-bounded cache, dropping the least recently used entries, with
+    counts of hits and misses, for use from several threads.  A maxsize of
+    0 disables the cache.  Values read before clear() are not stored if
+    put() is given the generation from before the read."""
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = self.misses = 0
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            if key in self.data:
+                self.data.move_to_end(key)
+                self.hits += 1
+                return self.data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value, generation=None):
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            self.data[key] = value
+            self.data.move_to_end(key)
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+            self.generation += 1
+
+    def stats(self):
+        "dict of hits, misses, size, and maxsize"
+        return dict(hits=self.hits, misses=self.misses, size=len(self.data),
+                    maxsize=self.maxsize)
+
+
+# element bitmasks: one bit per entry of ATOM_SYMS, packed into uint64 words
+ELEM_INDEX = {sym: i for i, sym in enumerate(ATOM_SYMS)}
+ELEM_MASK_WORDS = (len(ATOM_SYMS) + 63) // 64
+
+def elements_bitmask(elements):
+    """return element bitmask (ndarray of ELEM_MASK_WORDS uint64 words)
+    for a list of atomic symbols.  Symbols not in ATOM_SYMS are ignored.
+    """
+    mask = np.zeros(ELEM_MASK_WORDS, dtype=np.uint64)
+    for elem in elements:
+        i = ELEM_INDEX.get(elem, None)
+        if i is not None:
+            mask[i//64] |= np.uint64(1) << np.uint64(i % 64)
+    return mask
+
+def build_elements_bitmasks(cif_ids, elements):
+    """build element bitmasks from paired sequences of CIF ids and atomic symbols,
+    as from rows of the cif_elements table.
+
+    Returns
+    -------
+      ids:   sorted ndarray of unique CIF ids
+      masks: ndarray of shape (len(ids), ELEM_MASK_WORDS), dtype uint64
+    """
+    cif_ids = np.asarray(cif_ids, dtype=np.int64)
+    bits = np.array([ELEM_INDEX.get(e, -1) for e in elements], dtype=np.int64)
+    ids, index = np.unique(cif_ids, return_inverse=True)
+    masks = np.zeros((len(ids), ELEM_MASK_WORDS), dtype=np.uint64)
+    valid = bits >= 0
+    index, bits = index[valid], bits[valid]
+    np.bitwise_or.at(masks, (index, bits//64),
+                     np.left_shift(np.uint64(1), (bits % 64).astype(np.uint64)))
+    return ids, masks
+
+
+def build_composition_matrix(cif_ids, elements, amounts):
+    """build composition matrix from paired sequences of CIF ids, atomic
+    symbols, and amounts (formula units), as from rows of the cif_elements
+    table.  Each row is normalized to atomic fractions.
+
+    Returns
+    -------
+      ids:   sorted ndarray of unique CIF ids
+      comps: ndarray of shape (len(ids), len(ATOM_SYMS)), dtype float32
+    """
+    cif_ids = np.asarray(cif_ids, dtype=np.int64)
+    cols = np.array([ELEM_INDEX.get(e, -1) for e in elements], dtype=np.int64)
+    amounts = np.asarray(amounts, dtype=np.float64)
+    ids, index = np.unique(cif_ids, return_inverse=True)
+    comps = np.zeros((len(ids), len(ATOM_SYMS)), dtype=np.float64)
+    valid = (cols >= 0) & np.isfinite(amounts) & (amounts > 0)
+    np.add.at(comps, (index[valid], cols[valid]), amounts[valid])
+    total = comps.sum(axis=1)
+    total[total == 0] = 1.0
+    return ids, (comps / total[:, None]).astype(np.float32)
+
+def composition_vector(formula):
+    """return composition vector (atomic fractions, float32 ndarray of
+    len(ATOM_SYMS)) for a formula string or dict of {symbol: amount}"""
+    if isinstance(formula, str):
+        formula = chemparse(formula)
+    elems = list(formula.keys())
+    return build_composition_matrix([0]*len(elems), elems,
+                                    [formula[e] for e in elems])[1][0]
+
+def parse_ratio(ratio):
+    """return (numerator, denominator) atomic symbols for an element ratio
+    given as 'Fe/Ti' or ('Fe', 'Ti')"""
+    if isinstance(ratio, str):
+        ratio = ratio.split('/')
+    if len(ratio) != 2:
+        raise ValueError(f"element ratio must be given as 'El1/El2', not {ratio}")
+    num, den = [r.strip().title() for r in ratio]
+    for elem in (num, den):
+        if elem not in ELEM_INDEX:
+            raise ValueError(f"unknown element '{elem}' in element ratio")
+    return num, den
+
 
 schema = (
     '''CREATE TABLE version (id integer primary key, tag text, date text, notes text);''',
@@ -205,3 +467,845 @@ def create_amcsd(dbname='test.db'):
         if sym == 'D':
             atz = 1
         cursor.execute('insert into elements values (?,?,?,?)', (i, atz, sym, name))
+
+
+# full-text search index (sqlite FTS5), with rowid = cif.id
+textindex_schema = '''CREATE VIRTUAL TABLE cif_fts USING fts5(
+        mineral, compound, formula, formula_title, pub_title, authors, journal,
+        prefix='2 3', tokenize='unicode61 remove_diacritics 2');'''
+
+textindex_insert = '''INSERT INTO cif_fts (rowid, mineral, compound, formula,
+                                      formula_title, pub_title, authors, journal)
+    WITH pub_names AS (SELECT publication_authors.publication_id AS publication_id,
+                              group_concat(authors.name, '; ') AS names
+           FROM publication_authors
+           JOIN authors ON authors.id = publication_authors.author_id
+           GROUP BY publication_authors.publication_id)
+    SELECT cif.id, nullif(minerals.name, '<missing>'),
+           nullif(cif.compound, '<missing>'), cif.formula,
+           nullif(cif.formula_title, '<missing>'), nullif(cif.pub_title, '<missing>'),
+           pub_names.names, publications.journalname
+    FROM cif
+    LEFT JOIN minerals ON minerals.id = cif.mineral_id
+    LEFT JOIN publications ON publications.id = cif.publication_id
+    LEFT JOIN pub_names ON pub_names.publication_id = cif.publication_id'''
+
+def fts_quote(query):
+    """quote each word of a search string as an FTS5 string,
+    so that punctuation is not interpreted as FTS5 query syntax.
+    A trailing '*' on a word is kept as a prefix search."""
+    words = []
+    for word in query.split():
+        prefix = word.endswith('*')
+        word = word.strip('*').replace('"', '""')
+        if len(word) > 0:
+            words.append(f'"{word}"' + ('*' if prefix else ''))
+    return ' '.join(words)
+
+
+# schema v2: typed numeric cell columns, integer keys for cif_elements,
+# and indexes for the lookups done by AMCSD.find_cifs()
+SCHEMA_V2_TAG = 'schema v2'
+
+CIF_FLOATCOLUMNS = ('a', 'b', 'c', 'alpha', 'beta', 'gamma',
+                    'cell_volume', 'crystal_density')
+
+schema_v2 = (
+    '''CREATE TABLE cif (
+        id integer not null primary key,
+        mineral_id INTEGER,
+        spacegroup_id INTEGER,
+        publication_id INTEGER,
+        formula text,
+        compound text,
+        pub_title text,
+        formula_title text,
+        a real,
+        b real,
+        c real,
+        alpha real,
+        beta real,
+        gamma real,
+        cell_volume real,
+        crystal_density real,
+        atoms_sites text,
+        atoms_x text,
+        atoms_y text,
+        atoms_z text,
+        atoms_occupancy text,
+        atoms_u_iso text,
+        atoms_aniso_label text,
+        atoms_aniso_u11 text,
+        atoms_aniso_u22 text,
+        atoms_aniso_u33 text,
+        atoms_aniso_u12 text,
+        atoms_aniso_u13 text,
+        atoms_aniso_u23 text,
+        qdat text,
+        amcsd_url text,
+        url text,
+        hkls text,
+        FOREIGN KEY(spacegroup_id) REFERENCES spacegroups (id),
+        FOREIGN KEY(mineral_id) REFERENCES minerals (id),
+        FOREIGN KEY(publication_id) REFERENCES publications (id));''',
+
+    '''CREATE TABLE cif_elements (
+        cif_id integer not null,
+        element VARCHAR(2) not null,
+        FOREIGN KEY(cif_id) REFERENCES cif (id));''',
+    )
+
+schema_v2_indexes = (
+    'CREATE INDEX IF NOT EXISTS cif_mineral_idx ON cif (mineral_id)',
+    'CREATE INDEX IF NOT EXISTS cif_publication_idx ON cif (publication_id)',
+    'CREATE INDEX IF NOT EXISTS cif_spacegroup_idx ON cif (spacegroup_id)',
+    'CREATE INDEX IF NOT EXISTS cif_a_idx ON cif (a)',
+    'CREATE INDEX IF NOT EXISTS cif_b_idx ON cif (b)',
+    'CREATE INDEX IF NOT EXISTS cif_c_idx ON cif (c)',
+    'CREATE INDEX IF NOT EXISTS cif_volume_idx ON cif (cell_volume)',
+    'CREATE INDEX IF NOT EXISTS cif_density_idx ON cif (crystal_density)',
+    'CREATE INDEX IF NOT EXISTS cif_elements_cif_idx ON cif_elements (cif_id)',
+    'CREATE INDEX IF NOT EXISTS cif_elements_elem_idx ON cif_elements (element, cif_id)',
+    'CREATE INDEX IF NOT EXISTS minerals_lname_idx ON minerals (lower(name))',
+    'CREATE INDEX IF NOT EXISTS authors_lname_idx ON authors (lower(name))',
+    'CREATE INDEX IF NOT EXISTS publications_ljournal_idx ON publications (lower(journalname))',
+    'CREATE INDEX IF NOT EXISTS pubauth_pub_idx ON publication_authors (publication_id, author_id)',
+    'CREATE INDEX IF NOT EXISTS pubauth_auth_idx ON publication_authors (author_id, publication_id)',
+    )
+
+# per-CIF descriptors for AMCSD.find_cifs(), filled at ingest
+# and by AMCSD.build_descriptors()
+DESCRIPTOR_RANGES = ('natoms', 'min_occupancy', 'max_occupancy',
+                     'n_elements', 'z_min', 'z_max')
+DESCRIPTOR_FLAGS = ('has_aniso', 'disordered')
+
+descriptors_schema = (
+    '''CREATE TABLE IF NOT EXISTS cif_descriptors (
+        cif_id integer not null primary key,
+        natoms integer,
+        min_occupancy real,
+        max_occupancy real,
+        has_aniso integer,
+        n_elements integer,
+        z_min integer,
+        z_max integer,
+        disordered integer,
+        FOREIGN KEY(cif_id) REFERENCES cif (id));''',
+    'CREATE INDEX IF NOT EXISTS cif_desc_natoms_idx ON cif_descriptors (natoms)',
+    'CREATE INDEX IF NOT EXISTS cif_desc_minocc_idx ON cif_descriptors (min_occupancy)',
+    'CREATE INDEX IF NOT EXISTS cif_desc_nelem_idx ON cif_descriptors (n_elements)',
+    'CREATE INDEX IF NOT EXISTS cif_desc_zmax_idx ON cif_descriptors (z_max)',
+    )
+
+def cif_descriptors(formula, atoms_sites, atoms_x, atoms_y, atoms_z,
+                    atoms_occupancy, atoms_aniso_label, atoms_aniso_u11):
+    """return dict of descriptors for a CIF, from the values as stored in
+    the cif table (JSON site labels and encoded arrays)
+
+       natoms:         number of atom sites
+       min_occupancy:  minimum site occupancy (1.0 if not given, None
+                       if any occupancy is '?' or '.')
+       max_occupancy:  maximum site occupancy (1.0 if not given)
+       has_aniso:      whether anisotropic displacements are given
+       n_elements:     number of elements in formula
+       z_min, z_max:   range of atomic numbers in formula
+       disordered:     whether any site has occupancy < 0.99, or
+                       sites share the same position
+    """
+    sites = None
+    if atoms_sites not in (None, '0', '<missing>'):
+        sites = json.loads(atoms_sites)
+    natoms = 0 if not isinstance(sites, list) else len(sites)
+
+    occ = get_optfarray(atoms_occupancy)
+    # unknown occupancies give a NULL min_occupancy, failing any range,
+    # as NaN fails the comparison in AMCSD.filter_occupancy()
+    occ_unknown = occ is not None and not np.all(np.isfinite(occ))
+    if occ is not None:
+        occ = occ[np.isfinite(occ)]
+    if occ is None or len(occ) == 0:
+        occ = np.ones(1)
+
+    labels = None
+    if atoms_aniso_label not in (None, '0', '<missing>'):
+        labels = json.loads(atoms_aniso_label)
+    has_aniso = (isinstance(labels, list) and len(labels) > 0
+                 and atoms_aniso_u11 not in (None, 0, '0'))
+
+    disordered = occ.min() < 0.99
+    coords = [get_optfarray(x) for x in (atoms_x, atoms_y, atoms_z)]
+    if not disordered and all(x is not None for x in coords):
+        xyz = np.round(np.array(coords).T % 1.0, 3) % 1.0
+        disordered = len(np.unique(xyz, axis=0)) < len(xyz)
+
+    zvals = []
+    try:
+        zvals = [ELEM_INDEX[el]+1 for el in chemparse(formula) if el in ELEM_INDEX]
+    except Exception:
+        pass
+    return dict(natoms=natoms, min_occupancy=None if occ_unknown else float(occ.min()),
+                max_occupancy=float(occ.max()), has_aniso=int(has_aniso),
+                n_elements=len(zvals),
+                z_min=min(zvals) if len(zvals) > 0 else None,
+                z_max=max(zvals) if len(zvals) > 0 else None,
+                disordered=int(disordered))
+
+# cache of pymatgen structures, see AMCSD.build_structure_cache()
+structure_cache_schema = '''CREATE TABLE IF NOT EXISTS cif_structures (
+        cif_id integer not null primary key,
+        pmg_version text,
+        pmg_cstruct text,
+        pmg_pstruct text,
+        FOREIGN KEY(cif_id) REFERENCES cif (id));'''
+
+# structural fingerprints, see AMCSD.build_fingerprints()
+fingerprint_schema = '''CREATE TABLE IF NOT EXISTS cif_fingerprints (
+        cif_id integer not null primary key,
+        fingerprint text not null unique,
+        FOREIGN KEY(cif_id) REFERENCES cif (id));'''
+
+def structure_fingerprint(cell, symmetry_xyz, labels, fcoords, occupancy=None,
+                          length_digits=2, angle_digits=1, coord_digits=3,
+                          occupancy_digits=2):
+    """fingerprint of a CIF structure: SHA1 hash of the rounded cell
+    parameters, the set of symmetry operations, and the sorted list of
+    element, rounded fractional coordinates (in [0, 1)), and rounded
+    occupancy of the atom sites.  This does not depend on site labels,
+    the order of sites or symmetry operations, or the formatting of numbers.
+
+    Args:
+        cell (list): a, b, c, alpha, beta, gamma
+        symmetry_xyz (list or JSON string): CIF symmetry operations
+        labels (list of str): atom site labels
+        fcoords (ndarray): fractional coordinates, shape (nsites, 3)
+        occupancy (ndarray or None): site occupancies, NaN meaning 1.
+
+    Returns:
+        40 character hex string
+    """
+    cell = [round(float(v), length_digits) for v in cell[:3]] + [
+            round(float(v), angle_digits) for v in cell[3:]]
+    rots, trans = compile_symmetry_ops(symmetry_xyz)
+    trans = (trans % 1.0).round(4) % 1.0 + 0.0
+    ops = sorted((rot.flatten().tolist(), tr.tolist()) for rot, tr in zip(rots, trans))
+
+    fcoords = np.array(fcoords, dtype=np.float64).reshape(-1, 3)
+    fcoords = (fcoords % 1.0).round(coord_digits) % 1.0 + 0.0
+    if occupancy is None:
+        occupancy = np.ones(len(labels))
+    occupancy = np.where(np.isnan(occupancy), 1.0, occupancy).round(occupancy_digits) + 0.0
+    sites = []
+    for label, coord, occu in zip(labels, fcoords, occupancy):
+        symbol = site_symbol(label)
+        if symbol:
+            sites.append([symbol] + coord.tolist() + [float(occu)])
+    sites.sort()
+    dat = json.dumps([cell, ops, sites], separators=(',', ':'))
+    return hashlib.sha1(dat.encode('utf-8')).hexdigest()
+
+# manifest of CIF files added with AMCSD.sync_directory()
+manifest_schema = '''CREATE TABLE IF NOT EXISTS cif_files (
+        path text not null primary key,
+        size integer,
+        mtime integer,
+        hash text,
+        cif_id integer,
+        added integer,
+        FOREIGN KEY(cif_id) REFERENCES cif (id));'''
+
+def pack_structure(struct):
+    """serialize a pymatgen Structure to text for the structure cache:
+    base64 of compressed JSON of Structure.as_dict()"""
+    if struct is None:
+        return None
+    dat = json.dumps(struct.as_dict(verbosity=0), separators=(',', ':'))
+    return b64encode(zlib.compress(dat.encode('utf-8'))).decode('ascii')
+
+def unpack_structure(dat):
+    "pymatgen Structure from text made with pack_structure()"
+    if dat in (None, ''):
+        return None
+    return Structure.from_dict(json.loads(zlib.decompress(b64decode(dat))))
+
+
+# data blocks start with lines 'data_<name>', as split by pymatgen's CifFile
+CIF_BLOCK_START = re.compile(rb'^\s*data_(.*)$')
+CIF_BLOCK_SITES = re.compile(rb'^\s*_atom_site_fract_x\b')
+CIF_BLOCK_INDEX = {}
+
+def _cif_block_name(match):
+    return match.group(1).strip().decode('utf-8', errors='replace')
+
+def index_cif_blocks(filename):
+    """index of the data blocks in a CIF file, as a list of (name, start, end,
+    has_sites), with byte offsets and whether the block lists atom sites.
+    The file is scanned once and the index kept until the file size or
+    modification time changes.  As for pymatgen, text before the first block
+    and blocks of powder patterns are skipped."""
+    filename = os.path.abspath(filename)
+    stat = os.stat(filename)
+    key = (stat.st_size, stat.st_mtime_ns)
+    cached = CIF_BLOCK_INDEX.get(filename, None)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    blocks, offset = [], 0
+    with open(filename, 'rb') as fh:
+        for line in fh:
+            match = CIF_BLOCK_START.match(line)
+            if match is not None:
+                if len(blocks) > 0:
+                    blocks[-1][2] = offset
+                blocks.append([_cif_block_name(match), offset, None, False])
+            elif len(blocks) > 0 and CIF_BLOCK_SITES.match(line) is not None:
+                blocks[-1][3] = True
+            offset += len(line)
+    if len(blocks) > 0:
+        blocks[-1][2] = offset
+    blocks = [tuple(b) for b in blocks if 'powder_pattern' not in b[0]]
+    CIF_BLOCK_INDEX[filename] = (key, blocks)
+    return blocks
+
+def read_cif_block(filename, block=0):
+    """text of one data block of a CIF file, by index or name,
+    reading only that block (see index_cif_blocks())"""
+    blocks = index_cif_blocks(filename)
+    if isinstance(block, str):
+        blocks = [b for b in blocks if b[0] == block]
+        if len(blocks) == 0:
+            raise ValueError(f"no data block '{block}' in {filename}")
+        block = -1
+    name, start, end, has_sites = blocks[block]
+    with open(filename, 'rb') as fh:
+        fh.seek(start)
+        return fh.read(end - start).decode('utf-8', errors='replace')
+
+def iter_cif_blocks(filename):
+    """generator of (name, text) for the data blocks of a CIF file,
+    reading the file once and holding only one block at a time"""
+    name, lines = None, []
+    with open(filename, 'rb') as fh:
+        for line in fh:
+            match = CIF_BLOCK_START.match(line)
+            if match is not None:
+                if name is not None and 'powder_pattern' not in name:
+                    yield name, b''.join(lines).decode('utf-8', errors='replace')
+                name, lines = _cif_block_name(match), []
+            if name is not None:
+                lines.append(line)
+    if name is not None and 'powder_pattern' not in name:
+        yield name, b''.join(lines).decode('utf-8', errors='replace')
+
+
+# column store written by AMCSD.export_columnar(): one row per CIF, and
+# atom sites as flat arrays, with the sites of row i being
+# site_*[site_offsets[i]:site_offsets[i+1]]
+COLUMNAR_SITES = ('site_label', 'site_symbol', 'site_x', 'site_y', 'site_z',
+                  'site_occupancy', 'site_u_iso')
+
+def save_columnar(path, batches):
+    """write batches of columns (dicts of arrays, with site_count for the
+    number of sites of each row, see AMCSD.export_columnar()) to a column
+    store: a Parquet file if path ends with '.parquet' (requires pyarrow),
+    or else a directory of .npy files, one per column.
+    Returns the number of rows written."""
+    path = os.path.abspath(path)
+    nrows = 0
+    if path.endswith('.parquet'):
+        if pyarrow is None:
+            raise ValueError("pyarrow is needed to write Parquet. Try 'pip install pyarrow'.")
+        writer = None
+        for batch in batches:
+            offsets = np.concatenate(([0], np.cumsum(batch['site_count']))).astype(np.int32)
+            cols = {}
+            for name, arr in batch.items():
+                if name in COLUMNAR_SITES:
+                    cols[name] = pyarrow.ListArray.from_arrays(offsets, pyarrow.array(arr))
+                elif name != 'site_count':
+                    cols[name] = pyarrow.array(arr)
+            table = pyarrow.table(cols)
+            if writer is None:
+                writer = pyarrow.parquet.ParquetWriter(path, table.schema)
+            writer.write_table(table)
+            nrows += table.num_rows
+        if writer is not None:
+            writer.close()
+        return nrows
+
+    # each batch is appended as raw data to a .part file per column, and
+    # copied into the .npy file at the end, when the length of the column
+    # and the width of string columns are known
+    parts, offset = {}, 0
+    try:
+        for batch in batches:
+            if nrows == 0:
+                os.makedirs(path, exist_ok=True)
+            for name, arr in batch.items():
+                if name == 'site_count':
+                    name, arr = 'site_offsets', offset + np.cumsum(arr)
+                    offset = arr[-1] if len(arr) > 0 else offset
+                    if nrows == 0:
+                        arr = np.concatenate(([0], arr))
+                arr = np.ascontiguousarray(arr)
+                if name not in parts:
+                    parts[name] = (open(os.path.join(path, f'{name}.npy.part'), 'wb'), [])
+                arr.tofile(parts[name][0])
+                parts[name][1].append((arr.dtype, len(arr)))
+            nrows += len(batch['id'])
+    finally:
+        for fh, _ in parts.values():
+            fh.close()
+    if nrows == 0:
+        raise ValueError("no rows to write")
+    for name, (_, chunks) in parts.items():
+        dtype = np.result_type(*[dtype for dtype, _ in chunks])
+        size = sum(count for _, count in chunks)
+        fname = os.path.join(path, f'{name}.npy')
+        if size == 0:
+            np.save(fname, np.zeros(0, dtype=dtype))
+        else:
+            out = np.lib.format.open_memmap(fname, mode='w+', dtype=dtype, shape=(size,))
+            start = 0
+            with open(f'{fname}.part', 'rb') as fh:
+                for dtype, count in chunks:
+                    out[start:start+count] = np.fromfile(fh, dtype=dtype, count=count)
+                    start += count
+            out.flush()
+            del out
+        os.remove(f'{fname}.part')
+    return nrows
+
+def load_columnar(path):
+    """load a column store written by save_columnar(), as a dict of arrays.
+    Columns in a directory of .npy files are memory-mapped.  For Parquet,
+    the file is memory-mapped by pyarrow and the atom sites are given as
+    flat arrays and site_offsets, as for .npy files."""
+    path = os.path.abspath(path)
+    if not path.endswith('.parquet'):
+        return {fname[:-4]: np.load(os.path.join(path, fname), mmap_mode='r')
+                for fname in sorted(os.listdir(path)) if fname.endswith('.npy')}
+    if pyarrow is None:
+        raise ValueError("pyarrow is needed to read Parquet. Try 'pip install pyarrow'.")
+    table = pyarrow.parquet.read_table(path, memory_map=True)
+    columns = {}
+    for name in table.column_names:
+        col = table.column(name).combine_chunks()
+        if name in COLUMNAR_SITES:
+            if 'site_offsets' not in columns:
+                columns['site_offsets'] = col.offsets.to_numpy()
+            col = col.values
+        columns[name] = col.to_numpy(zero_copy_only=False)
+    return columns
+
+
+def cif_float(val):
+    """convert CIF numeric text to float, removing any '(esd)' suffix
+    and allowing ',' as decimal separator.
+
+    Returns None if the value cannot be converted.
+    """
+    if val is None:
+        return None
+    if isinstance(val, (int, float)):
+        return float(val)
+    val = str(val).strip(' ,')
+    if '(' in val:
+        val = val.split('(')[0]
+    if ',' in val and '.' not in val:
+        val = val.replace(',', '.')
+    try:
+        return float(val)
+    except ValueError:
+        return None
+
+
+SYMOP_TERM = re.compile(r'([+-]?)(\d*\.?\d+(?:/\d+)?)?\*?([xyz]?)')
+
+def parse_symop(xyz):
+    """parse a CIF symmetry operation such as '1/2+x,-y,z-x'
+
+    Returns
+    -------
+      rot:   3x3 integer rotation matrix
+      trans: translation vector
+    """
+    rot = np.zeros((3, 3), dtype=np.int32)
+    trans = np.zeros(3, dtype=np.float64)
+    terms = xyz.lower().replace(' ', '').split(',')
+    if len(terms) != 3:
+        raise ValueError(f"invalid symmetry operation '{xyz}'")
+    for i, term in enumerate(terms):
+        for sign, num, var in SYMOP_TERM.findall(term):
+            if num == '' and var == '':
+                continue
+            val = -1.0 if sign == '-' else 1.0
+            if '/' in num:
+                numer, denom = num.split('/')
+                val *= float(numer)/float(denom)
+            elif num != '':
+                val *= float(num)
+            if var == '':
+                trans[i] += val
+            else:
+                rot[i, 'xyz'.index(var)] += int(round(val))
+    return rot, trans
+
+def compile_symmetry_ops(symmetry_xyz):
+    """compile a list of CIF symmetry operations (list or JSON string)
+
+    Returns
+    -------
+      rots:   integer rotation matrices, shape (nops, 3, 3)
+      trans:  translation vectors, shape (nops, 3)
+    """
+    if isinstance(symmetry_xyz, str):
+        symmetry_xyz = json.loads(symmetry_xyz)
+    ops = [parse_symop(xyz) for xyz in symmetry_xyz]
+    if len(ops) == 0:
+        raise ValueError("no symmetry operations")
+    return (np.array([op[0] for op in ops], dtype=np.int32),
+            np.array([op[1] for op in ops], dtype=np.float64))
+
+
+# atom site labels as read by pymatgen CifParser
+SITE_SPECIAL_SYMBOLS = {'Hw': 'H', 'Ow': 'O', 'Wat': 'O', 'wat': 'O',
+                        'OH': '', 'OH2': '', 'NO3': 'N'}
+SITE_IMPLICIT_HYDROGENS = {'Wat': 2, 'wat': 2, 'O-H': 1}
+
+@lru_cache(maxsize=2048)
+def site_symbol(label):
+    """element symbol for a CIF atom site label, following pymatgen
+    CifParser: '' or None for labels that are not read as atoms"""
+    match = re.match('|'.join(SITE_SPECIAL_SYMBOLS), label)
+    if match:
+        return SITE_SPECIAL_SYMBOLS[match.group()]
+    if PMGElement.is_valid_symbol(label[:2].title()):
+        return label[:2].title()
+    if PMGElement.is_valid_symbol(label[0].upper()):
+        return label[0].upper()
+    match = re.match(r"w?[A-Z][a-z]*", label)
+    return None if match is None else match.group()
+
+def unique_fcoords(fcoords, known=None, tol=1.e-4):
+    """indices of fractional coordinates that are distinct, with periodic
+    boundaries, from each earlier kept coordinate and from known
+    coordinates, with the first of any duplicates kept"""
+    nknown = 0 if known is None else len(known)
+    ref = fcoords if nknown == 0 else np.concatenate((np.asarray(known), fcoords))
+    diff = fcoords[:, None, :] - ref[None, :, :]
+    diff -= np.round(diff)
+    close = (np.abs(diff) < tol).all(axis=2)
+    drop = close[:, :nknown].any(axis=1)
+    close = np.tril(close[:, nknown:], k=-1)
+    has_close = close.any(axis=1)
+    keep = ~drop & ~has_close
+    # a coordinate close to an earlier one is kept only if none of the
+    # earlier ones it is close to are kept: rare, as duplicates are exact
+    check = ~drop & has_close & ~close[:, keep].any(axis=1)
+    for i in np.where(check)[0]:
+        keep[i] = not (close[i, :i] & keep[:i]).any()
+    return np.where(keep)[0]
+
+def build_structure(cell, rots, trans, labels, fcoords, occupancy=None,
+                    site_tolerance=PMG_CIF_OPTS['site_tolerance'],
+                    occupancy_tolerance=PMG_CIF_OPTS['occupancy_tolerance'],
+                    frac_tolerance=1.e-4):
+    """pymatgen Structure for the conventional cell from the atom sites of
+    the asymmetric unit and compiled symmetry operations, following the
+    rules of CifParser.parse_structures(primitive=False): sites at the
+    same position are merged, positions are expanded by the symmetry
+    operations and duplicates removed, and occupancies above 1 are scaled.
+
+    Args:
+        cell (list): a, b, c, alpha, beta, gamma
+        rots, trans (ndarrays): symmetry operations from compile_symmetry_ops()
+        labels (list of str): atom site labels
+        fcoords (ndarray): fractional coordinates, shape (nsites, 3)
+        occupancy (ndarray or None): site occupancies, NaN meaning 1.
+
+    Returns:
+        pymatgen Structure
+    """
+    if Structure is None:
+        raise ValueError("pymatgen not available. Try 'pip install pymatgen'.")
+    fcoords = np.array(fcoords, dtype=np.float64).reshape(-1, 3)
+    if len(fcoords) != len(labels) or np.isnan(fcoords).any():
+        raise ValueError("undefined fractional coordinates")
+    for frac in (1/3, 2/3):
+        fcoords[np.abs(fcoords/frac - 1) <= frac_tolerance] = frac
+    if occupancy is None:
+        occupancy = np.ones(len(labels))
+    occupancy = np.where(np.isnan(occupancy), 1.0, occupancy)
+    lattice = PMGLattice.from_parameters(*cell)
+
+    # merge sites of the asymmetric unit at equivalent positions
+    asym_coords, asym_comps, asym_labels = [], [], []
+    for label, coord, occu in zip(labels, fcoords, occupancy):
+        symbol = site_symbol(label)
+        if not symbol or occu <= 0:
+            continue
+        comp = {get_el_sp(symbol): max(float(occu), 1.e-8)}
+        num_h = SITE_IMPLICIT_HYDROGENS.get(label[:3], 0)
+        if num_h > 0:
+            comp['H'] = num_h
+        comp = Composition(comp)
+        match = None
+        if len(asym_coords) > 0:
+            diff = (rots @ coord + trans)[:, None, :] - np.array(asym_coords)[None, :, :]
+            diff -= np.round(diff)
+            close = np.all(np.abs(diff) < site_tolerance, axis=2)
+            ops = np.where(close.any(axis=1))[0]
+            if len(ops) > 0:
+                match = np.argmax(close[ops[0]])
+        if match is None:
+            asym_coords.append(coord)
+            asym_comps.append(comp)
+            asym_labels.append(label)
+        else:
+            asym_comps[match] += comp
+            asym_labels[match] = label
+    if len(asym_coords) == 0:
+        raise ValueError("no atom sites")
+
+    # expand positions for sites with the same composition together
+    oxygen_hydrogen = {get_el_sp('O'), get_el_sp('H')}
+    groups = []
+    order = sorted(range(len(asym_comps)), key=lambda i: asym_comps[i])
+    for comp, group in groupby(order, key=lambda i: asym_comps[i]):
+        gcoords, glabels = [], []
+        for i in group:
+            images = rots @ asym_coords[i] + trans
+            images -= np.floor(images)
+            keep = unique_fcoords(images, known=gcoords, tol=site_tolerance)
+            gcoords.extend(images[keep])
+            glabels.extend([asym_labels[i]]*len(keep))
+        num_h = 0
+        if set(comp.elements) == oxygen_hydrogen:
+            num_h = comp['H']
+            comp = Composition({'O': comp['O']})
+        total_occu = sum(comp.values())
+        if total_occu > occupancy_tolerance:
+            raise ValueError(f"Occupancy {total_occu} exceeded tolerance.")
+        if total_occu > 1:
+            comp = comp / total_occu
+        groups.append((PMGSite(comp, gcoords[0]), comp, gcoords, glabels, num_h))
+
+    # order sites as Structure.get_sorted_structure(), which compares
+    # sites by species, so that whole groups can be sorted at once
+    species, coords, site_labels, hydrogens = [], [], [], []
+    for _, comp, gcoords, glabels, num_h in sorted(groups, key=lambda g: g[0]):
+        coords.extend(gcoords)
+        site_labels.extend(glabels)
+        species.extend([comp]*len(gcoords))
+        hydrogens.extend([num_h]*len(gcoords))
+
+    props = {}
+    if any(hydrogens):
+        props['implicit_hydrogens'] = hydrogens
+    return Structure(lattice, species, coords, site_properties=props,
+                     labels=site_labels)
+
+def spacegroup_number(symmetry_xyz):
+    """international space group number for a list of CIF symmetry
+    operations (list or JSON string), or None if it cannot be determined.
+    Requires spglib.
+    """
+    if spglib is None:
+        return None
+    if isinstance(symmetry_xyz, str):
+        symmetry_xyz = json.loads(symmetry_xyz)
+    try:
+        ops = [parse_symop(xyz) for xyz in symmetry_xyz]
+        rots = np.array([op[0] for op in ops])
+        trans = np.array([op[1] for op in ops]) % 1.0
+        with warnings.catch_warnings():
+            # spglib 2.x warns about its error handling on every call
+            warnings.simplefilter('ignore', DeprecationWarning)
+            sgtype = spglib.get_spacegroup_type_from_symmetry(rots, trans, symprec=1.e-3)
+    except Exception:
+        return None
+    return None if sgtype is None else int(sgtype.number)
+
+
+# centering translations for conventional cells, as fractional coordinates
+CENTERING_VECTORS = {'P': (),
+                     'A': ((0, 0.5, 0.5),),
+                     'B': ((0.5, 0, 0.5),),
+                     'C': ((0.5, 0.5, 0),),
+                     'I': ((0.5, 0.5, 0.5),),
+                     'F': ((0, 0.5, 0.5), (0.5, 0, 0.5), (0.5, 0.5, 0)),
+                     'R': ((2/3, 1/3, 1/3), (1/3, 2/3, 2/3))}
+
+def centering_vectors(symmetry_xyz):
+    """return list of the centering translations (fractional coordinates)
+    in a list of CIF symmetry operations (list or JSON string): the
+    translations of operations with an identity rotation"""
+    if isinstance(symmetry_xyz, str):
+        symmetry_xyz = json.loads(symmetry_xyz)
+    out = []
+    for xyz in symmetry_xyz:
+        rot, trans = parse_symop(xyz)
+        trans = trans % 1.0
+        if (rot == np.eye(3, dtype=np.int32)).all() and (trans > 1.e-4).any():
+            out.append(tuple(trans))
+    return out
+
+def niggli_cell(a, b, c, alpha, beta, gamma, centering=None):
+    """Niggli-reduced primitive cell for a unit cell with centering translations
+
+    Args:
+        a, b, c, alpha, beta, gamma (float): cell lengths and angles (in degrees)
+        centering (string, list or None): centering type ('P', 'A', 'B', 'C',
+            'I', 'F', 'R') or list of centering translations [None, primitive]
+
+    Returns:
+        ndarray of a, b, c, alpha, beta, gamma for the reduced cell.  Requires pymatgen.
+
+    Notes:
+        the primitive cell is built from the three shortest of the cell and
+        centering translations that span a cell with the primitive volume.
+    """
+    if isinstance(centering, str):
+        centering = CENTERING_VECTORS[centering.upper()[:1]]
+    matrix = PMGLattice.from_parameters(a, b, c, alpha, beta, gamma).matrix
+    if centering is not None and len(centering) > 0:
+        vectors = [np.array(v, dtype=np.float64) for v in centering] + list(np.eye(3))
+        target = 1.0/(len(centering) + 1)
+        vectors.sort(key=lambda v: np.linalg.norm(v @ matrix))
+        basis = None
+        for i in range(len(vectors)):
+            for j in range(i+1, len(vectors)):
+                for k in range(j+1, len(vectors)):
+                    frac = np.array([vectors[i], vectors[j], vectors[k]])
+                    if abs(abs(np.linalg.det(frac)) - target) < 1.e-4:
+                        basis = frac
+                        break
+                if basis is not None:
+                    break
+            if basis is not None:
+                break
+        if basis is None:
+            raise ValueError(f'could not find primitive cell for centering {centering}')
+        matrix = basis @ matrix
+    return np.array(PMGLattice(matrix).get_niggli_reduced_lattice().parameters)
+
+def cell_distances(cells, query):
+    """distances between an array of cells (shape (n, 6) as a, b, c, alpha,
+    beta, gamma) and a query cell: the root-sum-square of the relative
+    differences of the cell lengths and the differences of the cell angles
+    in radians.  Rows with NaN values get a distance of inf."""
+    query = np.asarray(query, dtype=np.float64)
+    rel = (cells[:, :3] - query[:3]) / query[:3]
+    ang = np.radians(cells[:, 3:] - query[3:])
+    dist = np.sqrt((rel*rel).sum(axis=1) + (ang*ang).sum(axis=1))
+    dist[np.isnan(dist)] = np.inf
+    return dist
+
+
+def get_schema_version(dbname):
+    """return schema version (1 or 2) of an AMCSD database file,
+    as recorded in the version table"""
+    conn = sqlite3.connect(dbname)
+    try:
+        tags = [row[0] for row in conn.execute('select tag from version')]
+    finally:
+        conn.close()
+    return 2 if SCHEMA_V2_TAG in tags else 1
+
+
+def upgrade_amcsd(dbname, outfile=None):
+    """upgrade an AMCSD database file to schema v2
+
+    Args:
+        dbname (string): name of AMCSD database file
+        outfile (string or None): name of upgraded file [None, upgrade in place]
+
+    Returns:
+        string: name of upgraded database file
+
+    Notes:
+      1. the numeric columns of the cif table (see CIF_FLOATCOLUMNS) are
+         converted from text with '(esd)' to real values.
+      2. cif_elements.cif_id is converted to integer.
+      3. indexes are created for the joins and case-insensitive lookups
+         of minerals, authors, and journals done in AMCSD.find_cifs(),
+         and for the cell lengths, volume, and density.
+      4. a 'number' column with the international space group number
+         (see spacegroup_number()) is added to the spacegroups table.
+      5. an 'amount' column with the number of atoms per formula unit
+         (from the cif formula) is added to the cif_elements table.
+      6. the upgrade is recorded in the version table, with
+         tag=SCHEMA_V2_TAG. Upgrading a v2 database will only add
+         missing indexes, space group numbers, and element amounts.
+    """
+    if outfile is not None and outfile != dbname:
+        src = sqlite3.connect(dbname)
+        dest = sqlite3.connect(outfile)
+        src.backup(dest)
+        src.close()
+        dest.close()
+        dbname = outfile
+
+    schema_version = get_schema_version(dbname)
+    # run the whole upgrade in one transaction, so that a failure leaves
+    # the database unchanged
+    conn = sqlite3.connect(dbname, isolation_level=None)
+    cursor = conn.cursor()
+    cursor.execute('begin')
+    try:
+        if schema_version < 2:
+            conn.create_function('cif_float', 1, cif_float, deterministic=True)
+            v1_columns = [row[1] for row in cursor.execute('pragma table_info(cif)')]
+
+            cursor.execute('alter table cif rename to cif_v1')
+            cursor.execute('alter table cif_elements rename to cif_elements_v1')
+            for s in schema_v2:
+                cursor.execute(s)
+            v2_columns = [row[1] for row in cursor.execute('pragma table_info(cif)')]
+
+            columns, values = [], []
+            for col in v2_columns:
+                if col in v1_columns:
+                    columns.append(col)
+                    values.append(f'cif_float({col})' if col in CIF_FLOATCOLUMNS else col)
+            columns, values = ', '.join(columns), ', '.join(values)
+            cursor.execute(f'insert into cif ({columns}) select {values} from cif_v1')
+            cursor.execute('''insert into cif_elements (cif_id, element)
+                   select distinct cast(cif_id as integer), element from cif_elements_v1''')
+            cursor.execute('drop table cif_v1')
+            cursor.execute('drop table cif_elements_v1')
+            cursor.execute('insert into version (tag, date, notes) values (?,?,?)',
+                           (SCHEMA_V2_TAG, isotime(), 'typed cell columns, integer cif_elements.cif_id, indexes'))
+
+        # indexes and space group numbers, also for databases upgraded earlier
+        for s in schema_v2_indexes:
+            cursor.execute(s)
+        sg_columns = [row[1] for row in cursor.execute('pragma table_info(spacegroups)')]
+        if 'number' not in sg_columns:
+            cursor.execute('alter table spacegroups add column number integer')
+        for sg_id, symmetry_xyz in cursor.execute(
+                'select id, symmetry_xyz from spacegroups where number is null').fetchall():
+            cursor.execute('update spacegroups set number=? where id=?',
+                           (spacegroup_number(symmetry_xyz), sg_id))
+
+        elem_columns = [row[1] for row in cursor.execute('pragma table_info(cif_elements)')]
+        if 'amount' not in elem_columns:
+            cursor.execute('alter table cif_elements add column amount real')
+        for cif_id, formula in cursor.execute(
+                """select distinct cif.id, cif.formula from cif join cif_elements
+                   on cif.id=cif_elements.cif_id where cif_elements.amount is null""").fetchall():
+            try:
+                amounts = chemparse(formula)
+            except Exception:
+                continue
+            for elem, amount in amounts.items():
+                cursor.execute('update cif_elements set amount=? where cif_id=? and element=?',
+                               (amount, cif_id, elem))
+    except:
+        cursor.execute('rollback')
+        conn.close()
+        raise
+    cursor.execute('commit')
+    cursor.execute('analyze')
+    cursor.execute('vacuum')
+    conn.close()
+    return dbname
@@ -79,17 +79,20 @@ class CIF_Cluster():
 
     """
     def __init__(self, ciftext=None, filename=None, absorber=None,
-                 absorber_site=1, with_h=False, cluster_size=8.0):
+                 absorber_site=1, with_h=False, cluster_size=8.0, struct=None):
         self.filename = filename
         self.ciftext = ciftext
         self.set_absorber(absorber)
         self.absorber_site = absorber_site
         self.with_h = with_h
         self.cluster_size = cluster_size
-        self.struct = None
+        self.struct = struct
         if ciftext is None and filename is not None:
             self.ciftext = open(filename, 'r').read()
-        if self.ciftext is not None:
+        if self.struct is not None:
+            # structure given, as from CifStructure.to_structure()
+            self.get_cif_sites()
+        elif self.ciftext is not None:
             self.parse_ciftext(self.ciftext)
 
     def set_absorber(self, absorber=None):
@@ -238,9 +241,10 @@ class CIF_Cluster():
         self.molecule = Molecule(self.symbols, self.coords)
 
 
-def cif_cluster(ciftext=None, filename=None, absorber=None):
+def cif_cluster(ciftext=None, filename=None, absorber=None, struct=None):
     "return list of sites for the structure"
-    return CIF_Cluster(ciftext=ciftext, filename=filename, absorber=absorber)
+    return CIF_Cluster(ciftext=ciftext, filename=filename, absorber=absorber,
+                       struct=struct)
 
 
 def cif_extra_titles(cifid):
@@ -275,7 +279,7 @@ def cif_extra_titles(cifid):
 
 def cif2feffinp(ciftext, absorber, template=None, edge=None, cluster_size=8.0,
                 absorber_site=None, extra_titles=None, with_h=False,
-                version8=True, rng_seed=None, cifid=None):
+                version8=True, rng_seed=None, cifid=None, struct=None):
 
     """convert CIF text to Feff8 or Feff6l input file
 
@@ -291,6 +295,7 @@ def cif2feffinp(ciftext, absorber, template=None, edge=None, cluster_size=8.0,
       with_h (bool):            whether to include H atoms [False]
       version8 (bool):          whether to write Feff8l input (see Note 5)[True]
       rng_seed (int or None):   seed for RNG to get reproducible occupancy selections [None]
+      struct (Structure or None): pymatgen structure to use instead of parsing ciftext [None]
     Returns
     -------
       text of Feff input file
@@ -319,7 +324,7 @@ def cif2feffinp(ciftext, absorber, template=None, edge=None, cluster_size=8.0,
     if template is None:
         template = open(Path(TEMPLATE_FOLDER, 'feff_exafs.tmpl'), 'r').read()
 
-    cluster = CIF_Cluster(ciftext=ciftext, absorber=absorber)
+    cluster = CIF_Cluster(ciftext=ciftext, absorber=absorber, struct=struct)
 
     if absorber_site is None:
         absorber_site = cluster.atom_sites[absorber][0]
@@ -20,7 +20,7 @@ from larixite.struct.xas import XasStructure
 from larixite.struct.xas_cif import XasStructureCif
 from larixite.struct.xas_xyz import XasStructureXyz
 from larixite.utils import get_logger, read_textfile
-from larixite.amcsd_utils import PMG_CIF_OPTS
+from larixite.amcsd_utils import PMG_CIF_OPTS, index_cif_blocks, read_cif_block
 
 logger = get_logger("larixite.struct")
 
@@ -51,6 +51,34 @@ def mol2struct(molecule: Molecule) -> Structure:
     return struct
 
 
+def get_cif_structure(filepath: Union[str, Path], frame: int = 0) -> Structure:
+    """Get one structure from a CIF file, parsing only the data block needed
+
+    As `CifParser(filepath).parse_structures(primitive=False)[frame]`, but
+    the data blocks with atom sites are found from an index of the file and
+    only the requested one is parsed, so that large multi-block files are
+    not fully parsed.
+
+    Parameters
+    ----------
+    filepath : str or Path
+        Filepath to CIF file
+    frame : int, optional
+        Index of the structure, counting only data blocks with atom sites
+
+    Returns
+    -------
+    Structure
+    """
+    iblocks = [i for i, block in enumerate(index_cif_blocks(filepath)) if block[3]]
+    try:
+        iblock = iblocks[frame]
+    except IndexError:
+        raise IndexError(f"no structure {frame} in CIF {filepath}")
+    parser = CifParser.from_str(read_cif_block(filepath, iblock), **PMG_CIF_OPTS)
+    return parser.parse_structures(primitive=False)[0]
+
+
 def get_structure(
     filepath: Union[str, Path], absorber: str, frame: int = 0
 ) -> XasStructure:
@@ -80,11 +108,7 @@ def get_structure(
     #: CIF
     if filepath.suffix == ".cif":
         try:
-            structs = CifParser(filepath, **PMG_CIF_OPTS)
-        except Exception:
-            raise ValueError(f"could not parse text of CIF from {filepath}")
-        try:
-            struct = structs.parse_structures(primitive=False)[frame]
+            struct = get_cif_structure(filepath, frame=frame)
         except Exception:
             raise ValueError(f"could not get structure {frame} from text of CIF {filepath}")
         molecule = Molecule.from_dict(struct.as_dict())
@@ -48,6 +48,7 @@ def connect(session, clear=False, cifid=None):
     global cifdb, config
     if cifdb is None:
         cifdb = get_amcsd()
+        cifdb.enable_caches()
 
     if config is None or clear:
         config = {'cifdict': {},
@@ -149,14 +150,15 @@ def cifs(cifid=None):
             all_cifs = cifdb.find_cifs(mineral_name=mineral,
                                        contains_elements=contains_elements,
                                        excludes_elements=excludes_elements,
-                                       strict_contains=strict, max_matches=500)
+                                       strict_contains=strict, max_matches=500,
+                                       summary=True)
 
             for cif in all_cifs:
                 try:
                     label = cif.formula.replace(' ', '')
-                    mineral = cif.get_mineralname()
-                    year = cif.publication.year
-                    journal= cif.publication.journalname
+                    mineral = cif.mineral
+                    year = cif.year
+                    journal= cif.journal
                     cid = cif.ams_id
                     label = f'{label}: {mineral}'
                     cite = f'{journal} {year}'
@@ -0,0 +1,738 @@
+import os
+import sys
+import asyncio
+import shutil
+import sqlite3
+import tarfile
+import subprocess
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from pathlib import Path
+import pytest
+import numpy as np
+from xraydb.chemparser import chemparse
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from larixite import get_amcsd
+from larixite.amcsd import AMCSD, AsyncAMCSD, read_ciffile, load_columnar
+from larixite import amcsd_utils
+from larixite.amcsd_utils import (upgrade_amcsd, get_schema_version, niggli_cell,
+                                  encode_farray, decode_farray, decode_farray_float,
+                                  compile_symmetry_ops, build_structure)
+
+
+def test_get_cifs():
+    db = get_amcsd()
+    cifids = [2762, 143, 2400]
+
+    cifs = db.get_cifs(cifids + [-1])
+    assert [cif.ams_id for cif in cifs] == cifids
+    for cif in cifs:
+        one = db.get_cif(cif.ams_id)
+        assert cif.ciftext == one.ciftext
+        assert cif.publication == one.publication
+        assert len(cif.publication.authors) > 0
+
+
+def test_find_cifs_elements():
+    db = get_amcsd()
+    cifs = db.find_cifs(contains_elements=['Fe', 'O'], strict_contains=True)
+    assert len(cifs) > 5
+    for cif in cifs:
+        assert sorted(chemparse(cif.formula).keys()) == ['Fe', 'O']
+
+    cifs = db.find_cifs(contains_elements=['Fe'], excludes_elements=['O', 'H'])
+    assert len(cifs) > 5
+    for cif in cifs:
+        elems = chemparse(cif.formula)
+        assert 'Fe' in elems and 'O' not in elems and 'H' not in elems
+
+    assert db.find_cifs(contains_elements=['Xx']) == []
+
+
+def test_find_cifs_wildcard():
+    db = get_amcsd()
+    cifs = db.find_cifs(mineral_name='hem*', journal_name='*mineralogist*')
+    assert len(cifs) > 0
+    for cif in cifs:
+        assert 'hem' in cif.get_mineralname().lower()
+        assert 'mineralogist' in cif.publication.journalname.lower()
+
+    cifs = db.find_cifs(mineral_name='quartz', author_name='*downs*')
+    assert len(cifs) > 0
+    for cif in cifs:
+        assert any('downs' in a.lower() for a in cif.publication.authors)
+
+    exact = db.find_cifs(mineral_name='hematite')
+    assert len(exact) <= len(db.find_cifs(mineral_name='^HEMATITE'))
+
+
+def test_find_cifs_ranges():
+    db = get_amcsd()
+    cifs = db.find_cifs(spacegroup='Fd-3m', a=(8.3, 8.5))
+    assert len(cifs) > 5
+    for cif in cifs:
+        assert 8.3 <= cif.a <= 8.5
+    assert len(cifs) == len(db.find_cifs(spacegroup=227, a=(8.3, 8.5)))
+
+    cifs = db.find_cifs(crystal_density=(5, None), contains_elements=['Fe'])
+    assert len(cifs) > 5
+    for cif in cifs:
+        assert cif.crystal_density >= 5
+
+    cifs = db.find_cifs(mineral_name='quartz', gamma=(119.9, 120.1),
+                        cell_volume=(100, 120))
+    for cif in cifs:
+        assert abs(cif.gamma - 120) < 0.1 and 100 <= cif.cell_volume <= 120
+
+
+def test_upgrade_v2(tmp_path):
+    db = get_amcsd()
+    dbname = upgrade_amcsd(db.dbname, Path(tmp_path, 'amcsd_v2.db').as_posix())
+    assert get_schema_version(dbname) == 2
+    assert upgrade_amcsd(dbname) == dbname
+
+    db2 = AMCSD(dbname)
+    assert db2.schema_version == 2
+    for cifid in (143, 2400, 2762):
+        cif1, cif2 = db.get_cif(cifid), db2.get_cif(cifid)
+        assert isinstance(cif2.a, float)
+        assert cif1.ciftext == cif2.ciftext
+    assert (len(db.find_cifs(mineral_name='hematite', contains_elements=['Fe'])) ==
+            len(db2.find_cifs(mineral_name='hematite', contains_elements=['Fe'])))
+    assert (len(db.find_cifs(spacegroup=14, c=(5, 6))) ==
+            len(db2.find_cifs(spacegroup=14, c=(5, 6))))
+    assert 'amount' in db2.tables['cif_elements'].columns
+    assert (len(db.find_cifs(element_ratios={'Fe/Ti': (2, 4)})) ==
+            len(db2.find_cifs(element_ratios={'Fe/Ti': (2, 4)})))
+
+
+def test_upgrade_v2_rollback(tmp_path, monkeypatch):
+    dbname = Path(tmp_path, 'amcsd_v1.db').as_posix()
+    shutil.copy(get_amcsd().dbname, dbname)
+
+    def fail(symmetry_xyz):
+        raise RuntimeError('interrupted upgrade')
+    monkeypatch.setattr(amcsd_utils, 'spacegroup_number', fail)
+    with pytest.raises(RuntimeError):
+        upgrade_amcsd(dbname)
+    assert get_schema_version(dbname) == 1
+    db = AMCSD(dbname)
+    assert 'cif_v1' not in db.tables
+    assert db.get_cif(143).formula == get_amcsd().get_cif(143).formula
+
+
+def test_search_text(tmp_path):
+    dbname = Path(tmp_path, 'amcsd_fts.db').as_posix()
+    shutil.copy(get_amcsd().dbname, dbname)
+    db = AMCSD(dbname)
+    assert not db.has_textindex()
+    with pytest.raises(ValueError):
+        db.search_text('hematite')
+    assert not db.has_textindex()
+    db.build_textindex()
+    assert db.has_textindex()
+
+    matches = db.search_text('hematite', limit=10)
+    assert 0 < len(matches) <= 10
+    assert db.get_cif(matches[0]).mineral.name.lower() == 'hematite'
+    assert 143 in db.search_text('hema*', limit=100)
+    # not valid FTS5 syntax: searched as quoted words
+    matches = db.search_text('high-pressure "quartz')
+    assert len(matches) > 0
+    assert matches == db.search_text('"high-pressure" "quartz"')
+    assert db.search_text('xxxqqqzzz') == []
+
+
+def test_nearest_cells(tmp_path):
+    dbname = Path(tmp_path, 'amcsd_cells.db').as_posix()
+    shutil.copy(get_amcsd().dbname, dbname)
+    db = AMCSD(dbname)
+    index_file = Path(tmp_path, 'amcsd_cells.npz').as_posix()
+    ids, cells = db.get_cell_index(filename=index_file)
+    assert len(ids) == cells.shape[0] and cells.shape[1] == 6
+
+    cif = db.get_cif(143)
+    matches = db.nearest_cells(cif.a, cif.b, cif.c, cif.alpha, cif.beta,
+                               cif.gamma, k=5, centering='R')
+    assert len(matches) == 5 and matches[0] == 143
+    assert 143 in db.nearest_cells(cif.a, cif.b, cif.c, cif.alpha, cif.beta,
+                                   cif.gamma, tol=1.e-3, centering='R')
+
+    # the primitive rhombohedral cell of hematite matches the hexagonal setting
+    prim = niggli_cell(cif.a, cif.b, cif.c, cif.alpha, cif.beta, cif.gamma, 'R')
+    db2 = AMCSD(db.dbname)
+    assert db2.nearest_cells(*prim, k=1, index_file=index_file) == [143]
+
+    # changing a cell invalidates both the index in memory and the saved index
+    fingerprint = str(np.load(index_file)['fingerprint'])
+    tab = db.tables['cif']
+    db.update(tab, whereclause=(tab.c.id == 143), a='5.5')
+    assert 143 not in db.nearest_cells(cif.a, cif.b, cif.c, cif.alpha, cif.beta,
+                                       cif.gamma, tol=1.e-3, centering='R',
+                                       index_file=index_file)
+    assert str(np.load(index_file)['fingerprint']) != fingerprint
+    assert db2.nearest_cells(*prim, k=1, index_file=index_file) != [143]
+
+    # a change by another connection is seen by every thread
+    db.update(tab, whereclause=(tab.c.id == 143), a=str(cif.a))
+    assert db.nearest_cells(*prim, k=1) == [143]
+    db2.update(tab, whereclause=(tab.c.id == 143), a='5.5')
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        assert pool.submit(db.nearest_cells, *prim, k=1).result() != [143]
+    assert db.nearest_cells(*prim, k=1) != [143]
+
+
+def test_compositions():
+    db = get_amcsd()
+    ids, comps = db.get_compositions()
+    assert comps.shape[0] == len(ids)
+    assert abs(comps[ids == 143].sum() - 1) < 1.e-5
+
+    cifs = db.find_cifs(element_ratios={'Fe/Ti': (2, 4)})
+    assert len(cifs) > 5
+    for cif in cifs:
+        elems = chemparse(cif.formula)
+        assert 2 <= elems['Fe']/elems['Ti'] <= 4
+
+    matches = db.nearest_compositions('Fe2.6Ti0.4O4', k=5)
+    assert len(matches) == 5
+    for cif in db.get_cifs(matches):
+        assert sorted(chemparse(cif.formula).keys()) == ['Fe', 'O', 'Ti']
+    for metric in ('cosine', 'l1'):
+        best = db.get_cif(db.nearest_compositions('Fe2O3', k=1, metric=metric)[0])
+        assert sorted(chemparse(best.formula).keys()) == ['Fe', 'O']
+    assert len(db.nearest_compositions({'Fe': 2, 'O': 3}, tol=1.e-5)) > 2
+
+
+def test_iter_cifs():
+    db = get_amcsd()
+    criteria = dict(contains_elements=['Fe'], excludes_elements=['H'])
+    ids = list(db.iter_cifs(as_ids=True, order_by='-year', **criteria))
+    assert len(ids) == db.count_cifs(**criteria) > 50
+    assert sorted(ids) == [cif.ams_id for cif in db.find_cifs(max_matches=None, **criteria)]
+
+    pages = []
+    for offset in range(0, len(ids), 100):
+        pages.extend(db.iter_cifs(as_ids=True, order_by='-year', offset=offset,
+                                  limit=100, batch_size=250, **criteria))
+    assert pages == ids
+
+    cifs = list(db.iter_cifs(mineral_name='quartz', order_by='a', limit=5))
+    assert len(cifs) == min(5, db.count_cifs(mineral_name='quartz'))
+    avals = [cif.a for cif in cifs]
+    assert avals == sorted(avals)
+    assert db.count_cifs(mineral_name='hematite') == len(db.find_cifs(mineral_name='hematite'))
+
+
+def test_descriptors(tmp_path):
+    dbname = Path(tmp_path, 'amcsd_desc.db').as_posix()
+    shutil.copy(get_amcsd().dbname, dbname)
+    db = AMCSD(dbname)
+    assert not db.has_descriptors()
+    with pytest.raises(ValueError):
+        db.find_cifs(descriptors={'natoms': (None, 2)})
+    # an unknown occupancy fails full_occupancy, with or without descriptors
+    tab = db.tables['cif']
+    assert 143 in db.iter_cifs(full_occupancy=True, as_ids=True)
+    db.update(tab, whereclause=(tab.c.id == 143),
+              atoms_occupancy=encode_farray(['?', '1.0']))
+    assert 143 not in db.iter_cifs(full_occupancy=True, as_ids=True)
+    full = db.count_cifs(full_occupancy=True)
+
+    assert db.build_descriptors() == db.count_cifs()
+    assert db.has_descriptors() and db.build_descriptors() == 0
+    assert db.count_cifs(full_occupancy=True) == full
+    assert 143 not in db.iter_cifs(full_occupancy=True, as_ids=True)
+
+    cifs = db.find_cifs(descriptors={'natoms': (None, 2), 'has_aniso': True},
+                        contains_elements=['Fe'])
+    assert len(cifs) > 0
+    for cif in cifs:
+        assert cif.natoms <= 2 and cif.atoms_aniso_label not in (None, '<missing>')
+    for cif in db.find_cifs(descriptors={'z_max': (None, 14), 'disordered': False},
+                            max_matches=20):
+        assert all(el in ('H', 'He', 'Li', 'Be', 'B', 'C', 'N', 'O', 'F', 'Ne',
+                          'Na', 'Mg', 'Al', 'Si') for el in chemparse(cif.formula))
+        if cif.atoms_occupancy is not None:
+            assert cif.atoms_occupancy.min() >= 0.99
+    assert (db.count_cifs(descriptors={'disordered': True}) +
+            db.count_cifs(descriptors={'disordered': False})) == db.count_cifs()
+
+
+def test_decode_farray():
+    vals = ['0.25', '-0.1234567', '?', '0.5(3)', '.', '1']
+    enc = encode_farray(vals)
+    out = decode_farray_float(enc)
+    assert out.dtype == np.float64
+    assert list(np.isnan(out)) == [False, False, True, False, True, False]
+    strs = decode_farray(enc)
+    for sval, fval in zip(strs, out):
+        if sval in ('?', '.'):
+            assert np.isnan(fval)
+        else:
+            assert float(sval) == fval
+
+    db = get_amcsd()
+    cif, scif = db.get_cif(143), db.get_cif(143, as_strings=True)
+    for attr in ('atoms_x', 'atoms_y', 'atoms_z', 'atoms_aniso_u11'):
+        arr = getattr(cif, attr)
+        assert isinstance(arr, np.ndarray) and arr.dtype == np.float64
+        assert np.allclose(arr, [float(x) for x in getattr(scif, attr)])
+
+
+def test_cifstructure_lazy():
+    db = get_amcsd()
+    cif = db.get_cif(143)
+    assert not hasattr(cif, '__dict__')
+    assert cif.natoms == 2 and len(cif.atoms_x) == 2
+    assert cif.hm_symbol == cif.spacegroup.hm_notation.split('%var')[0]
+    assert 'hematite' in cif.ciftext.lower()
+
+    summary = cif.summary()
+    assert summary.ams_id == 143 and summary.formula == cif.formula
+    assert summary.mineral == cif.get_mineralname()
+    assert summary.year == cif.publication.year
+    assert summary.journal == cif.publication.journalname
+
+    cifs = db.find_cifs(mineral_name='hematite')
+    summaries = db.find_cifs(mineral_name='hematite', summary=True)
+    assert [c.summary() for c in cifs] == summaries
+    assert db.get_summaries([143, -1]) == [summary]
+
+
+def test_structure_cache(tmp_path):
+    dbfile = tmp_path / 'amcsd_cache.db'
+    shutil.copy(get_amcsd().dbname, dbfile)
+    db = AMCSD(dbfile)
+    assert not db.has_structure_cache()
+    assert db.build_structure_cache([143, 2400]) == 2
+    assert db.has_structure_cache()
+    assert db.build_structure_cache([143, 2400]) == 0
+
+    parsed = AMCSD(dbfile).get_cif(143)
+    parsed.get_pmg_struct(use_cache=False)
+    cstruct, pstruct = AMCSD(dbfile).get_cached_structures(143)
+    assert cstruct == parsed.pmg_cstruct and pstruct == parsed.pmg_pstruct
+
+    cif = AMCSD(dbfile).get_cif(143)
+    cif.get_pmg_struct()
+    assert cif.pmg_pstruct == parsed.pmg_pstruct
+    assert cif.get_sites() == parsed.get_sites()
+
+    # updating the cell drops the cached structures and remakes descriptors
+    db.build_descriptors()
+    db.build_fingerprints()
+    query = text('select fingerprint from cif_fingerprints where cif_id=143')
+    fingerprint = db.execone(query)[0]
+    tab = db.tables['cif']
+    db.update(tab, whereclause=(tab.c.id == 143), a='5.5', b='5.5')
+    assert db.get_cached_structures(143) is None
+    assert db.get_cached_structures(2400) is not None
+    cif = db.get_cif(143)
+    cif.get_pmg_struct()
+    assert cif.pmg_cstruct.lattice.a == pytest.approx(5.5)
+    assert db.execone(text('select count(*) from cif_descriptors where cif_id=143'))[0] == 1
+    assert db.execone(query)[0] != fingerprint
+
+
+def test_to_structure():
+    db = get_amcsd()
+    rots, trans = db.get_symmetry_ops(db.get_cif(143).spacegroup.id)
+    assert rots.shape == (len(trans), 3, 3) and rots.dtype.kind == 'i'
+    for cif in db.get_cifs([143, 2400, 2762]) + [db.get_cif(143, as_strings=True)]:
+        struct = cif.to_structure()
+        parsed = cif.parse_structure()
+        assert struct == parsed
+        assert [site.label for site in struct] == [site.label for site in parsed]
+
+    # disordered site merged, inversion images of the O site expanded
+    rots, trans = compile_symmetry_ops(['x,y,z', '-x,-y,-z'])
+    struct = build_structure([5, 5, 5, 90, 90, 90], rots, trans, ['Fe1', 'Mg1', 'O1'],
+                             [[0, 0, 0], [0, 0, 0], [0.25, 0.25, 0.25]],
+                             occupancy=np.array([0.5, 0.5, np.nan]))
+    assert len(struct) == 3
+    assert struct[0].species.as_dict() == {'Fe': 0.5, 'Mg': 0.5}
+    assert np.allclose(struct[2].frac_coords, [0.75, 0.75, 0.75])
+
+
+def test_add_ciffiles(tmp_path):
+    ids = [143, 2400, 2762]
+    dbfile = tmp_path / 'amcsd_add.db'
+    shutil.copy(get_amcsd().dbname, dbfile)
+    files = []
+    for cif in get_amcsd().get_cifs(ids):
+        files.append(tmp_path / f'{cif.ams_id}.cif')
+        files[-1].write_text(cif.ciftext)
+    files.append(tmp_path / 'bad.cif')
+    files[-1].write_text('data_bad\n_cell_length_a 1.0\n')
+
+    db = AMCSD(dbfile)
+    orig = {cif.ams_id: cif for cif in db.get_cifs(ids)}
+    db.build_textindex()
+    for cif_id in ids:
+        db.delete_cif(cif_id)
+    assert db.get_cifs(ids) == [] and 143 not in db.search_text('hematite')
+
+    cif_ids, errors = db.add_ciffiles(files, workers=2, batch_size=2)
+    assert cif_ids == ids
+    assert 143 in db.search_text('hematite')
+    assert list(errors) == [str(files[-1])]
+    for cif in db.get_cifs(ids):
+        assert cif.formula == orig[cif.ams_id].formula
+        assert cif.spacegroup.id == orig[cif.ams_id].spacegroup.id
+        assert np.allclose(cif.atoms_x, orig[cif.ams_id].atoms_x)
+    # already added: same ids, nothing new
+    ncifs = db.count_cifs()
+    assert db.add_ciffiles(files[:2], workers=1)[0] == ids[:2]
+    assert db.count_cifs() == ncifs
+
+
+def test_sync_directory(tmp_path):
+    ids = [143, 2400, 2762]
+    dbfile = tmp_path / 'amcsd_sync.db'
+    shutil.copy(get_amcsd().dbname, dbfile)
+    db = AMCSD(dbfile)
+    cifdir = tmp_path / 'cifs'
+    cifdir.mkdir()
+    for cif in db.get_cifs(ids + [2763]):
+        (cifdir / f'{cif.ams_id}.cif').write_text(cif.ciftext)
+    ctab, etab = db.tables['cif'], db.tables['cif_elements']
+    db.session.execute(etab.delete().where(etab.c.cif_id.in_(ids)))
+    db.session.execute(ctab.delete().where(ctab.c.id.in_(ids)))
+    db.session.commit()
+    ncifs = db.count_cifs()
+
+    out = db.sync_directory(cifdir, workers=1)
+    assert len(out['added']) == 4 and out['unchanged'] == 0
+    assert db.count_cifs() == ncifs + 3
+
+    # unchanged and touched files are not read again
+    (cifdir / '143.cif').touch()
+    (cifdir / 'bad.cif').write_text('data_bad\n')
+    out = db.sync_directory(cifdir, workers=1)
+    assert out['unchanged'] == 4 and out['added'] == [] and len(out['errors']) == 1
+    assert db.sync_directory(cifdir, workers=1)['unchanged'] == 5
+
+    # changed file keeps its CIF id
+    fname = cifdir / '2400.cif'
+    lines = [line if not line.startswith('_cell_volume') else '_cell_volume 999.0'
+             for line in fname.read_text().split('\n')]
+    fname.write_text('\n'.join(lines))
+    out = db.sync_directory(cifdir, workers=1)
+    assert out['updated'] == [fname.absolute().as_posix()]
+    assert float(db.get_cif(2400).cell_volume) == 999.0
+
+    # changed file that cannot be read keeps its CIF until read again
+    ciftext = fname.read_text()
+    fname.write_text('data_bad\n')
+    out = db.sync_directory(cifdir, workers=1)
+    assert list(out['errors']) == [fname.absolute().as_posix()]
+    assert float(db.get_cif(2400).cell_volume) == 999.0
+    fname.write_text(ciftext.replace('_cell_volume 999.0', '_cell_volume 998.0'))
+    out = db.sync_directory(cifdir, workers=1)
+    assert out['updated'] == [fname.absolute().as_posix()]
+    assert float(db.get_cif(2400).cell_volume) == 998.0
+
+    # retire only removes files from the directory synced
+    otherdir = tmp_path / 'other'
+    otherdir.mkdir()
+    assert db.sync_directory(otherdir, retire=True, workers=1)['retired'] == []
+    assert db.count_cifs() == ncifs + 3
+
+    # removed files: only CIFs added from those files are deleted
+    (cifdir / '2762.cif').unlink()
+    (cifdir / '2763.cif').unlink()
+    assert len(db.sync_directory(cifdir, workers=1)['retired']) == 0
+    assert len(db.sync_directory(cifdir, retire=True, workers=1)['retired']) == 2
+    assert db.get_cif(2762) is None and db.get_cif(2763) is not None
+    assert db.count_cifs() == ncifs + 2
+
+
+def test_fingerprints(tmp_path):
+    dbfile = tmp_path / 'amcsd_fp.db'
+    shutil.copy(get_amcsd().dbname, dbfile)
+    db = AMCSD(dbfile)
+    ncifs = db.count_cifs()
+    duplicates = db.build_fingerprints()
+    assert db.has_fingerprints()
+    assert all(dup > first for dup, first in duplicates.items())
+
+    # same structure with other formatting and a new AMCSD code
+    ciftext = db.get_cif(143).ciftext
+    ciftext = ciftext.replace('_database_code_amcsd 143', '_database_code_amcsd 99143')
+    ciftext = ciftext.replace('_cell_length_a 5.038', '_cell_length_a 5.0380')
+    fname = tmp_path / 'hematite.cif'
+    fname.write_text(ciftext)
+    assert db.add_ciffile(fname) == 143
+    ids, errors = db.add_ciffiles([fname], workers=1, duplicates='reject')
+    assert ids == [] and 'CIF 143' in errors[fname.as_posix()]
+    assert db.count_cifs() == ncifs
+
+    # a different structure is added and fingerprinted
+    fname.write_text(ciftext.replace('_cell_length_a 5.0380', '_cell_length_a 5.1'))
+    cif_id = db.add_ciffile(fname, duplicates='reject')
+    assert cif_id == 99143 and db.count_cifs() == ncifs + 1
+    assert db.add_ciffile(fname) == 99143
+    db.delete_cif(cif_id)
+    assert db.add_ciffile(fname, duplicates='reject') == 99143
+
+
+def test_read_cif_block(tmp_path):
+    db = get_amcsd()
+    fname = tmp_path / 'blocks.cif'
+    fname.write_text('\n'.join(cif.ciftext for cif in db.get_cifs([143, 2400, 2762])))
+    assert len(amcsd_utils.index_cif_blocks(fname)) == 3
+    assert [int(read_ciffile(fname, block=i)['cif_id']) for i in (0, 2, -2)] == [143, 2762, 2400]
+    blocks = list(amcsd_utils.iter_cif_blocks(fname))
+    assert blocks[1][1] == amcsd_utils.read_cif_block(fname, 1)
+
+
+def test_export_columnar(tmp_path):
+    db = get_amcsd()
+    assert db.export_columnar(tmp_path / 'columns', batch_size=3000) == db.count_cifs()
+    cols = load_columnar(tmp_path / 'columns')
+    assert isinstance(cols['site_x'], np.memmap)
+    offsets = cols['site_offsets']
+    assert offsets[-1] == len(cols['site_label'])
+    for cif in db.get_cifs([143, 2400, 2762]):
+        i = int(np.searchsorted(cols['id'], cif.ams_id))
+        sites = slice(offsets[i], offsets[i+1])
+        assert cols['id'][i] == cif.ams_id and cols['formula'][i] == cif.formula
+        assert cols['a'][i] == pytest.approx(float(cif.a))
+        assert list(cols['site_label'][sites]) == list(cif.atoms_sites)
+        assert np.allclose(cols['site_z'][sites], [float(z) for z in cif.atoms_z])
+    # columns are written batch by batch, with string widths of all batches
+    assert db.export_columnar(tmp_path / 'columns2', batch_size=500) == len(cols['id'])
+    assert list((tmp_path / 'columns2').glob('*.part')) == []
+    cols2 = load_columnar(tmp_path / 'columns2')
+    for name in ('mineral', 'site_offsets', 'site_label', 'site_x'):
+        assert np.array_equal(cols2[name], cols[name], equal_nan=(name == 'site_x'))
+    if amcsd_utils.pyarrow is not None:
+        assert db.export_columnar(tmp_path / 'amcsd.parquet') == len(cols['id'])
+        pcols = load_columnar(tmp_path / 'amcsd.parquet')
+        for name in ('id', 'site_offsets', 'site_label', 'site_occupancy'):
+            assert np.array_equal(pcols[name], cols[name])
+
+
+def test_export_cifs(tmp_path):
+    db = get_amcsd()
+    cifs = db.get_cifs([143, 2400, 2762])
+    texts = {f'{cif.label}.cif': cif.ciftext for cif in cifs}
+    nout, errors = db.export_cifs([143, 2400, 2762], tmp_path / 'cifs.zip', workers=2)
+    assert nout == 3 and errors == {}
+    with zipfile.ZipFile(tmp_path / 'cifs.zip') as archive:
+        assert {name: archive.read(name).decode('utf-8')
+                for name in archive.namelist()} == texts
+
+    query = dict(mineral_name='hematite')
+    nout, errors = db.export_cifs(query, tmp_path / 'cifs.tar.gz', workers=1, batch_size=2)
+    assert nout == db.count_cifs(**query) and errors == {}
+    with tarfile.open(tmp_path / 'cifs.tar.gz') as archive:
+        names = archive.getnames()
+        assert len(names) == nout and texts[names[0]] == archive.extractfile(
+            names[0]).read().decode('utf-8')
+
+    # max_matches of find_cifs() limits the export
+    nout, errors = db.export_cifs(dict(max_matches=2, **query),
+                                  tmp_path / 'cifs2.zip', workers=1)
+    assert nout == 2 and errors == {}
+    with pytest.raises(ValueError):
+        db.export_cifs(dict(summary=True, **query), tmp_path / 'cifs3.zip')
+
+
+def test_open(tmp_path):
+    dbfile = tmp_path / 'amcsd_open.db'
+    shutil.copy(get_amcsd().dbname, dbfile)
+    conn = sqlite3.connect(dbfile)
+    conn.execute('alter table cif drop column atoms_aniso_u23')
+    conn.commit()
+    conn.close()
+    assert amcsd_utils.isAMCSD(dbfile)
+
+    # missing columns are added, without reconnecting
+    db = AMCSD(dbfile)
+    assert 'atoms_aniso_u23' in db.tables['cif'].columns
+    assert db.get_all('version')[-1].tag == 'with atoms_aniso_u23'
+    assert db.get_cif(143).formula == get_amcsd().get_cif(143).formula
+    db.close()
+
+    # schema is reflected once while the file is unchanged
+    db1 = AMCSD(dbfile, read_only=True)
+    db2 = AMCSD(dbfile, read_only=True)
+    assert db1.metadata is db2.metadata
+
+
+@pytest.mark.skipif(not os.environ.get('LARIXITE_BENCHMARK'),
+                    reason='benchmark: set LARIXITE_BENCHMARK=1 to run')
+def test_open_latency(record_property):
+    "time to open the database in a new process, recorded as cold_open_ms"
+    code = ('import time; from larixite.amcsd import AMCSD; t0 = time.perf_counter(); '
+            f'AMCSD({get_amcsd().dbname!r}); print(time.perf_counter() - t0)')
+    times = []
+    for i in range(5):
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True,
+                             text=True, check=True)
+        times.append(float(out.stdout.split()[-1])*1000)
+    record_property('cold_open_ms', min(times))
+    print(f"cold AMCSD open: {min(times):.1f} ms")
+
+
+_FORKED_DB = None
+
+def _forked_formula(cif_id):
+    return os.getpid(), _FORKED_DB.get_cif(cif_id).formula
+
+
+def test_read_only_fork(tmp_path):
+    global _FORKED_DB
+    dbfile = tmp_path / 'amcsd ro.db'
+    shutil.copy(get_amcsd().dbname, dbfile)
+    db = AMCSD(dbfile, read_only=True, mmap_size=2**24)
+    assert db.execone(text('pragma mmap_size'))[0] == 2**24
+    with pytest.raises(OperationalError):
+        db.session.execute(text('delete from minerals'))
+
+    # forked workers open the database again, without reflecting it
+    _FORKED_DB = db
+    formula = db.get_cif(143).formula
+    ctx = multiprocessing.get_context('fork')
+    with ProcessPoolExecutor(max_workers=2, mp_context=ctx) as pool:
+        results = list(pool.map(_forked_formula, [143]*4))
+    assert all(pid != os.getpid() and val == formula for pid, val in results)
+    assert db.get_cif(2400).formula == get_amcsd().get_cif(2400).formula
+    _FORKED_DB = None
+
+
+def test_threads(tmp_path):
+    dbfile = tmp_path / 'amcsd_threads.db'
+    shutil.copy(get_amcsd().dbname, dbfile)
+    db = AMCSD(dbfile)
+    ids = [143, 2400, 2762, 9000, 10200, 12000]
+    ciftexts = {cif.ams_id: cif.ciftext for cif in db.get_cifs(ids)}
+    hematite = [cif.ams_id for cif in db.find_cifs(mineral_name='hematite')]
+    pub = db.get_cif(143).publication
+    fname = tmp_path / 'new.cif'
+    fname.write_text(ciftexts[143].replace('_database_code_amcsd 143',
+                                           '_database_code_amcsd 99001'))
+
+    def work(i):
+        if i == 0:
+            # single writer, while other threads read
+            return db.add_ciffile(fname) == 99001
+        for cif_id in ids:
+            if db.get_cif(cif_id).ciftext != ciftexts[cif_id]:
+                return False
+        found = [cif.ams_id for cif in db.find_cifs(mineral_name='hematite')]
+        pubs = db.get_publications(journalname=pub.journalname, year=pub.year)
+        return (found[:len(hematite)] == hematite and
+                any(p.id == pub.id and p.authors == pub.authors for p in pubs))
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        results = list(pool.map(work, range(64)))
+    assert all(results)
+    assert db.get_cif(99001).formula == db.get_cif(143).formula
+
+
+def test_async():
+    db = get_amcsd()
+    criteria = dict(contains_elements=['Fe', 'O'], strict_contains=True)
+    expected = [cif.ams_id for cif in db.find_cifs(**criteria)]
+
+    async def search(adb):
+        results = await asyncio.gather(*[adb.find_cifs(**criteria) for i in range(8)],
+                                       adb.get_cifs([143, 2400]),
+                                       adb.count_cifs(**criteria))
+        found = [cif.ams_id async for cif in adb.iter_cifs(batch_size=2, **criteria)]
+
+        # cancelled iteration stops between batches
+        gen = adb.iter_cifs(as_ids=True, batch_size=2, **criteria)
+        first = await gen.__anext__()
+        await gen.aclose()
+        task = asyncio.ensure_future(adb.find_cifs(**criteria))
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return results, found, first
+
+    async def main():
+        async with AsyncAMCSD(db, max_workers=4, max_concurrency=2) as adb:
+            return await search(adb)
+
+    results, found, first = asyncio.run(main())
+    for cifs in results[:8]:
+        assert [cif.ams_id for cif in cifs] == expected
+    assert [cif.ams_id for cif in results[8]] == [143, 2400]
+    assert results[9] == len(expected) and found == expected and first == expected[0]
+
+
+def test_caches(tmp_path):
+    dbfile = tmp_path / 'amcsd_cache.db'
+    shutil.copy(get_amcsd().dbname, dbfile)
+    db = AMCSD(dbfile, cif_cache_size=2, search_cache_size=4)
+    cif = db.get_cif(143)
+    ciftext = cif.ciftext
+    assert db.get_cif(143) is cif
+    db.get_cifs([2400, 2762])
+    assert db.get_cif(143) is not cif       # least recently used, dropped
+    assert db.cache_stats()['cifs'] == dict(hits=1, misses=4, size=2, maxsize=2)
+
+    found = db.find_cifs(mineral_name='Hematite ', contains_elements=['O', 'Fe'])
+    again = db.find_cifs(mineral_name='hematite', contains_elements=['Fe', 'O'])
+    assert again == found and db.cache_stats()['searches']['hits'] == 1
+
+    # updates clear the caches
+    cif = db.get_cif(143)
+    ctab = db.tables['cif']
+    db.update(ctab, whereclause=(ctab.c.id == 143), compound='Elba')
+    assert db.get_cif(143) is not cif and db.get_cif(143).compound == 'Elba'
+    assert db.cache_stats()['searches']['size'] == 0
+    db.find_cifs(mineral_name='hematite')
+    assert db.cache_stats()['searches']['size'] == 1
+
+    # as do changes of the version table by another connection
+    cif = db.get_cif(143)
+    assert db.get_cif(143) is cif and cif.ciftext != ciftext
+    conn = sqlite3.connect(dbfile)
+    conn.execute("insert into version (tag, date, notes) values ('test', '', '')")
+    conn.commit()
+    conn.close()
+    assert db.get_cif(143) is not cif
+    assert db.cache_stats()['searches']['size'] == 0
+
+    # scans, sync or async, do not use the CIF cache
+    stats = db.cache_stats()['cifs']
+    async def scan():
+        async with AsyncAMCSD(db, max_workers=2) as adb:
+            return [cif async for cif in adb.iter_cifs(mineral_name='hematite')]
+    assert len(asyncio.run(scan())) == len(list(db.iter_cifs(mineral_name='hematite'))) > 2
+    assert db.cache_stats()['cifs'] == stats
+
+
+if __name__ == "__main__":
+    test_get_cifs()
+    test_find_cifs_elements()
+    test_find_cifs_wildcard()
+    test_find_cifs_ranges()
+    test_upgrade_v2(Path('.'))
+    test_search_text(Path('.'))
+    test_nearest_cells(Path('.'))
+    test_compositions()
+    test_iter_cifs()
+    test_descriptors(Path('.'))
+    test_decode_farray()
+    test_cifstructure_lazy()
+    test_structure_cache(Path('.'))
+    test_to_structure()
+    test_add_ciffiles(Path('.'))
+    test_sync_directory(Path('.'))
+    test_fingerprints(Path('.'))
+    test_read_cif_block(Path('.'))
+    test_export_columnar(Path('.'))
+    test_export_cifs(Path('.'))
+    test_open(Path('.'))
+    test_read_only_fork(Path('.'))
+    test_threads(Path('.'))
+    test_async()
+    test_caches(Path('.'))
@@ -1,5 +1,7 @@
 from pathlib import Path
-from larixite.struct import get_structure
+from pymatgen.io.cif import CifParser
+from larixite.struct import get_structure, get_cif_structure
+from larixite.amcsd_utils import PMG_CIF_OPTS, index_cif_blocks, iter_cif_blocks
 from larixite.utils import get_logger
 
 logger = get_logger("larixite.test")
@@ -25,5 +27,28 @@ def test_struct():
         assert sg.get_occupancy(s) == occupancy, "Wrong occupancy"
 
 
+def test_cif_blocks(tmp_path):
+    cifs = sorted(structsdir.glob("*.cif"))
+    text = "data_global\n_journal_year 2024\n"
+    for i, cif in enumerate(cifs):
+        # unique block names, as pymatgen keeps only the last of equal names
+        lines = cif.read_text().split("\n")
+        lines = [f"data_block{i}" if l.startswith("data_") else l for l in lines]
+        text = text + "\n".join(lines) + "\n"
+    filepath = tmp_path / "multi_block.cif"
+    filepath.write_text(text)
+
+    blocks = index_cif_blocks(filepath)
+    assert len(blocks) == len(cifs) + 1
+    assert [b[0] for b in blocks] == [name for name, _ in iter_cif_blocks(filepath)]
+    structs = CifParser(filepath, **PMG_CIF_OPTS).parse_structures(primitive=False)
+    assert len(structs) == len(cifs)
+    for frame in (0, len(cifs) - 1, -1):
+        assert get_cif_structure(filepath, frame=frame) == structs[frame]
+    sg = get_structure(filepath, "Zn", frame=len(cifs) - 1)
+    assert sg.struct == structs[-1]
+
+
 if __name__ == "__main__":
     test_struct()
+    test_cif_blocks(Path('.'))